@@ -0,0 +1,71 @@
+"""Compressed archive segments for old messages.
+
+A segment holds up to SEGMENT_ROWS messages of one chat and one month,
+stored column-wise as zlib-compressed JSON: message ids, interned user
+references (users.id), timestamps as integer seconds and texts. Timestamps
+are converted without any timezone math: the hot table stores naive local
+time, and from_epoch(to_epoch(ts)) gives the same wall-clock time back
+(to the second).
+"""
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+SEGMENT_ROWS = 2000
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(timestamp):
+    """ISO timestamp text -> integer seconds since 1970-01-01 (same naive clock)."""
+    return int((datetime.fromisoformat(timestamp) - EPOCH).total_seconds())
+
+
+def from_epoch(seconds):
+    return (EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+def encode_segment(rows):
+    """Packs (message_id, user_ref, epoch_seconds, text) rows into a compressed blob."""
+    ids, users, timestamps, texts = (list(column) for column in zip(*rows))
+    payload = {"ids": ids, "users": users, "ts": timestamps, "text": texts}
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(), 9)
+
+
+def decode_segment(blob):
+    """Returns {message_id: (user_ref, epoch_seconds, text)} for a segment blob."""
+    payload = json.loads(zlib.decompress(blob))
+    return {
+        message_id: (user_ref, timestamp, text)
+        for message_id, user_ref, timestamp, text
+        in zip(payload["ids"], payload["users"], payload["ts"], payload["text"])
+    }
+
+
+def raw_size(row):
+    """Approximate bytes a (id, chat_id, user_id, username, text, timestamp) row takes in the hot table."""
+    _, _, _, username, text, timestamp = row
+    return 24 + len(text.encode()) + len((username or "").encode()) + len(timestamp)
+
+
+class SegmentCache:
+    """Small LRU of decoded segments; segments never change once written."""
+
+    def __init__(self, size=16):
+        self.size = size
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, segment_id, load):
+        with self._lock:
+            segment = self._segments.get(segment_id)
+            if segment is not None:
+                self._segments.move_to_end(segment_id)
+                return segment
+        segment = load(segment_id)
+        with self._lock:
+            self._segments[segment_id] = segment
+            if len(self._segments) > self.size:
+                self._segments.popitem(last=False)
+        return segment
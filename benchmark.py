@@ -0,0 +1,764 @@
+"""Offline benchmarks for the bot's hot paths.
+
+Run from the project directory, e.g.:
+
+    python benchmark.py async-db --messages 200000 --updates 400
+
+Every benchmark works on a throw-away database in a temporary directory and
+never touches bot_data.db.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from broadcast import Broadcaster
+from database import AsyncDatabaseManager, DatabaseManager
+from sharding import ShardedDatabaseManager
+from stub_bot import StubBotAPI
+from timer_wheel import TimerWheel
+from update_queue import decode_update, orjson, plain_group_text
+
+logger = logging.getLogger(__name__)
+
+# --- Helpers ---
+
+WORDS = (
+    "hello memory group birthday cake party photo tomorrow tonight remember "
+    "funny trip summer winter coffee movie game music dinner weekend"
+).split()
+# A long tail of filler words so term frequencies look like real chat text.
+VOCABULARY = WORDS + [f"word{i}" for i in range(5000)]
+
+
+def random_text(rng, words=8):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def populate_messages(manager, chat_ids, per_chat, seed=1, batch=50000, spread_days=0):
+    """Bulk-inserts per_chat synthetic messages for every chat id.
+
+    With spread_days, timestamps are spread over that many days before now
+    (in order); otherwise every message is stamped now.
+    """
+    if hasattr(manager, "shards"):
+        # ShardedDatabaseManager: insert each chat into its own shard.
+        for chat_id in chat_ids:
+            populate_messages(manager.shard(chat_id), [chat_id], per_chat, seed=seed + chat_id, batch=batch,
+                              spread_days=spread_days)
+        return
+    rng = random.Random(seed)
+    now = datetime.now()
+    step = timedelta(days=spread_days) / per_chat
+    with manager.pool.transaction() as conn:
+        for chat_id in chat_ids:
+            remaining = per_chat
+            while remaining:
+                size = min(batch, remaining)
+                conn.executemany(
+                    "INSERT INTO messages (chat_id, user_id, username, text, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(chat_id, rng.randint(1, 50), "user", random_text(rng),
+                      (now - step * (remaining - i)).isoformat())
+                     for i in range(size)],
+                )
+                remaining -= size
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(label, latencies, elapsed, count):
+    print(
+        f"{label:<28} {count / elapsed:10.1f} updates/s   "
+        f"p50 {percentile(latencies, 50) * 1000:8.2f} ms   "
+        f"p99 {percentile(latencies, 99) * 1000:8.2f} ms   "
+        f"max {max(latencies) * 1000:8.2f} ms"
+    )
+
+# --- async-db: blocking vs. executor-backed DB calls ---
+
+async def _simulate_updates(call, updates, slow_every, send_latency):
+    """Fires `updates` concurrent handlers; every slow_every-th one is a /random."""
+    latencies = {"text": [], "/random": []}
+
+    async def handler(i):
+        start = time.perf_counter()
+        if i % slow_every == 0:
+            kind = "/random"
+            await call("get_random_messages", 1)
+        else:
+            kind = "text"
+            await call("store_message", 2, 42, "user", f"message {i}")
+        # Stand-in for the reply/send round trip to Telegram.
+        await asyncio.sleep(send_latency)
+        latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(i) for i in range(updates)))
+    return latencies, time.perf_counter() - start
+
+
+def bench_async_db(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = DatabaseManager(os.path.join(tmp, "bench.db"))
+        populate_messages(manager, [1], args.messages)
+        async_manager = AsyncDatabaseManager(manager)
+
+        async def blocking_call(name, *call_args):
+            # What the handlers did before: call straight into sqlite3.
+            return getattr(manager, name)(*call_args)
+
+        async def executor_call(name, *call_args):
+            return await getattr(async_manager, name)(*call_args)
+
+        print(f"{args.updates} concurrent updates, 1 in {args.slow_every} is /random "
+              f"over {args.messages} messages, {args.send_latency * 1000:.0f} ms send latency")
+        for label, call in (("blocking (before)", blocking_call),
+                            ("db executor (after)", executor_call)):
+            latencies, elapsed = asyncio.run(
+                _simulate_updates(call, args.updates, args.slow_every, args.send_latency)
+            )
+            all_latencies = latencies["text"] + latencies["/random"]
+            summarize(label, all_latencies, elapsed, args.updates)
+            for kind, values in latencies.items():
+                summarize(f"  {kind} updates", values, elapsed, len(values))
+        async_manager.close()
+
+# --- sampling: ORDER BY RANDOM() vs. memory index ---
+
+LEGACY_RANDOM_SQL = """
+    SELECT text, username, timestamp FROM messages
+    WHERE chat_id = ? AND text NOT LIKE '/%'
+    ORDER BY RANDOM() LIMIT ?
+"""
+
+# "On this day" without an index: a date filter over the chat's whole history.
+LEGACY_DAY_SQL = """
+    SELECT text, username, timestamp FROM messages
+    WHERE chat_id = ? AND text NOT LIKE '/%' AND strftime('%m-%d', timestamp) = ?
+      AND timestamp < ?
+    ORDER BY RANDOM() LIMIT 1
+"""
+
+
+def _time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_sampling(args):
+    print(f"{'messages':>10} {'method':<26} {'p50 ms':>10} {'p99 ms':>10}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = DatabaseManager(os.path.join(tmp, "bench.db"), write_behind=False)
+            start = time.perf_counter()
+            # A second chat makes sure lookups stay scoped to one chat_id.
+            populate_messages(manager, [1, 2], size, spread_days=args.years * 365)
+            print(f"{size:>10} {'(populate, 2 chats)':<26} {(time.perf_counter() - start) * 1000:>10.0f}")
+
+            conn = manager.pool.get()
+            legacy_repeat = max(1, min(args.repeat, 10_000_000 // (size * 10) or 1))
+            today = date.today()
+            this_year = f"{today.year}-01-01"
+            cases = (
+                ("ORDER BY RANDOM() limit=1", legacy_repeat,
+                 lambda: conn.execute(LEGACY_RANDOM_SQL, (1, 1)).fetchall()),
+                ("memory index limit=1", args.repeat,
+                 lambda: manager.get_random_messages(1)),
+                ("memory index limit=5", args.repeat,
+                 lambda: manager.get_random_messages(1, limit=5)),
+                ("on this day: strftime scan", legacy_repeat,
+                 lambda: conn.execute(LEGACY_DAY_SQL, (1, f"{today:%m-%d}", this_year)).fetchall()),
+                ("on this day: day index", args.repeat,
+                 lambda: manager.get_day_messages(1, today)),
+            )
+            for label, repeat, fn in cases:
+                timings = _time_calls(fn, repeat)
+                print(f"{size:>10} {label:<26} {percentile(timings, 50) * 1000:>10.3f} "
+                      f"{percentile(timings, 99) * 1000:>10.3f}")
+
+            picks = manager.get_random_messages(1, limit=50)
+            assert len(picks) == 50, "expected 50 memories"
+            if size >= args.years * 365:
+                assert manager.get_day_messages(1, today), "expected an on-this-day memory"
+            manager.close()
+
+# --- broadcast: sequential job loop vs. rate-limited fan-out ---
+
+async def _broadcast_sequential(manager, bot, chat_ids):
+    """The old random_memory_job: one query and one awaited send per chat."""
+    for chat_id in chat_ids:
+        messages = manager.get_random_messages(chat_id)
+        if messages:
+            await bot.send_message(chat_id=chat_id, text=messages[0][0])
+
+
+async def _broadcast_fan_out(manager, bot, args):
+    start = time.perf_counter()
+    memories = manager.get_random_memories()
+    db_elapsed = time.perf_counter() - start
+    broadcaster = Broadcaster(global_rate=args.rate, per_chat_interval=1.0,
+                              concurrency=args.concurrency)
+    stats = await broadcaster.send_all(
+        bot, [(chat_id, memory[0]) for chat_id, memory in memories.items()]
+    )
+    return db_elapsed, stats
+
+
+def bench_broadcast(args):
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubBotAPI(latency=args.latency, global_rate=args.stub_rate, per_chat_interval=1.0) as stub:
+        manager = DatabaseManager(os.path.join(tmp, "bench.db"))
+        chat_ids = [-(1000000 + i) for i in range(args.chats)]
+        populate_messages(manager, chat_ids, args.messages_per_chat)
+
+        async def main():
+            request = HTTPXRequest(connection_pool_size=args.concurrency, pool_timeout=30.0)
+            async with Bot("123:stub", base_url=stub.base_url, request=request) as bot:
+                sample = chat_ids[:args.sequential_sample]
+                start = time.perf_counter()
+                await _broadcast_sequential(manager, bot, sample)
+                sequential = (time.perf_counter() - start) / len(sample)
+
+                limited_before = stub.counters["flood_limited"]
+                start = time.perf_counter()
+                db_elapsed, stats = await _broadcast_fan_out(manager, bot, args)
+                elapsed = time.perf_counter() - start
+                limited = stub.counters["flood_limited"] - limited_before
+
+            print(f"{args.chats} chats, {args.latency * 1000:.0f} ms API latency, "
+                  f"stub flood limit {args.stub_rate}/s, broadcaster rate {args.rate}/s")
+            print(f"sequential (before): {sequential * 1000:8.2f} ms/chat -> "
+                  f"{sequential * args.chats:8.1f} s projected for all chats "
+                  f"(measured on {len(sample)})")
+            print(f"fan-out (after):     {elapsed * 1000 / args.chats:8.2f} ms/chat -> "
+                  f"{elapsed:8.1f} s total, DB pass {db_elapsed * 1000:.0f} ms, "
+                  f"sent {stats['sent']}, failed {stats['failed']}, "
+                  f"retried {stats['retried']}, 429s {limited}")
+
+        asyncio.run(main())
+        manager.close()
+
+# --- search: FTS5 query latency and incremental backfill ---
+
+def bench_search(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = DatabaseManager(os.path.join(tmp, "bench.db"), write_behind=False)
+        start = time.perf_counter()
+        populate_messages(manager, [1, 2], args.messages)
+        print(f"populated 2 chats x {args.messages} messages in {time.perf_counter() - start:.1f} s")
+
+        queries = ("hello", "birthday party", "word42", "word42 word43", "nosuchword")
+        print(f"{'query':<18} {'page':>4} {'results':>7} {'p50 ms':>10} {'p99 ms':>10}")
+        for query in queries:
+            for page in (1, 3):
+                results, _ = manager.search_messages(1, query, page=page)
+                timings = _time_calls(lambda: manager.search_messages(1, query, page=page), args.repeat)
+                print(f"{query:<18} {page:>4} {len(results):>7} "
+                      f"{percentile(timings, 50) * 1000:>10.3f} {percentile(timings, 99) * 1000:>10.3f}")
+
+        # Re-index the whole table the way an upgraded database would.
+        with manager.pool.transaction() as conn:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+            conn.execute("UPDATE bot_state SET value = '1' WHERE key = 'fts_backfill_next'")
+            conn.execute("UPDATE bot_state SET value = (SELECT MAX(id) FROM messages) "
+                         "WHERE key = 'fts_backfill_end'")
+        batches = []
+        start = time.perf_counter()
+        while True:
+            batch_start = time.perf_counter()
+            remaining = manager.backfill_search_index(batch_size=args.batch)
+            batches.append(time.perf_counter() - batch_start)
+            if remaining <= 0:
+                break
+        elapsed = time.perf_counter() - start
+        print(f"backfill of {args.messages * 2} rows: {elapsed:.1f} s in {len(batches)} batches of "
+              f"{args.batch}; write lock held p50 {percentile(batches, 50) * 1000:.1f} ms, "
+              f"max {max(batches) * 1000:.1f} ms per batch")
+        manager.close()
+
+# --- ingest: per-update CPU cost of the webhook fast path ---
+
+def make_updates(count, command_share, seed=1):
+    """Builds raw webhook bodies shaped like real group traffic."""
+    rng = random.Random(seed)
+    users = [
+        {"id": 100000 + i, "is_bot": False, "first_name": f"User{i}",
+         **({"last_name": "Example"} if i % 3 else {}),
+         **({"username": f"user_{i}"} if i % 4 else {}),
+         "language_code": "en"}
+        for i in range(50)
+    ]
+    chats = [{"id": -(1001000000000 + i), "title": f"Group {i}", "type": "supergroup"} for i in range(20)]
+    bodies = []
+    for update_id in range(1, count + 1):
+        chat = rng.choice(chats)
+        message = {
+            "message_id": update_id,
+            "from": rng.choice(users),
+            "chat": chat,
+            "date": 1700000000 + update_id,
+        }
+        if rng.random() < command_share:
+            message["text"] = rng.choice(("/random", "/debug", "/search hello", "/view_birthdays"))
+            message["entities"] = [{"offset": 0, "length": len(message["text"].split()[0]),
+                                    "type": "bot_command"}]
+        else:
+            message["text"] = random_text(rng, rng.randint(3, 25))
+            if rng.random() < 0.2:
+                message["reply_to_message"] = {
+                    "message_id": max(1, update_id - rng.randint(1, 50)),
+                    "from": rng.choice(users), "chat": chat,
+                    "date": 1700000000 + update_id - 60, "text": random_text(rng),
+                }
+            if rng.random() < 0.1:
+                message["entities"] = [{"offset": 0, "length": 5, "type": "url"}]
+        bodies.append(json.dumps({"update_id": update_id, "message": message}).encode())
+    return bodies
+
+
+def _ingest_application(stub, db, new_messages_only=False):
+    """Mirrors the bot's handlers; new_messages_only uses its narrowed filters (else the old ones)."""
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+    async def command(update, context):
+        pass
+
+    async def collect(update, context):
+        # Mirrors collect_message for the text it stores.
+        message = update.message
+        if message and message.text and update.effective_chat.type in ("group", "supergroup") \
+                and not message.text.startswith("/"):
+            user = update.effective_user
+            await db.store_message(update.effective_chat.id, user.id, user.username or user.full_name,
+                                   message.text, message.message_id)
+
+    application = Application.builder().token("123:stub").base_url(stub.base_url).build()
+    new = filters.UpdateType.MESSAGE
+    for name in ("start", "debug", "set_birthday", "view_birthdays", "set_timezone", "random", "search"):
+        application.add_handler(CommandHandler(name, command, filters=new if new_messages_only else None))
+    collect_filter = new & filters.TEXT & ~filters.COMMAND if new_messages_only else filters.ALL
+    application.add_handler(MessageHandler(collect_filter, collect))
+    return application
+
+
+def bench_ingest(args):
+    from telegram import Update
+
+    bodies = make_updates(args.updates, args.command_share)
+    print(f"{len(bodies)} updates, {args.command_share:.0%} commands, "
+          f"avg body {sum(map(len, bodies)) / len(bodies):.0f} bytes, "
+          f"decoder {'orjson' if orjson is not None else 'json'}")
+
+    with tempfile.TemporaryDirectory() as tmp, StubBotAPI() as stub:
+        manager = DatabaseManager(os.path.join(tmp, "bench.db"))
+        db = AsyncDatabaseManager(manager)
+        application = _ingest_application(stub, db)
+
+        async def full(body):
+            update_data = json.loads(body)
+            await application.process_update(Update.de_json(update_data, application.bot))
+
+        async def fast(body):
+            update_data = decode_update(body)
+            fields = plain_group_text(update_data)
+            if fields is not None:
+                manager.store_message(*fields)
+            else:
+                await application.process_update(Update.de_json(update_data, application.bot))
+
+        async def run(label, handle):
+            await asyncio.to_thread(manager.flush_messages)
+            cpu, wall = time.process_time(), time.perf_counter()
+            for body in bodies:
+                await handle(body)
+            await asyncio.to_thread(manager.flush_messages)
+            cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+            print(f"{label:<28} {cpu / len(bodies) * 1e6:8.1f} us CPU/update   "
+                  f"{len(bodies) / wall:10.0f} updates/s")
+            return cpu
+
+        def parts():
+            # Per-stage cost, without storing anything.
+            for label, fn in (
+                ("  json.loads", lambda: [json.loads(b) for b in bodies]),
+                ("  decode_update", lambda: [decode_update(b) for b in bodies]),
+                ("  Update.de_json", lambda: [Update.de_json(json.loads(b), application.bot)
+                                              for b in bodies]),
+                ("  decode + plain_group_text", lambda: [plain_group_text(decode_update(b)) for b in bodies]),
+            ):
+                start = time.process_time()
+                fn()
+                print(f"{label:<28} {(time.process_time() - start) / len(bodies) * 1e6:8.1f} us CPU/update")
+
+        async def main():
+            async with application:
+                before = await run("full PTB path (before)", full)
+                after = await run("fast path (after)", fast)
+                print(f"speedup: {before / after:.1f}x CPU per update")
+                parts()
+
+        asyncio.run(main())
+        stored = manager.pool.get().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        print(f"stored {stored} messages ({stored // 2} per run)")
+        db.close()
+
+# --- webhook: traffic with Telegram's default update types vs. allowed_updates ---
+
+def make_mixed_updates(count, edit_share, media_share, member_share, seed=1):
+    """make_updates traffic with some updates turned into edits, media and bot membership changes."""
+    rng = random.Random(seed)
+    bodies = []
+    for body in make_updates(count, 0.05, seed):
+        update = json.loads(body)
+        message = update["message"]
+        roll = rng.random()
+        if roll < edit_share:
+            message["edit_date"] = message["date"] + 30
+            update = {"update_id": update["update_id"], "edited_message": message}
+        elif roll < edit_share + media_share:
+            del message["text"]
+            message.pop("entities", None)
+            message["photo"] = [{"file_id": f"photo{update['update_id']}", "file_unique_id": "u",
+                                 "width": 640, "height": 480}]
+        elif roll < edit_share + media_share + member_share:
+            member = {"user": {"id": 1, "is_bot": True, "first_name": "Bot"}, "status": "member"}
+            update = {"update_id": update["update_id"], "my_chat_member": {
+                "chat": message["chat"], "from": message["from"], "date": message["date"],
+                "old_chat_member": {**member, "status": "left"}, "new_chat_member": member,
+            }}
+        bodies.append(json.dumps(update).encode())
+    return bodies
+
+
+def bench_webhook(args):
+    from telegram import Update
+
+    from webhook_manager import allowed_updates
+
+    bodies = make_mixed_updates(args.updates, args.edit_share, args.media_share, args.member_share)
+    kinds = [next(key for key in json.loads(body) if key != "update_id") for body in bodies]
+    counts = ", ".join(f"{kind} {kinds.count(kind)}" for kind in sorted(set(kinds)))
+    print(f"{len(bodies)} updates Telegram has for the bot: {counts}")
+
+    # Telegram's default when allowed_updates was never set: all but chat_member.
+    default = [str(t) for t in Update.ALL_TYPES if t != Update.CHAT_MEMBER]
+
+    async def run(label, stub, path, new_messages_only, allowed=None):
+        # A fresh database per run: a second run would only hit INSERT OR IGNORE duplicates.
+        manager = DatabaseManager(path)
+        db = AsyncDatabaseManager(manager)
+        application = _ingest_application(stub, db, new_messages_only)
+        allowed = allowed or allowed_updates(application)
+        delivered = [body for body, kind in zip(bodies, kinds) if kind in allowed]
+        async with application:
+            cpu = time.process_time()
+            for body in delivered:
+                # accept_update: fast path for plain group text, PTB for the rest.
+                update_data = decode_update(body)
+                fields = plain_group_text(update_data)
+                if fields is not None:
+                    manager.store_message(*fields)
+                else:
+                    await application.process_update(Update.de_json(update_data, application.bot))
+            await asyncio.to_thread(manager.flush_messages)
+            cpu = time.process_time() - cpu
+        await asyncio.to_thread(db.close)
+        print(f"{label:<34} {len(delivered):>7} requests {sum(map(len, delivered)) / 1e6:7.2f} MB "
+              f"{cpu * 1000:9.0f} ms CPU   allowed_updates={'default' if allowed is default else allowed}")
+        return cpu
+
+    async def main(tmp, stub):
+        before = await run("default update types, filters.ALL", stub, os.path.join(tmp, "before.db"),
+                           False, default)
+        after = await run("allowed_updates, narrowed filters", stub, os.path.join(tmp, "after.db"), True)
+        print(f"CPU: {before / after:.2f}x less with allowed_updates")
+
+    with tempfile.TemporaryDirectory() as tmp, StubBotAPI() as stub:
+        asyncio.run(main(tmp, stub))
+
+# --- shards: concurrent multi-chat write throughput by shard count ---
+
+def _write_load(manager, writers, per_writer, chats, seed):
+    """Stores per_writer messages from each of `writers` threads; returns (elapsed, latencies)."""
+    import threading
+
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(writers + 1)
+
+    def writer(n):
+        rng = random.Random(seed + n)
+        texts = [random_text(rng) for _ in range(100)]
+        timings = []
+        barrier.wait()
+        for i in range(per_writer):
+            chat_id = -(1000000 + rng.randrange(chats))
+            start = time.perf_counter()
+            manager.store_message(chat_id, n, f"user{n}", texts[i % 100])
+            timings.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(timings)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    manager.flush_messages()
+    return time.perf_counter() - start, latencies
+
+
+def bench_shards(args):
+    print(f"{args.writers} writer threads x {args.messages} messages over {args.chats} chats "
+          f"({os.cpu_count()} CPUs)")
+    print(f"{'mode':<10} {'shards':>6} {'msgs/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for write_behind in (True, False):
+        mode = "buffered" if write_behind else "direct"
+        for shards in args.shards:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "bench.db")
+                manager = (DatabaseManager(path, write_behind=write_behind) if shards == 1
+                           else ShardedDatabaseManager(path, shards, write_behind=write_behind))
+                elapsed, latencies = _write_load(manager, args.writers, args.messages, args.chats, args.seed)
+                total = args.writers * args.messages
+                stored = manager.archive_report()["hot_messages"]
+                manager.close()
+            if stored != total:
+                print(f"warning: stored {stored} of {total} messages")
+            print(f"{mode:<10} {shards:>6} {total / elapsed:>10.0f} "
+                  f"{percentile(latencies, 50) * 1000:>9.3f} {percentile(latencies, 99) * 1000:>9.3f} "
+                  f"{max(latencies) * 1000:>9.1f}")
+
+# --- schedule: one 6-hourly run for all chats vs. the staggered timer wheel ---
+
+def _simulate_sends(due_by_second, rate, seconds):
+    """Drains due chats through a `rate`/s send limit; returns (sends per second, delays)."""
+    queue, sends, delays = [], [0] * seconds, []
+    head = 0
+    for second in range(seconds):
+        queue.extend([second] * due_by_second.get(second, 0))
+        sent = min(rate, len(queue) - head)
+        for due in queue[head:head + sent]:
+            delays.append(second - due)
+        head += sent
+        sends[second] = sent
+    return sends, delays
+
+
+def bench_schedule(args):
+    day = 86400
+    interval = args.interval_hours * 3600
+    chat_ids = [-(1000000 + i) for i in range(args.chats)]
+
+    # Before: a run_repeating job picks and sends for every chat at each run.
+    before = {start: args.chats for start in range(9 * 3600 % interval, day, interval)}
+    # After: each tick releases the chats whose hashed slot it passed.
+    wheel = TimerWheel(interval, args.tick)
+    wheel.sync(chat_ids, default_tz="UTC")
+    after = {}
+    for tick in range(0, day, args.tick):
+        due = len(wheel.due(tick, tick + args.tick))
+        if due:
+            after[tick] = due
+    assert sum(after.values()) == sum(before.values()), "both schedules must send the same memories"
+
+    slots = [len(slot) for slot in wheel.slots]
+    print(f"{args.chats} chats, one memory per chat every {args.interval_hours} h, "
+          f"{args.rate} sends/s limit, {args.tick} s ticks ({len(slots)} slots, "
+          f"{min(slots)}-{max(slots)} chats per slot)")
+    print(f"{'schedule':<16} {'peak picks/min':>15} {'peak sends/s':>13} {'busy min/day':>13} "
+          f"{'p50 delay s':>12} {'max delay s':>12}")
+    for label, due_by_second in (("6-hourly job", before), ("timer wheel", after)):
+        sends, delays = _simulate_sends(due_by_second, args.rate, day + interval)
+        per_minute = {}
+        for second, count in due_by_second.items():
+            per_minute[second // 60] = per_minute.get(second // 60, 0) + count
+        busy_minutes = len({second // 60 for second, sent in enumerate(sends) if sent})
+        print(f"{label:<16} {max(per_minute.values()):>15} {max(sends):>13} {busy_minutes:>13} "
+              f"{percentile(delays, 50):>12.0f} {max(delays):>12.0f}")
+
+    # The DB side of one run: picking memories for all chats vs. one tick's batch.
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = DatabaseManager(os.path.join(tmp, "bench.db"), write_behind=False)
+        populate_messages(manager, chat_ids, args.messages)
+        batch = sorted(wheel.slots[0]) or chat_ids[:1]
+        for label, chats in (("6-hourly job", chat_ids), ("timer wheel", batch)):
+            timings = _time_calls(lambda: manager.get_random_memories(chats), 5)
+            print(f"{label:<16} memory picks per run: {len(chats):>6} chats in "
+                  f"{percentile(timings, 50) * 1000:8.1f} ms")
+        manager.close()
+
+# --- startup: WSGI worker cold start, eager vs. lazy bootstrap ---
+
+# Runs in a fresh interpreter, like a WSGI worker that was just (re)started.
+STARTUP_WORKER = """
+import json, sys, time
+started = time.perf_counter()
+import webhook_handler as wh
+imported = time.perf_counter()
+body = json.dumps({"update_id": 1, "message": {
+    "message_id": 1, "date": 1700000000, "text": "hello",
+    "chat": {"id": -1001, "type": "supergroup"}, "from": {"id": 7, "is_bot": False, "first_name": "A"}}})
+status = wh.app.test_client().post(wh.WEBHOOK_PATH, data=body, content_type="application/json").status_code
+acked = time.perf_counter()
+wh.bot_ready.wait()
+while not wh.application.running:
+    time.sleep(0.005)
+ready = time.perf_counter()
+print(json.dumps({
+    "import": imported - started, "first_ack": acked - started, "ready": ready - started,
+    "acked_at": time.time() - (time.perf_counter() - acked), "status": status,
+    "job_runner": wh.is_job_runner, "job_queue": wh.application.job_queue is not None,
+}), flush=True)
+if "--hold" in sys.argv:
+    sys.stdin.read()  # keep the job lock until the benchmark has started every worker
+"""
+
+
+def _start_worker(env, hold=False):
+    return subprocess.Popen(
+        [sys.executable, "-c", STARTUP_WORKER, *(["--hold"] if hold else [])],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+
+
+def bench_startup(args):
+    with tempfile.TemporaryDirectory() as tmp, StubBotAPI() as stub:
+        db_path = os.path.join(tmp, "bench.db")
+        manager = DatabaseManager(db_path, write_behind=False)
+        populate_messages(manager, [-(1001000000000 + i) for i in range(20)], args.messages // 20)
+        manager.close()
+        base_env = dict(os.environ, BOT_DB_PATH=db_path, BOT_API_BASE_URL=stub.base_url)
+
+        print(f"{args.runs} cold starts per mode, {args.messages} stored messages; seconds, median (max); "
+              f"the last three count from the first line of the worker script")
+        print(f"{'mode':<8} {'spawn to ack':>14} {'import':>14} {'first ack':>14} {'PTB ready':>14}")
+        for mode, lazy in (("eager", "0"), ("lazy", "1")):
+            env = dict(base_env, BOT_LAZY_BOOTSTRAP=lazy)
+            runs = []
+            for _ in range(args.runs):
+                spawned = time.time()
+                worker = _start_worker(env)
+                result = json.loads(worker.communicate()[0].splitlines()[-1])
+                # Includes interpreter start-up, which the worker's own clock misses.
+                result["spawn_to_ack"] = result["acked_at"] - spawned
+                runs.append(result)
+            cells = [f"{percentile([r[key] for r in runs], 50):6.3f} ({max(r[key] for r in runs):5.3f})"
+                     for key in ("spawn_to_ack", "import", "first_ack", "ready")]
+            print(f"{mode:<8} " + " ".join(f"{cell:>14}" for cell in cells))
+
+        # Several workers started together: only one may run the scheduled jobs.
+        env = dict(base_env, BOT_LAZY_BOOTSTRAP="1")
+        workers = [_start_worker(env, hold=True) for _ in range(args.workers)]
+        results = [json.loads(worker.stdout.readline()) for worker in workers]
+        for worker in workers:
+            worker.communicate("")
+        runners = sum(r["job_runner"] for r in results)
+        queues = sum(r["job_queue"] for r in results)
+        print(f"{args.workers} concurrent workers: {runners} job runner, {queues} JobQueue "
+              f"(each worker ran its own before)")
+
+# --- CLI ---
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = subparsers.add_parser("async-db", help="Event-loop throughput with blocking vs. async DB calls.")
+    p.add_argument("--messages", type=int, default=200000, help="History size of the /random chat.")
+    p.add_argument("--updates", type=int, default=400, help="Number of concurrent updates.")
+    p.add_argument("--slow-every", type=int, default=20, help="Every Nth update is a /random.")
+    p.add_argument("--send-latency", type=float, default=0.05, help="Simulated Telegram send time (s).")
+    p.set_defaults(func=bench_async_db)
+
+    p = subparsers.add_parser("sampling", help="Random and on-this-day memory pick latency by history size.")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000],
+                   help="Messages per chat to benchmark.")
+    p.add_argument("--repeat", type=int, default=200, help="Samples per method.")
+    p.add_argument("--years", type=int, default=5, help="Years of history the messages are spread over.")
+    p.set_defaults(func=bench_sampling)
+
+    p = subparsers.add_parser("broadcast", help="random_memory_job fan-out against a local Bot API stub.")
+    p.add_argument("--chats", type=int, default=10_000, help="Number of chats to broadcast to.")
+    p.add_argument("--messages-per-chat", type=int, default=5)
+    p.add_argument("--latency", type=float, default=0.02, help="Stub Bot API latency (s).")
+    p.add_argument("--rate", type=float, default=900.0, help="Broadcaster global rate (msg/s).")
+    p.add_argument("--stub-rate", type=float, default=1000.0, help="Stub flood limit (msg/s).")
+    p.add_argument("--concurrency", type=int, default=32, help="Sends in flight / HTTP pool size.")
+    p.add_argument("--sequential-sample", type=int, default=200,
+                   help="Chats used to measure the sequential loop.")
+    p.set_defaults(func=bench_broadcast)
+
+    p = subparsers.add_parser("search", help="/search latency and search index backfill.")
+    p.add_argument("--messages", type=int, default=2_000_000, help="Messages per chat.")
+    p.add_argument("--repeat", type=int, default=50, help="Runs per query.")
+    p.add_argument("--batch", type=int, default=2000, help="Backfill batch size.")
+    p.set_defaults(func=bench_search)
+
+    p = subparsers.add_parser("ingest", help="Per-update CPU cost of webhook decoding and dispatch.")
+    p.add_argument("--updates", type=int, default=20000, help="Number of webhook bodies.")
+    p.add_argument("--command-share", type=float, default=0.05, help="Fraction of updates that are commands.")
+    p.set_defaults(func=bench_ingest)
+
+    p = subparsers.add_parser("webhook", help="Webhook requests and CPU: default vs. own allowed_updates.")
+    p.add_argument("--updates", type=int, default=20000, help="Updates Telegram has for the bot.")
+    p.add_argument("--edit-share", type=float, default=0.15, help="Fraction that are message edits.")
+    p.add_argument("--media-share", type=float, default=0.2, help="Fraction that are photos (no text).")
+    p.add_argument("--member-share", type=float, default=0.01, help="Fraction that are my_chat_member.")
+    p.set_defaults(func=bench_webhook)
+
+    p = subparsers.add_parser("shards", help="Concurrent multi-chat write throughput by shard count.")
+    p.add_argument("--shards", type=int, nargs="+", default=[1, 4, 16], help="Shard counts to compare.")
+    p.add_argument("--writers", type=int, default=16, help="Concurrent writer threads.")
+    p.add_argument("--messages", type=int, default=2000, help="Messages per writer.")
+    p.add_argument("--chats", type=int, default=500, help="Distinct chats written to.")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_shards)
+
+    p = subparsers.add_parser(
+        "schedule", help="Peak load of the memory broadcast: 6-hourly job vs. timer wheel."
+    )
+    p.add_argument("--chats", type=int, default=10000, help="Chats receiving memories.")
+    p.add_argument("--interval-hours", type=int, default=6, help="Hours between two memories of one chat.")
+    p.add_argument("--tick", type=int, default=60, help="Timer wheel tick in seconds.")
+    p.add_argument("--rate", type=int, default=25, help="Global sends per second (BROADCAST_RATE).")
+    p.add_argument("--messages", type=int, default=50, help="Stored messages per chat for the DB timing.")
+    p.set_defaults(func=bench_schedule)
+
+    p = subparsers.add_parser("startup", help="WSGI worker cold start: eager vs. lazy bootstrap.")
+    p.add_argument("--runs", type=int, default=5, help="Cold starts per mode.")
+    p.add_argument("--messages", type=int, default=100000, help="Messages in the bot database.")
+    p.add_argument("--workers", type=int, default=4, help="Workers started at once for the job-runner check.")
+    p.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import calendar
+import logging
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+
+def birthday_dates(day):
+    """Returns the (month, day) birthdays celebrated on a calendar date.
+
+    Feb 29 birthdays are celebrated on Feb 28 in non-leap years.
+    """
+    dates = [(day.month, day.day)]
+    if (day.month, day.day) == (2, 28) and not calendar.isleap(day.year):
+        dates.append((2, 29))
+    return dates
+
+
+class BirthdayCalendar:
+    """In-memory index of all birthdays, keyed by (month, day) and by chat.
+
+    DatabaseManager loads it once and patches it on every store_birthday, so
+    the reminder job and /view_birthdays never query the birthdays table.
+    `version` mirrors the birthdays_version counter in bot_state, which lets
+    the manager notice writes made by other processes and reload.
+    Rendered /view_birthdays texts are cached per chat until that chat changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self._by_date = {}       # (month, day) -> {chat_id: {user_id: name}}
+        self._by_chat = {}       # chat_id -> {user_id: (month, day, name)}
+        self._chat_of_user = {}  # user_id -> chat_id (a user has one birthday)
+        self._timezones = {}     # chat_id -> IANA timezone name
+        self._rendered = {}      # chat_id -> cached /view_birthdays text
+
+    def load(self, version, birthdays, timezones):
+        """Replaces the whole index with (chat_id, user_id, name, day, month) rows."""
+        with self._lock:
+            self._by_date.clear()
+            self._by_chat.clear()
+            self._chat_of_user.clear()
+            self._rendered.clear()
+            self._timezones = dict(timezones)
+            for chat_id, user_id, name, day, month in birthdays:
+                self._add(chat_id, user_id, name, day, month)
+            self.version = version
+        logger.info(f"Birthday calendar loaded: {len(birthdays)} birthdays, version {version}")
+
+    def upsert(self, version, chat_id, user_id, name, day, month):
+        """Applies a stored birthday (a user's previous entry is replaced)."""
+        with self._lock:
+            self._remove(user_id)
+            self._add(chat_id, user_id, name, day, month)
+            self.version = version
+
+    def set_timezone(self, version, chat_id, tz_name):
+        with self._lock:
+            self._timezones[chat_id] = tz_name
+            self.version = version
+
+    def _add(self, chat_id, user_id, name, day, month):
+        self._by_date.setdefault((month, day), {}).setdefault(chat_id, {})[user_id] = name
+        self._by_chat.setdefault(chat_id, {})[user_id] = (month, day, name)
+        self._chat_of_user[user_id] = chat_id
+        self._rendered.pop(chat_id, None)
+
+    def _remove(self, user_id):
+        chat_id = self._chat_of_user.pop(user_id, None)
+        if chat_id is None:
+            return
+        month, day, _ = self._by_chat[chat_id].pop(user_id)
+        people = self._by_date[(month, day)][chat_id]
+        del people[user_id]
+        if not people:
+            del self._by_date[(month, day)][chat_id]
+        self._rendered.pop(chat_id, None)
+
+    # --- Lookups ---
+
+    def list_for_chat(self, chat_id):
+        """Returns (name, day, month) for a chat, ordered by month and day."""
+        with self._lock:
+            people = self._by_chat.get(chat_id, {})
+            return sorted(((name, day, month) for month, day, name in people.values()),
+                          key=lambda b: (b[2], b[1]))
+
+    def on_date(self, month, day):
+        """Returns (chat_id, name) pairs for every chat's birthdays on one date."""
+        with self._lock:
+            return [(chat_id, name)
+                    for chat_id, people in self._by_date.get((month, day), {}).items()
+                    for name in people.values()]
+
+    def timezones(self):
+        """Returns {chat_id: IANA timezone name} for the chats that set one."""
+        with self._lock:
+            return dict(self._timezones)
+
+    def render(self, chat_id, render):
+        """Returns render(list_for_chat(chat_id)), cached until the chat's birthdays change."""
+        with self._lock:
+            text = self._rendered.get(chat_id)
+            if text is None:
+                text = render(self.list_for_chat(chat_id))
+                self._rendered[chat_id] = text
+            return text
+
+    def due(self, now, hour, default_tz=None):
+        """Returns [(chat_id, [names])] whose local time is `hour` o'clock at `now`.
+
+        Chats without a timezone use default_tz (None = the server's local time).
+        Each chat is due exactly once per local day, in that day's `hour`.
+        """
+        if now.tzinfo is None:
+            now = now.astimezone()
+        with self._lock:
+            # Local date for every timezone that is at the reminder hour right now.
+            due_dates = {}
+            for tz_name in set(self._timezones.values()) | {None}:
+                local = now.astimezone(self._zone(tz_name or default_tz))
+                if local.hour == hour:
+                    due_dates[tz_name] = birthday_dates(local.date())
+
+            result = {}
+            for tz_name, dates in due_dates.items():
+                for month, day in dates:
+                    for chat_id, people in self._by_date.get((month, day), {}).items():
+                        if self._timezones.get(chat_id) == tz_name:
+                            result.setdefault(chat_id, []).extend(people.values())
+            return list(result.items())
+
+    @staticmethod
+    def _zone(tz_name):
+        if tz_name is None:
+            return datetime.now().astimezone().tzinfo
+        try:
+            return ZoneInfo(tz_name)
+        except Exception:
+            logger.error(f"Unknown timezone {tz_name!r}, using UTC")
+            return timezone.utc
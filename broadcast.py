@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Async token bucket: at most `rate` acquisitions per second, bursting to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Blocks all acquisitions for `seconds` (used for Telegram's retry_after)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out first come, first served.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster:
+    """Sends one message to many chats concurrently within Telegram's limits.
+
+    Sends share a global rate limit (global_rate messages/s) and keep at
+    least per_chat_interval seconds between two messages to the same chat;
+    at most `concurrency` requests are in flight. A 429 pauses the global
+    limiter for its retry_after before the message is retried; network
+    errors are retried with backoff; chats that removed the bot are skipped.
+    """
+
+    def __init__(self, global_rate=25.0, per_chat_interval=1.0, concurrency=16, max_retries=3):
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._limiter = None
+        self._next_by_chat = {}
+
+    async def send_all(self, bot, messages, **send_kwargs):
+        """Sends (chat_id, text) pairs; returns counters for sent/failed/retried messages."""
+        if self._limiter is None:
+            self._limiter = RateLimiter(self.global_rate)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        stats = {"sent": 0, "failed": 0, "retried": 0}
+        start = time.monotonic()
+
+        async def send(chat_id, text):
+            async with semaphore:
+                await self._send(bot, chat_id, text, send_kwargs, stats)
+
+        await asyncio.gather(*(send(chat_id, text) for chat_id, text in messages))
+        stats["elapsed"] = time.monotonic() - start
+        self._forget_idle_chats()
+        return stats
+
+    async def _send(self, bot, chat_id, text, send_kwargs, stats):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self._limiter.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **send_kwargs)
+                stats["sent"] += 1
+                return
+            except RetryAfter as e:
+                logger.error(f"Flood limit hit sending to {chat_id}, retrying in {e.retry_after}s")
+                self._limiter.pause(e.retry_after)
+                self._next_by_chat[chat_id] = time.monotonic() + e.retry_after
+            except (Forbidden, BadRequest) as e:
+                # The bot was removed or the chat is gone; retrying will not help.
+                logger.error(f"Skipping chat {chat_id}: {e}")
+                break
+            except NetworkError as e:
+                logger.error(f"Network error sending to {chat_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            if attempt < self.max_retries:
+                stats["retried"] += 1
+        stats["failed"] += 1
+
+    async def _wait_for_chat(self, chat_id):
+        now = time.monotonic()
+        ready_at = self._next_by_chat.get(chat_id, 0.0)
+        self._next_by_chat[chat_id] = max(now, ready_at) + self.per_chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        for chat_id in [c for c, ready_at in self._next_by_chat.items() if ready_at <= now]:
+            del self._next_by_chat[chat_id]
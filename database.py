@@ -0,0 +1,1292 @@
+import os
+import asyncio
+import functools
+import logging
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import archive
+import metrics
+import migrations
+from birthdays import BirthdayCalendar
+
+logger = logging.getLogger(__name__)
+
+# --- Connection Manager ---
+
+class ConnectionManager:
+    """Keeps one long-lived, tuned SQLite connection per thread."""
+
+    # Applied once when a connection is opened, never per statement.
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-8192",      # ~8 MiB page cache (negative = KiB)
+        "PRAGMA mmap_size=67108864",    # 64 MiB memory-mapped reads
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA busy_timeout=5000",
+    )
+
+    def __init__(self, db_path, cached_statements=128):
+        self.db_path = db_path
+        # sqlite3 keeps a per-connection LRU of prepared statements keyed by
+        # the SQL text, so reusing the same connection reuses the statements.
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._closed = False
+
+    def get(self):
+        """Returns the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+        return conn
+
+    def _open(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection manager has been closed.")
+
+        # check_same_thread is off only so close() can tear every connection
+        # down from the shutdown thread; each connection is otherwise used
+        # exclusively by the thread that opened it.
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=5.0,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+
+        ident = threading.get_ident()
+        with self._lock:
+            # Thread idents are recycled, so close whatever a dead thread left.
+            stale = self._connections.pop(ident, None)
+            self._connections[ident] = conn
+        if stale is not None:
+            stale.close()
+
+        self._local.conn = conn
+        logger.info(f"Opened SQLite connection to {self.db_path} for thread {ident}")
+        return conn
+
+    def discard(self):
+        """Closes the calling thread's connection so the next call reconnects."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if self._connections.get(threading.get_ident()) is conn:
+                del self._connections[threading.get_ident()]
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def transaction(self):
+        """Yields the thread's connection inside a transaction (commit or rollback)."""
+        conn = self.get()
+        try:
+            with conn:
+                yield conn
+        except sqlite3.IntegrityError:
+            raise
+        except (sqlite3.OperationalError, sqlite3.DatabaseError,
+                sqlite3.ProgrammingError, sqlite3.InterfaceError):
+            # The connection may be broken (disk error, closed handle, ...);
+            # drop it so the next call starts from a fresh one.
+            self.discard()
+            raise
+
+    def close(self):
+        """Closes every connection handed out. Further use raises an error."""
+        with self._lock:
+            self._closed = True
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing SQLite connection: {e}")
+        logger.info(f"Closed {len(connections)} SQLite connection(s) to {self.db_path}")
+
+# --- Write-Behind Message Buffer ---
+
+# OR IGNORE: a Telegram message id that is already stored (webhook retry,
+# overlapping import) is skipped instead of failing the whole batch.
+INSERT_MESSAGE_SQL = """
+    INSERT OR IGNORE INTO messages (chat_id, user_id, username, text, timestamp, message_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+class MessageBuffer:
+    """Queues incoming messages and group-commits them from a background thread.
+
+    Rows are written with a single executemany() per transaction once
+    max_batch rows are waiting or the oldest row has waited flush_interval
+    seconds, whichever comes first. When max_pending rows are queued the
+    producer flushes inline instead of growing the queue further.
+    """
+
+    def __init__(self, pool, max_batch=500, flush_interval=0.2, max_pending=10000):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._first_enqueued = 0.0
+        self._closed = False
+        self._cond = threading.Condition()
+        # Serializes batches so rows are committed in the order they arrived.
+        self._flush_lock = threading.Lock()
+        self._counters = {
+            "enqueued": 0,
+            "flushed_rows": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "dropped": 0,
+            "inline_flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="message-flusher", daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        """Queues one message row for the next group commit."""
+        with self._cond:
+            if not self._pending:
+                self._first_enqueued = time.monotonic()
+                self._cond.notify()
+            self._pending.append(row)
+            self._counters["enqueued"] += 1
+            depth = len(self._pending)
+            if depth == self.max_batch:
+                self._cond.notify()
+            closed = self._closed
+
+        if depth >= self.max_pending or closed:
+            # Backpressure: the producer pays for the write rather than
+            # letting the queue grow without bound.
+            with self._cond:
+                self._counters["inline_flushes"] += 1
+            self.flush()
+
+    def flush(self):
+        """Writes every row queued so far. Returns False if the write failed."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if batch:
+                return self._write(batch)
+            return True
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            with self.pool.transaction() as conn:
+                conn.executemany(INSERT_MESSAGE_SQL, batch)
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} buffered messages: {e}")
+            with self._cond:
+                self._counters["failed_flushes"] += 1
+                # Put the batch back in front of newer rows if there is room,
+                # otherwise drop it rather than exceed the memory bound.
+                if len(batch) + len(self._pending) <= self.max_pending:
+                    self._pending[:0] = batch
+                    self._first_enqueued = time.monotonic()
+                else:
+                    self._counters["dropped"] += len(batch)
+            return False
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._cond:
+            counters = self._counters
+            counters["flushed_rows"] += len(batch)
+            counters["flushes"] += 1
+            counters["last_flush_ms"] = elapsed_ms
+            counters["max_flush_ms"] = max(counters["max_flush_ms"], elapsed_ms)
+            counters["total_flush_ms"] += elapsed_ms
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and len(self._pending) < self.max_batch:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    remaining = self._first_enqueued + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            if not self.flush():
+                # Back off instead of spinning on a failing database.
+                time.sleep(self.flush_interval)
+
+    def stats(self):
+        """Returns queue depth and flush counters/latencies."""
+        with self._cond:
+            stats = dict(self._counters)
+            stats["queue_depth"] = len(self._pending)
+        flushes = stats["flushes"]
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / flushes if flushes else 0.0
+        return stats
+
+    def close(self):
+        """Stops the flusher thread and writes whatever is still queued."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+# --- Hot Queries ---
+
+# Kept as constants so every call reuses the same cached prepared statement
+# and so check_query_plans() verifies exactly what the bot runs.
+
+# Loose index scan: one index seek per chat instead of reading every row.
+# Reads memory_index, which keeps entries for archived messages, so chats
+# whose history is entirely archived still get memories.
+CHAT_IDS_SQL = """
+    WITH RECURSIVE chats(chat_id) AS (
+        SELECT MIN(chat_id) FROM memory_index
+        UNION ALL
+        SELECT (SELECT MIN(chat_id) FROM memory_index WHERE chat_id > chats.chat_id)
+        FROM chats WHERE chats.chat_id IS NOT NULL
+    )
+    SELECT chat_id FROM chats WHERE chat_id IS NOT NULL
+"""
+
+MEMORY_COUNT_SQL = "SELECT MAX(seq) FROM memory_index WHERE chat_id = ?"
+
+# LEFT JOIN: a NULL text means the message was moved to the archive. The
+# chat_id check keeps a row from another chat out should an id ever be reused.
+MEMORY_PICK_SQL = """
+    SELECT i.message_id, m.text, m.username, m.timestamp
+    FROM memory_index i LEFT JOIN messages m ON m.id = i.message_id AND m.chat_id = i.chat_id
+    WHERE i.chat_id = ? AND i.seq = ?
+"""
+
+# "On this day": the earlier years (< ?3) with memories on one calendar day,
+# newest first, and the last seq of each. A loose index scan, so the cost
+# grows with the number of years, not with the number of messages.
+MEMORY_DAY_YEARS_SQL = """
+    WITH RECURSIVE years(year) AS (
+        SELECT MAX(year) FROM memory_days WHERE chat_id = ?1 AND month_day = ?2 AND year < ?3
+        UNION ALL
+        SELECT (SELECT MAX(year) FROM memory_days
+                WHERE chat_id = ?1 AND month_day = ?2 AND year < years.year)
+        FROM years WHERE years.year IS NOT NULL
+    )
+    SELECT year, (SELECT MAX(seq) FROM memory_days
+                  WHERE chat_id = ?1 AND month_day = ?2 AND year = years.year)
+    FROM years WHERE year IS NOT NULL
+"""
+
+MEMORY_DAY_PICK_SQL = """
+    SELECT d.message_id, m.text, m.username, m.timestamp
+    FROM memory_days d LEFT JOIN messages m ON m.id = d.message_id AND m.chat_id = d.chat_id
+    WHERE d.chat_id = ? AND d.month_day = ? AND d.year = ? AND d.seq = ?
+"""
+
+# Chats with messages still in the hot table (archiver only).
+HOT_CHAT_IDS_SQL = """
+    WITH RECURSIVE chats(chat_id) AS (
+        SELECT MIN(chat_id) FROM messages
+        UNION ALL
+        SELECT (SELECT MIN(chat_id) FROM messages WHERE chat_id > chats.chat_id)
+        FROM chats WHERE chats.chat_id IS NOT NULL
+    )
+    SELECT chat_id FROM chats WHERE chat_id IS NOT NULL
+"""
+
+ARCHIVE_SEGMENT_SQL = """
+    SELECT id FROM archive_segments
+    WHERE chat_id = ? AND first_id <= ? AND last_id >= ?
+    ORDER BY first_id DESC
+"""
+
+BIRTHDAYS_VERSION_SQL = "SELECT CAST(value AS INTEGER) FROM bot_state WHERE key = 'birthdays_version'"
+
+CHAT_STATS_SQL = """
+    SELECT message_count, first_timestamp, last_timestamp FROM chat_stats
+    WHERE chat_id = ?
+"""
+
+TOP_POSTERS_SQL = """
+    SELECT username, message_count FROM chat_user_stats
+    WHERE chat_id = ?
+    ORDER BY message_count DESC LIMIT ?
+"""
+
+DAILY_STATS_SQL = """
+    SELECT day, message_count FROM chat_daily_stats
+    WHERE chat_id = ? AND day >= ?
+"""
+
+RECENT_MESSAGES_SQL = """
+    SELECT r.slot, r.message_id, m.text, m.username
+    FROM chat_recent r LEFT JOIN messages m ON m.id = r.message_id AND m.chat_id = r.chat_id
+    WHERE r.chat_id = ?
+"""
+
+SEARCH_SQL = """
+    SELECT m.text, m.username, m.timestamp
+    FROM messages_fts f JOIN messages m ON m.id = f.rowid
+    WHERE messages_fts MATCH ? AND f.chat_id = ?
+    ORDER BY f.rank
+    LIMIT ? OFFSET ?
+"""
+
+# (name, sql, sample parameters) for every query on a hot path.
+HOT_QUERIES = (
+    ("get_chat_ids", CHAT_IDS_SQL, ()),
+    ("memory_count", MEMORY_COUNT_SQL, (1,)),
+    ("memory_pick", MEMORY_PICK_SQL, (1, 0)),
+    ("memory_day_years", MEMORY_DAY_YEARS_SQL, (1, 1017, 2026)),
+    ("memory_day_pick", MEMORY_DAY_PICK_SQL, (1, 1017, 2025, 0)),
+    ("archive_segment", ARCHIVE_SEGMENT_SQL, (1, 1, 1)),
+    ("birthdays_version", BIRTHDAYS_VERSION_SQL, ()),
+    ("chat_stats", CHAT_STATS_SQL, (1,)),
+    ("daily_stats", DAILY_STATS_SQL, (1, "2000-01-01")),
+    ("recent_messages", RECENT_MESSAGES_SQL, (1,)),
+    ("search_messages", SEARCH_SQL, ('"memory"', 1, 5, 0)),
+)
+
+# --- Bulk Import ---
+
+# The per-row insert triggers on messages. import_messages() suspends them for
+# a batch and applies BULK_MAINTENANCE_SQL (their set-based equivalents) to
+# the rows with id > :start instead.
+BULK_TRIGGERS = ("memory_index_insert", "memory_days_insert", "messages_fts_insert", "chat_stats_insert")
+
+BULK_MAINTENANCE_SQL = (
+    # SQLite evaluates the whole SELECT before inserting, so the MAX(seq) base
+    # is the chat's value before the batch.
+    """
+    INSERT INTO memory_index (chat_id, seq, message_id)
+    SELECT m.chat_id,
+           COALESCE((SELECT MAX(seq) + 1 FROM memory_index i WHERE i.chat_id = m.chat_id), 0)
+               + ROW_NUMBER() OVER (PARTITION BY m.chat_id ORDER BY m.id) - 1,
+           m.id
+    FROM messages m
+    WHERE m.id > :start AND m.text NOT LIKE '/%'
+    """,
+    f"""
+    INSERT INTO memory_days (chat_id, month_day, year, seq, message_id)
+    SELECT m.chat_id, m.month_day, m.year,
+           COALESCE((SELECT MAX(seq) + 1 FROM memory_days d
+                     WHERE d.chat_id = m.chat_id AND d.month_day = m.month_day AND d.year = m.year), 0)
+               + ROW_NUMBER() OVER (PARTITION BY m.chat_id, m.month_day, m.year ORDER BY m.id) - 1,
+           m.id
+    FROM (SELECT id, chat_id, {migrations.MONTH_DAY_SQL.format(ts="timestamp")} AS month_day,
+                 CAST(substr(timestamp, 1, 4) AS INTEGER) AS year
+          FROM messages WHERE id > :start AND text NOT LIKE '/%') m
+    """,
+    """
+    INSERT INTO messages_fts (rowid, text, chat_id)
+    SELECT id, text, chat_id FROM messages
+    WHERE id > :start AND text NOT LIKE '/%'
+    """,
+    """
+    INSERT INTO chat_stats (chat_id, message_count, first_timestamp, last_timestamp)
+    SELECT chat_id, COUNT(*), MIN(timestamp), MAX(timestamp) FROM messages
+    WHERE id > :start GROUP BY chat_id
+    ON CONFLICT (chat_id) DO UPDATE SET
+        message_count = message_count + excluded.message_count,
+        first_timestamp = min(first_timestamp, excluded.first_timestamp),
+        last_timestamp = max(last_timestamp, excluded.last_timestamp)
+    """,
+    # Imported history is older than live traffic, so a stored username wins.
+    """
+    INSERT INTO chat_user_stats (chat_id, user_id, username, message_count)
+    SELECT chat_id, user_id, username, cnt FROM (
+        SELECT chat_id, user_id, username, COUNT(*) AS cnt, MAX(timestamp)
+        FROM messages WHERE id > :start GROUP BY chat_id, user_id
+    ) WHERE true
+    ON CONFLICT (chat_id, user_id) DO UPDATE SET
+        message_count = message_count + excluded.message_count
+    """,
+    """
+    INSERT INTO chat_daily_stats (chat_id, day, message_count)
+    SELECT chat_id, substr(timestamp, 1, 10), COUNT(*) FROM messages
+    WHERE id > :start GROUP BY chat_id, substr(timestamp, 1, 10)
+    ON CONFLICT (chat_id, day) DO UPDATE SET
+        message_count = message_count + excluded.message_count
+    """,
+)
+
+# The newest RECENT_SLOTS rows per chat among the rows with id > ?.
+BULK_NEWEST_SQL = f"""
+    SELECT chat_id, id, total FROM (
+        SELECT chat_id, id, COUNT(*) OVER (PARTITION BY chat_id) AS total,
+               ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp DESC, id DESC) AS rn
+        FROM messages WHERE id > ?
+    ) WHERE rn <= {migrations.RECENT_SLOTS}
+    ORDER BY chat_id, rn
+"""
+
+# --- Database Manager ---
+
+def writes(method):
+    """Marks a DatabaseManager method as a write for AsyncDatabaseManager routing."""
+    method.db_write = True
+    return method
+
+
+def resolve_db_path(db_path):
+    """Resolves relative paths next to the code, so the bot always finds the
+    same DB file regardless of the working directory."""
+    if not os.path.isabs(db_path):
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        db_path = os.path.join(script_dir, db_path)
+    return db_path
+
+
+class DatabaseManager:
+    """Handles all SQLite database operations."""
+    def __init__(self, db_path, write_behind=True):
+        self.db_path = resolve_db_path(db_path)
+        self.pool = ConnectionManager(self.db_path)
+        self.birthdays = BirthdayCalendar()
+        self.segments = archive.SegmentCache()
+        self._initialize_db()
+        self.buffer = MessageBuffer(self.pool) if write_behind else None
+
+    def _initialize_db(self):
+        """Initializes the database connection and applies pending schema migrations."""
+        try:
+            conn = self.pool.get()
+            version = migrations.migrate(conn)
+            logger.info(f"Database initialized at {self.db_path} (schema version {version})")
+
+        except Exception as e:
+            logger.error(f"Failed to initialize database: {e}")
+
+    def close(self):
+        """Flushes buffered messages and closes all pooled connections (called on shutdown)."""
+        if self.buffer is not None:
+            self.buffer.close()
+        self.pool.close()
+
+    def check_query_plans(self):
+        """Returns (query, plan step) pairs for hot queries that scan a table or sort.
+
+        Used as a regression check after schema changes: an empty list means
+        every hot query is served by an index seek.
+        """
+        problems = []
+        conn = self.pool.get()
+        for name, sql, params in HOT_QUERIES:
+            steps = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            # Scanning a CTE's own rows is fine; scanning a table is not.
+            ctes = {step.split()[1] for step in steps
+                    if step.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+            for step in steps:
+                # FTS5 reports a MATCH lookup as "SCAN f VIRTUAL TABLE INDEX n:M...".
+                fts_match = "VIRTUAL TABLE INDEX" in step and ":M" in step
+                scans_table = (step.startswith("SCAN ") and step.split()[1] not in ctes
+                               and not fts_match)
+                if scans_table or step.startswith("USE TEMP B-TREE"):
+                    problems.append((name, step))
+        return problems
+
+    def flush_messages(self):
+        """Commits buffered messages so that subsequent reads see them."""
+        if self.buffer is not None:
+            self.buffer.flush()
+
+    def buffer_stats(self):
+        """Returns the write-behind buffer counters, or None without write-behind."""
+        return self.buffer.stats() if self.buffer is not None else None
+
+    def storage_bytes(self):
+        """Returns the database file size after folding the WAL back into it."""
+        self.flush_messages()
+        self.pool.get().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return os.path.getsize(self.db_path)
+
+    # Data Storage Methods
+    @writes
+    def store_message(self, chat_id, user_id, username, text, message_id=None):
+        """Stores a message in the database (via the write-behind buffer if enabled)."""
+        row = (chat_id, user_id, username, text, datetime.now().isoformat(), message_id)
+        try:
+            if self.buffer is not None:
+                self.buffer.put(row)
+                return
+            with self.pool.transaction() as conn:
+                conn.execute(INSERT_MESSAGE_SQL, row)
+        except Exception as e:
+            logger.error(f"Error storing message: {e}")
+
+    @writes
+    def store_birthday(self, chat_id, user_id, username, name, day, month):
+        """Stores or updates a user's birthday (and patches the birthday calendar)."""
+        try:
+            with self.pool.transaction() as conn:
+                # Use INSERT OR REPLACE to update if user_id already exists
+                conn.execute("""
+                    INSERT OR REPLACE INTO birthdays (chat_id, user_id, username, name, day, month)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (chat_id, user_id, username, name, day, month))
+                version = conn.execute(BIRTHDAYS_VERSION_SQL).fetchone()[0]
+            self._patch_calendar(
+                version, lambda v: self.birthdays.upsert(v, chat_id, user_id, name, day, month)
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error storing birthday: {e}")
+            return False
+
+    @writes
+    def delete_birthday(self, user_id):
+        """Removes a user's birthday (used when it moves to another shard)."""
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute("DELETE FROM birthdays WHERE user_id = ?", (user_id,))
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting birthday: {e}")
+            return False
+
+    @writes
+    def set_chat_timezone(self, chat_id, tz_name):
+        """Stores the IANA timezone birthday reminders and memories use for a chat."""
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chat_settings (chat_id, timezone) VALUES (?, ?)",
+                    (chat_id, tz_name),
+                )
+                version = conn.execute(BIRTHDAYS_VERSION_SQL).fetchone()[0]
+            self._patch_calendar(version, lambda v: self.birthdays.set_timezone(v, chat_id, tz_name))
+            return True
+        except Exception as e:
+            logger.error(f"Error storing timezone: {e}")
+            return False
+
+    @writes
+    def set_state(self, key, value):
+        """Stores a bot_state value (kept as text)."""
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, str(value))
+                )
+                return True
+        except Exception as e:
+            logger.error(f"Error storing state {key}: {e}")
+            return False
+
+    @writes
+    def delete_states(self, keys):
+        """Removes bot_state values."""
+        try:
+            with self.pool.transaction() as conn:
+                conn.executemany("DELETE FROM bot_state WHERE key = ?", [(key,) for key in keys])
+                return True
+        except Exception as e:
+            logger.error(f"Error deleting state: {e}")
+            return False
+
+    @writes
+    def backfill_search_index(self, batch_size=2000):
+        """Indexes the next batch of pre-existing messages for /search.
+
+        Each call is one short transaction, so the backfill can run alongside
+        normal traffic. Returns the number of ids still to index (0 when done).
+        """
+        try:
+            with self.pool.transaction() as conn:
+                state = dict(conn.execute(
+                    "SELECT key, value FROM bot_state WHERE key IN ('fts_backfill_next', 'fts_backfill_end')"
+                ).fetchall())
+                start = int(state.get("fts_backfill_next", 1))
+                end = int(state.get("fts_backfill_end", 0))
+                if start > end:
+                    return 0
+
+                stop = min(start + batch_size - 1, end)
+                conn.execute("""
+                    INSERT INTO messages_fts (rowid, text, chat_id)
+                    SELECT id, text, chat_id FROM messages
+                    WHERE id BETWEEN ? AND ? AND text NOT LIKE '/%'
+                """, (start, stop))
+                conn.execute(
+                    "UPDATE bot_state SET value = ? WHERE key = 'fts_backfill_next'", (str(stop + 1),)
+                )
+                return end - stop
+        except Exception as e:
+            logger.error(f"Error backfilling search index: {e}")
+            return -1
+
+    # Data Retrieval Methods
+    def get_state(self, key, default=None):
+        """Retrieves a bot_state value, or `default` if it was never set."""
+        try:
+            with self.pool.transaction() as conn:
+                row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+                return row[0] if row is not None else default
+        except Exception as e:
+            logger.error(f"Error retrieving state {key}: {e}")
+            return default
+
+    def get_states(self, prefix):
+        """Retrieves {key: value} for every bot_state key that starts with `prefix`."""
+        try:
+            with self.pool.transaction() as conn:
+                return dict(conn.execute(
+                    "SELECT key, value FROM bot_state WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+                ).fetchall())
+        except Exception as e:
+            logger.error(f"Error retrieving states {prefix}*: {e}")
+            return {}
+
+    def get_chat_ids(self):
+        """Retrieves all chat IDs that have memories (in the hot table or the archive)."""
+        try:
+            with self.pool.transaction() as conn:
+                cursor = conn.execute(CHAT_IDS_SQL)
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error retrieving chat IDs: {e}")
+            return []
+
+    def _pick_memories(self, cursor, chat_id, limit):
+        """Draws up to `limit` distinct memories of one chat from the memory index."""
+        cursor.execute(MEMORY_COUNT_SQL, (chat_id,))
+        last_seq = cursor.fetchone()[0]
+        if last_seq is None:
+            return []
+
+        total = last_seq + 1
+        messages = []
+        for seq in random.sample(range(total), min(limit, total)):
+            memory = self._memory(cursor, chat_id, cursor.execute(MEMORY_PICK_SQL, (chat_id, seq)).fetchone())
+            if memory is not None:
+                messages.append(memory)
+        return messages
+
+    def _memory(self, cursor, chat_id, row):
+        """Turns a picked (message_id, text, username, timestamp) row into a memory.
+
+        Archived messages (NULL text) are read from their segment; returns
+        None if the row or the message is gone.
+        """
+        if row is None:
+            return None
+        message_id, text, username, timestamp = row
+        if text is None:
+            archived = self._archived_message(cursor, chat_id, message_id)
+            if archived is None:
+                return None
+            username, timestamp, text = archived
+        return text, username, timestamp
+
+    def _pick_day_memories(self, cursor, chat_id, today, limit, window):
+        """Draws up to `limit` memories from today's calendar day in earlier years.
+
+        Without any, tries the nearest days up to `window` days before and
+        after (yesterday first). A day counts as an earlier year when its
+        year is before the year of that day's date, so on January 1st the
+        December 31st of last year is not "a year ago".
+        """
+        for offset in sorted(range(-window, window + 1), key=lambda o: (abs(o), o)):
+            day = today + timedelta(days=offset)
+            month_day = 228 if (day.month, day.day) == (2, 29) else day.month * 100 + day.day
+            years = cursor.execute(MEMORY_DAY_YEARS_SQL, (chat_id, month_day, day.year)).fetchall()
+            total = sum(last_seq + 1 for _, last_seq in years)
+            messages = []
+            for pick in random.sample(range(total), min(limit, total)):
+                for year, last_seq in years:
+                    if pick <= last_seq:
+                        break
+                    pick -= last_seq + 1
+                row = cursor.execute(MEMORY_DAY_PICK_SQL, (chat_id, month_day, year, pick)).fetchone()
+                memory = self._memory(cursor, chat_id, row)
+                if memory is not None:
+                    messages.append(memory)
+            if messages:
+                return messages
+        return []
+
+    def get_random_messages(self, chat_id, limit=1):
+        """Retrieves up to `limit` distinct random messages for a specific chat.
+
+        Uses the memory index: O(log n) per pick instead of sorting the
+        chat's whole history with ORDER BY RANDOM().
+        """
+        self.flush_messages()
+        try:
+            with self.pool.transaction() as conn:
+                return self._pick_memories(conn.cursor(), chat_id, limit)
+        except Exception as e:
+            logger.error(f"Error retrieving random message: {e}")
+            return []
+
+    def get_random_memories(self, chat_ids=None):
+        """Picks one random memory per chat (default: every chat) in a single DB pass.
+
+        Returns {chat_id: (text, username, timestamp)}; chats without memories are left out.
+        """
+        self.flush_messages()
+        try:
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                if chat_ids is None:
+                    chat_ids = [row[0] for row in cursor.execute(CHAT_IDS_SQL).fetchall()]
+                memories = {}
+                for chat_id in chat_ids:
+                    picked = self._pick_memories(cursor, chat_id, 1)
+                    if picked:
+                        memories[chat_id] = picked[0]
+                return memories
+        except Exception as e:
+            logger.error(f"Error retrieving random memories: {e}")
+            return {}
+
+    def get_day_messages(self, chat_id, today, limit=1, window=3):
+        """Retrieves up to `limit` memories of a chat from this calendar day in earlier years.
+
+        Falls back to the nearest days within `window` days; returns [] if
+        none of them has memories. Each lookup is a few index seeks per year
+        of history.
+        """
+        self.flush_messages()
+        try:
+            with self.pool.transaction() as conn:
+                return self._pick_day_memories(conn.cursor(), chat_id, today, limit, window)
+        except Exception as e:
+            logger.error(f"Error retrieving on-this-day message: {e}")
+            return []
+
+    def get_day_memories(self, today, chat_ids=None, window=3):
+        """Picks one on-this-day memory per chat (default: every chat) in a single DB pass.
+
+        Returns {chat_id: (text, username, timestamp)}; chats without a
+        memory near this day in earlier years are left out.
+        """
+        self.flush_messages()
+        try:
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                if chat_ids is None:
+                    chat_ids = [row[0] for row in cursor.execute(CHAT_IDS_SQL).fetchall()]
+                memories = {}
+                for chat_id in chat_ids:
+                    picked = self._pick_day_memories(cursor, chat_id, today, 1, window)
+                    if picked:
+                        memories[chat_id] = picked[0]
+                return memories
+        except Exception as e:
+            logger.error(f"Error retrieving on-this-day memories: {e}")
+            return {}
+
+    def search_messages(self, chat_id, query, page=1, page_size=5):
+        """Full-text search over one chat's hot-tier messages, best bm25 matches first.
+
+        Every whitespace-separated term must match; ranking is FTS5's bm25
+        rank. Returns (results, has_more) where results are (text, username,
+        timestamp) rows for the given page.
+        """
+        terms = [term.replace('"', "") for term in query.split()]
+        match = " ".join(f'"{term}"' for term in terms if term)
+        if not match:
+            return [], False
+
+        self.flush_messages()
+        try:
+            with self.pool.transaction() as conn:
+                # Fetch one extra row to know whether a next page exists.
+                cursor = conn.execute(
+                    SEARCH_SQL, (match, chat_id, page_size + 1, (page - 1) * page_size)
+                )
+                rows = cursor.fetchall()
+                return rows[:page_size], len(rows) > page_size
+        except Exception as e:
+            logger.error(f"Error searching messages: {e}")
+            return [], False
+
+    # Birthday Calendar (in-memory, see birthdays.BirthdayCalendar)
+    def _patch_calendar(self, version, patch):
+        """Applies a local write to the calendar, or reloads if another process wrote too."""
+        if self.birthdays.version == version - 1:
+            patch(version)
+        else:
+            self.birthdays.version = None
+
+    def _current_calendar(self):
+        """Returns the birthday calendar, reloading it if the database changed."""
+        with self.pool.transaction() as conn:
+            version = conn.execute(BIRTHDAYS_VERSION_SQL).fetchone()[0]
+            if version != self.birthdays.version:
+                birthdays = conn.execute(
+                    "SELECT chat_id, user_id, name, day, month FROM birthdays"
+                ).fetchall()
+                timezones = conn.execute(
+                    "SELECT chat_id, timezone FROM chat_settings WHERE timezone IS NOT NULL"
+                ).fetchall()
+                self.birthdays.load(version, birthdays, timezones)
+        return self.birthdays
+
+    def get_birthdays_list(self, chat_id):
+        """Retrieves all stored birthdays for a specific chat, ordered by month and day."""
+        try:
+            return self._current_calendar().list_for_chat(chat_id)
+        except Exception as e:
+            logger.error(f"Error retrieving birthday list: {e}")
+            return []
+
+    def render_birthdays(self, chat_id, render):
+        """Returns render(birthdays of the chat), cached per chat until its birthdays change."""
+        try:
+            return self._current_calendar().render(chat_id, render)
+        except Exception as e:
+            logger.error(f"Error rendering birthday list: {e}")
+            return render([])
+
+    def get_today_birthdays(self, month, day):
+        """Retrieves (chat_id, name) birthdays matching the given day and month for all chats."""
+        try:
+            return self._current_calendar().on_date(month, day)
+        except Exception as e:
+            logger.error(f"Error retrieving today's birthdays: {e}")
+            return []
+
+    def get_due_birthdays(self, now, hour, default_tz=None):
+        """Returns [(chat_id, [names])] for chats where it is `hour` o'clock local time."""
+        try:
+            return self._current_calendar().due(now, hour, default_tz)
+        except Exception as e:
+            logger.error(f"Error retrieving due birthdays: {e}")
+            return []
+
+    def get_chat_timezones(self):
+        """Returns {chat_id: IANA timezone name} for the chats that set one with /set_timezone."""
+        try:
+            return self._current_calendar().timezones()
+        except Exception as e:
+            logger.error(f"Error retrieving chat timezones: {e}")
+            return {}
+
+    def get_chat_stats(self, chat_id, top_posters=3, days=7):
+        """Returns /debug statistics for a chat from the incrementally maintained stats tables.
+
+        The result is a dict with total, first/last timestamps, average and
+        recent messages per day, the top posters and the newest messages
+        (newest first), or None if the chat has no messages.
+        """
+        self.flush_messages()
+        try:
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                row = cursor.execute(CHAT_STATS_SQL, (chat_id,)).fetchone()
+                if row is None:
+                    return None
+                total, first_timestamp, last_timestamp = row
+
+                posters = cursor.execute(TOP_POSTERS_SQL, (chat_id, top_posters)).fetchall()
+
+                since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+                daily = cursor.execute(DAILY_STATS_SQL, (chat_id, since)).fetchall()
+
+                # The ring slot of message n is n % RECENT_SLOTS; order newest first.
+                ring = cursor.execute(RECENT_MESSAGES_SQL, (chat_id,)).fetchall()
+                ring.sort(key=lambda r: (total - r[0]) % migrations.RECENT_SLOTS)
+                recent = []
+                for _, message_id, text, username in ring:
+                    if text is None:
+                        archived = self._archived_message(cursor, chat_id, message_id)
+                        if archived is None:
+                            continue
+                        username, _, text = archived
+                    recent.append((text, username))
+
+            first_day = datetime.fromisoformat(first_timestamp[:10])
+            last_day = datetime.fromisoformat(last_timestamp[:10])
+            active_days = (last_day - first_day).days + 1
+            return {
+                "total": total,
+                "first_timestamp": first_timestamp,
+                "last_timestamp": last_timestamp,
+                "per_day": total / active_days,
+                "last_days": sum(count for _, count in daily),
+                "days": days,
+                "top_posters": posters,
+                "recent": recent,
+            }
+        except Exception as e:
+            logger.error(f"Error reading chat stats: {e}")
+            return None
+
+    def check_chat_stats(self):
+        """Compares the stats tables with the messages they summarize (both tiers).
+
+        Returns a list of (chat_id, table, stored, actual) mismatches;
+        an empty list means the incremental stats are consistent.
+        """
+        self.flush_messages()
+        with self.pool.transaction() as conn:
+            actual = dict(conn.execute("SELECT chat_id, COUNT(*) FROM messages GROUP BY chat_id"))
+            for chat_id, archived in conn.execute(
+                "SELECT chat_id, SUM(message_count) FROM archive_segments GROUP BY chat_id"
+            ):
+                actual[chat_id] = actual.get(chat_id, 0) + archived
+            stored = {
+                "chat_stats": dict(conn.execute("SELECT chat_id, message_count FROM chat_stats")),
+                "chat_user_stats": dict(conn.execute(
+                    "SELECT chat_id, SUM(message_count) FROM chat_user_stats GROUP BY chat_id"
+                )),
+                "chat_daily_stats": dict(conn.execute(
+                    "SELECT chat_id, SUM(message_count) FROM chat_daily_stats GROUP BY chat_id"
+                )),
+            }
+
+        mismatches = []
+        for table, counts in stored.items():
+            for chat_id in sorted(actual.keys() | counts.keys()):
+                if counts.get(chat_id) != actual.get(chat_id):
+                    mismatches.append((chat_id, table, counts.get(chat_id), actual.get(chat_id)))
+        return mismatches
+
+    # Message Archive (cold tier, see archive.py)
+    @writes
+    def archive_messages(self, cutoff, max_rows=2000):
+        """Moves up to max_rows messages older than `cutoff` into compressed archive segments.
+
+        Each call is one transaction, so the archiver can run alongside
+        normal traffic. Rows are grouped per chat and month into segments of
+        at most archive.SEGMENT_ROWS messages. Archived messages leave the
+        search index; memories, /debug and the stats still see them.
+        Returns the number of messages archived (0 when nothing is left).
+        """
+        self.flush_messages()
+        cutoff = cutoff.isoformat() if isinstance(cutoff, datetime) else cutoff
+        try:
+            with self.pool.transaction() as conn:
+                users = {}
+                archived = 0
+                for (chat_id,) in conn.execute(HOT_CHAT_IDS_SQL).fetchall():
+                    if archived >= max_rows:
+                        break
+                    # Legacy media rows have no text (NULL); they are archived as "".
+                    rows = conn.execute(
+                        "SELECT id, chat_id, user_id, username, COALESCE(text, ''), timestamp FROM messages "
+                        "WHERE chat_id = ? AND timestamp < ? ORDER BY timestamp LIMIT ?",
+                        (chat_id, cutoff, max_rows - archived),
+                    ).fetchall()
+                    months = {}
+                    for row in rows:
+                        months.setdefault(row[5][:7], []).append(row)
+                    for month, month_rows in months.items():
+                        for start in range(0, len(month_rows), archive.SEGMENT_ROWS):
+                            self._write_segment(conn, users, chat_id, month,
+                                                month_rows[start:start + archive.SEGMENT_ROWS])
+                    ids = [(row[0],) for row in rows]
+                    # Keep the Telegram ids, so a later history import still skips these.
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO archived_message_ids (chat_id, message_id) "
+                        "SELECT chat_id, message_id FROM messages WHERE id = ? AND message_id IS NOT NULL",
+                        ids,
+                    )
+                    conn.executemany("DELETE FROM messages WHERE id = ?", ids)
+                    archived += len(rows)
+                return archived
+        except Exception as e:
+            logger.error(f"Error archiving messages: {e}")
+            return 0
+
+    def _write_segment(self, conn, users, chat_id, month, rows):
+        packed = []
+        for message_id, _, user_id, username, text, timestamp in rows:
+            key = (user_id, username)
+            if key not in users:
+                users[key] = self._intern_user(conn, user_id, username)
+            packed.append((message_id, users[key], archive.to_epoch(timestamp), text))
+        ids = [row[0] for row in rows]
+        conn.execute(
+            "INSERT INTO archive_segments "
+            "(chat_id, month, first_id, last_id, message_count, raw_bytes, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, month, min(ids), max(ids), len(rows),
+             sum(archive.raw_size(row) for row in rows), archive.encode_segment(packed)),
+        )
+
+    @staticmethod
+    def _intern_user(conn, user_id, username):
+        """Returns the users.id of a (user_id, username) pair, adding it if new."""
+        row = conn.execute(
+            "SELECT id FROM users WHERE user_id = ? AND username IS ?", (user_id, username)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        return conn.execute(
+            "INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, username)
+        ).lastrowid
+
+    def _archived_message(self, cursor, chat_id, message_id):
+        """Returns (username, timestamp, text) of an archived message, or None."""
+        # Segment id ranges of a chat rarely overlap, so the first candidate
+        # is almost always the one that holds the message.
+        candidates = cursor.execute(ARCHIVE_SEGMENT_SQL, (chat_id, message_id, message_id)).fetchall()
+        for (segment_id,) in candidates:
+            segment = self.segments.get(segment_id, lambda s: self._load_segment(cursor, s))
+            if message_id in segment:
+                return segment[message_id]
+        return None
+
+    @staticmethod
+    def _load_segment(cursor, segment_id):
+        """Decodes a segment into {message_id: (username, timestamp, text)}."""
+        blob = cursor.execute(
+            "SELECT data FROM archive_segments WHERE id = ?", (segment_id,)
+        ).fetchone()[0]
+        rows = archive.decode_segment(blob)
+        refs = sorted({user_ref for user_ref, _, _ in rows.values()})
+        names = dict(cursor.execute(
+            f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(refs))})", refs
+        ).fetchall())
+        return {
+            message_id: (names.get(user_ref), archive.from_epoch(timestamp), text)
+            for message_id, (user_ref, timestamp, text) in rows.items()
+        }
+
+    # History Import (bulk loads, see import_history.py)
+    @writes
+    def import_messages(self, rows, state_key=None, state=None):
+        """Bulk-inserts (chat_id, user_id, username, text, timestamp, message_id) rows.
+
+        The batch is one transaction. Rows whose Telegram message id is
+        already stored (hot or archived), and rows dated inside a chat's
+        legacy_history window, are skipped. The insert triggers are
+        suspended for the batch and the memory index, search index and stats
+        are updated with one set-based statement each. If state_key is given,
+        `state` is stored in bot_state in the same transaction, so a
+        resumable import records its position atomically with the rows.
+        Returns (imported, skipped), or None if the batch was rolled back.
+        """
+        try:
+            with self.pool.transaction() as conn:
+                # sqlite3 would only begin at the first INSERT: the trigger drops
+                # must be part of the batch, so they roll back with it and live
+                # inserts wait instead of slipping in while the triggers are gone.
+                conn.execute("BEGIN IMMEDIATE")
+                fresh = self._new_import_rows(conn, rows)
+                imported = self._bulk_insert(conn, fresh) if fresh else 0
+                if state_key is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (state_key, str(state))
+                    )
+                return imported, len(rows) - imported
+        except Exception as e:
+            logger.error(f"Error importing {len(rows)} messages: {e}")
+            return None
+
+    @staticmethod
+    def _new_import_rows(conn, rows):
+        """Drops rows that were archived or fall into their chat's legacy (id-less) history."""
+        windows = {}
+        has_archived = {}
+        fresh = []
+        for row in rows:
+            chat_id, timestamp, message_id = row[0], row[4], row[5]
+            if chat_id not in windows:
+                windows[chat_id] = conn.execute(
+                    "SELECT first_timestamp, last_timestamp FROM legacy_history WHERE chat_id = ?", (chat_id,)
+                ).fetchone()
+                has_archived[chat_id] = conn.execute(
+                    "SELECT 1 FROM archived_message_ids WHERE chat_id = ? LIMIT 1", (chat_id,)
+                ).fetchone() is not None
+            window = windows[chat_id]
+            if window is not None and window[0] <= timestamp <= window[1]:
+                continue
+            if message_id is not None and has_archived[chat_id] and conn.execute(
+                "SELECT 1 FROM archived_message_ids WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+            ).fetchone() is not None:
+                continue
+            fresh.append(row)
+        return fresh
+
+    def _bulk_insert(self, conn, rows):
+        """Inserts rows with the insert triggers suspended; returns how many were new."""
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        triggers = conn.execute(
+            f"SELECT sql FROM sqlite_master WHERE type = 'trigger' "
+            f"AND name IN ({','.join('?' * len(BULK_TRIGGERS))})", BULK_TRIGGERS
+        ).fetchall()
+        for name in BULK_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        # OR IGNORE skips duplicates, so the new rows are exactly ids start+1 .. end.
+        conn.executemany(INSERT_MESSAGE_SQL, rows)
+        end = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        if end > start:
+            for sql in BULK_MAINTENANCE_SQL:
+                conn.execute(sql, {"start": start})
+            self._merge_recent(conn, start)
+        for (sql,) in triggers:
+            conn.execute(sql)
+        return end - start
+
+    @staticmethod
+    def _merge_recent(conn, start):
+        """Renumbers each chat's chat_recent ring after a bulk insert.
+
+        Imported history is normally older than what the ring holds, so the
+        ring keeps its messages (newest first) and only free places are
+        filled with the newest imported ones.
+        """
+        newest = {}
+        for chat_id, message_id, imported in conn.execute(BULK_NEWEST_SQL, (start,)).fetchall():
+            newest.setdefault(chat_id, (imported, []))[1].append(message_id)
+        for chat_id, (imported, message_ids) in newest.items():
+            total = conn.execute(CHAT_STATS_SQL, (chat_id,)).fetchone()[0]
+            before = total - imported
+            ring = conn.execute(
+                "SELECT slot, message_id FROM chat_recent WHERE chat_id = ?", (chat_id,)
+            ).fetchall()
+            ring.sort(key=lambda r: (before - r[0]) % migrations.RECENT_SLOTS)
+            keep = ([message_id for _, message_id in ring] + message_ids)[:migrations.RECENT_SLOTS]
+            conn.execute("DELETE FROM chat_recent WHERE chat_id = ?", (chat_id,))
+            conn.executemany(
+                "INSERT INTO chat_recent (chat_id, slot, message_id) VALUES (?, ?, ?)",
+                [(chat_id, (total - i) % migrations.RECENT_SLOTS, message_id)
+                 for i, message_id in enumerate(keep)],
+            )
+
+    def archive_report(self):
+        """Returns row counts and sizes of the hot and archive tiers."""
+        with self.pool.transaction() as conn:
+            segments, archived, raw_bytes, stored_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(message_count), 0), COALESCE(SUM(raw_bytes), 0), "
+                "COALESCE(SUM(length(data)), 0) FROM archive_segments"
+            ).fetchone()
+            users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            hot = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {
+            "hot_messages": hot,
+            "archived_messages": archived,
+            "segments": segments,
+            "interned_users": users,
+            "archived_raw_bytes": raw_bytes,
+            "archived_stored_bytes": stored_bytes,
+            "bytes_saved": raw_bytes - stored_bytes,
+            "file_bytes": page_size * pages,
+            "free_bytes": page_size * free_pages,
+        }
+
+# --- Async Front-End ---
+
+class AsyncDatabaseManager:
+    """Awaitable wrapper around DatabaseManager for the async handlers.
+
+    Every DatabaseManager method is exposed as a coroutine that runs off the
+    event loop: methods marked with @writes go to one dedicated writer thread
+    (so writes keep their order), everything else to a small pool of reader
+    threads, which WAL lets run alongside the writer. A slow query or a disk
+    stall then suspends only the calling handler instead of every chat.
+    The wrapped synchronous manager stays available as ``.sync``.
+    """
+
+    def __init__(self, manager, readers=4):
+        self.sync = manager
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        executor = self._writer if getattr(attr, "db_write", False) else self._readers
+
+        def timed(*args, **kwargs):
+            # Execution time only; time spent queued for the thread is not included.
+            with metrics.DB_SECONDS.time(name):
+                return attr(*args, **kwargs)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(timed, *args, **kwargs))
+
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        # Cache the coroutine function so later lookups skip __getattr__.
+        setattr(self, name, call)
+        return call
+
+    def close(self):
+        """Waits for queued DB calls, then closes the underlying manager."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.sync.close()
+
+
+if __name__ == "__main__":
+    # Migrates a database in place and runs the consistency checks:
+    #   python database.py [path/to/bot_data.db] [--check-stats]
+    # Exits non-zero if a hot query regressed to a scan or the stats drifted.
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate and check the bot database.")
+    parser.add_argument("db_path", nargs="?", default="bot_data.db")
+    parser.add_argument("--check-stats", action="store_true",
+                        help="Also verify the per-chat statistics against the messages table.")
+    parser.add_argument("--archive-older-than", type=int, metavar="DAYS",
+                        help="Move messages older than DAYS days into the compressed archive.")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="Rebuild the file afterwards to return freed pages to the OS.")
+    parser.add_argument("--archive-report", action="store_true",
+                        help="Print hot/archive row counts and bytes saved.")
+    args = parser.parse_args()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    manager = DatabaseManager(args.db_path, write_behind=False)
+    if args.archive_older_than is not None:
+        cutoff = datetime.now() - timedelta(days=args.archive_older_than)
+        total = 0
+        while True:
+            archived = manager.archive_messages(cutoff)
+            total += archived
+            if not archived:
+                break
+        print(f"Archived {total} messages older than {cutoff:%Y-%m-%d}.")
+    if args.vacuum:
+        manager.pool.get().execute("VACUUM")
+    problems = manager.check_query_plans()
+    mismatches = manager.check_chat_stats() if args.check_stats else []
+    report = manager.archive_report() if args.archive_report or args.archive_older_than is not None else None
+    manager.close()
+
+    if report is not None:
+        for key, value in report.items():
+            print(f"{key:<22} {value}")
+
+    for name, step in problems:
+        print(f"FAIL {name}: {step}")
+    for chat_id, table, stored, actual in mismatches:
+        print(f"FAIL {table} for chat {chat_id}: stored {stored}, actual {actual}")
+    if problems or mismatches:
+        sys.exit(1)
+    print(f"OK: all {len(HOT_QUERIES)} hot queries use indexes.")
+    if args.check_stats:
+        print("OK: chat statistics match the messages table.")
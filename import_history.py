@@ -0,0 +1,390 @@
+"""Imports chat history into the bot database, so new groups get memories on day one.
+
+    python import_history.py result.json
+    python import_history.py history.jsonl --shards 4
+
+Reads a Telegram Desktop export (result.json of one chat, or a full account
+export with many chats), or a JSONL file with one message object per line:
+
+    {"chat_id": -1001234, "user_id": 42, "username": "alice",
+     "text": "hello", "timestamp": "2021-05-01T12:00:00", "message_id": 17}
+
+(timestamp may also be Unix seconds; message_id is optional but needed for
+deduplication). Like the bot itself, only group and supergroup text is
+imported: private chats, bot chats, saved messages and channels in a full
+export (and non-negative chat ids in JSONL) are skipped. The file is
+streamed, never loaded whole: JSONL line by line, the export through a small
+incremental parser that decodes one message at a time. Rows are written in
+large batches (DatabaseManager.import_messages), each committed together with
+the read position, so an interrupted import resumes where it stopped when run
+again with the same file. Messages that are already stored are skipped, so
+overlapping exports can be imported safely.
+The bot may keep running during an import: a batch holds the write lock for
+about half a second, and live writes wait for it (busy_timeout).
+"""
+import argparse
+import codecs
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from database import DatabaseManager
+from sharding import ShardedDatabaseManager
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 1 << 20
+BATCH_ROWS = 20000
+PROGRESS_SECONDS = 2.0
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Telegram Desktop exports chat ids without the Bot API prefixes. Other chat
+# types (personal_chat, bot_chat, saved_messages, channels) are not imported.
+SUPERGROUP_TYPES = ("public_supergroup", "private_supergroup")
+GROUP_TYPES = ("private_group",)
+# Top-level keys of a full account export (a single-chat export has "messages").
+MULTI_CHAT_KEYS = ("chats", "left_chats")
+
+
+def naive_timestamp(value):
+    """Unix seconds or ISO text -> naive local ISO text, the clock the bot stores."""
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+        return datetime.fromtimestamp(int(value)).isoformat()
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+def export_chat_id(chat):
+    """Bot API chat id of an exported group (supergroups get -100..., groups -...), else None."""
+    chat_id = chat.get("id")
+    if chat_id is None:
+        return None
+    if chat.get("type") in SUPERGROUP_TYPES:
+        return -int(f"100{chat_id}")
+    if chat.get("type") in GROUP_TYPES:
+        return -chat_id
+    return None
+
+
+def _sender_id(from_id):
+    """'user123' -> 123, 'channel123' -> -100123 (the sender_chat id)."""
+    if isinstance(from_id, int):
+        return from_id
+    if not from_id:
+        return None
+    if from_id.startswith("user"):
+        return int(from_id[4:])
+    if from_id.startswith("channel"):
+        return -int(f"100{from_id[7:]}")
+    return None
+
+
+def export_row(chat_id, message):
+    """Returns a messages row for an exported text message, or None if the bot would not store it."""
+    if message.get("type") != "message":
+        return None
+    text = message.get("text")
+    if isinstance(text, list):
+        # Formatted text is a list of plain strings and {"type": ..., "text": ...} entities.
+        text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    user_id = _sender_id(message.get("from_id"))
+    # Same filter as collect_message (export_chat_id already dropped non-groups):
+    # no commands, no empty texts.
+    if not text or text.startswith("/") or user_id is None:
+        return None
+    timestamp = naive_timestamp(message.get("date_unixtime") or message["date"])
+    return chat_id, user_id, message.get("from"), text, timestamp, message.get("id")
+
+
+def jsonl_row(record):
+    text = record.get("text")
+    # Group and supergroup ids are negative; positive ids are private chats.
+    if not text or text.startswith("/") or record["chat_id"] >= 0:
+        return None
+    return (
+        record["chat_id"], record["user_id"], record.get("username"), text,
+        naive_timestamp(record["timestamp"]), record.get("message_id"),
+    )
+
+# --- Streaming readers ---
+
+class JsonlReader:
+    """Yields rows from a JSONL file, one line at a time."""
+
+    def __init__(self, path, position=None):
+        self.path = path
+        self.offset = (position or {}).get("offset", 0)
+        self.skipped = 0
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for line in f:
+                self.offset += len(line)
+                if not line.strip():
+                    continue
+                row = jsonl_row(json.loads(line))
+                if row is None:
+                    self.skipped += 1
+                    continue
+                yield row
+
+    def position(self):
+        return {"offset": self.offset}
+
+
+class ExportReader:
+    """Yields rows from a Telegram Desktop export without loading it.
+
+    Walks the JSON structure with an explicit stack: scalars are decoded as
+    they come (so each chat object's id and type are known before its
+    "messages"), and every element of a "messages" array is decoded on its
+    own with the C JSON decoder. Between two messages the whole parser state
+    is the byte offset plus the small stack, which position() returns for
+    resuming.
+    """
+
+    def __init__(self, path, chat_id=None, position=None):
+        self.path = path
+        self.chat_id = chat_id
+        position = position or {}
+        self.offset = position.get("offset", 0)        # bytes consumed before self._buffer
+        # Frames: [kind, key, scalars]; kind is "object" or "array".
+        self._stack = position.get("stack", [])
+        self._expect_value = not self._stack
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self.skipped = 0
+
+    def position(self):
+        """Resume point after the last message yielded."""
+        consumed = len(self._buffer[:self._pos].encode())
+        return {"offset": self.offset + consumed, "stack": self._stack}
+
+    def _fill(self):
+        if self._pos > CHUNK_BYTES:
+            self.offset += len(self._buffer[:self._pos].encode())
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        chunk = self._file.read(CHUNK_BYTES)
+        self._eof = not chunk
+        self._buffer += self._utf8.decode(chunk, final=self._eof)
+        return not self._eof
+
+    def _peek(self):
+        """Returns the next non-whitespace character (without consuming it)."""
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError(f"Unexpected end of {self.path}")
+
+    def _value(self):
+        """Decodes the complete JSON value at the current position."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number that ends with the buffer may continue in the next chunk.
+            if end == len(self._buffer) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} at byte ~{self.position()['offset']} of {self.path}")
+        self._pos += 1
+
+    def __iter__(self):
+        with open(self.path, "rb") as self._file:
+            self._file.seek(self.offset)
+            yield from self._walk()
+
+    def _walk(self):
+        stack = self._stack
+        key = None
+        if self._expect_value:
+            self._open(self._peek(), None)
+        while stack:
+            kind, _, scalars = stack[-1]
+            char = self._peek()
+            if char in "}]":
+                self._pos += 1
+                stack.pop()
+                continue
+            if char == ",":
+                self._pos += 1
+                char = self._peek()
+            if kind == "object":
+                key = self._value()
+                if self.chat_id is not None and len(stack) == 1 and key in MULTI_CHAT_KEYS:
+                    raise ValueError(
+                        f"{self.path} holds many chats; --chat-id only works with a single-chat export"
+                    )
+                self._expect(":")
+                char = self._peek()
+                if char in "{[":
+                    self._open(char, key)
+                else:
+                    scalars[key] = self._value()
+            elif stack[-1][1] == "messages":
+                chat = stack[-2][2] if len(stack) > 1 else {}
+                chat_id = export_chat_id(chat)
+                yield from self._messages(self.chat_id if chat_id and self.chat_id is not None else chat_id)
+            elif char in "{[":
+                self._open(char, None)
+            else:
+                self._value()
+
+    def _messages(self, chat_id):
+        """Yields the rows of the current "messages" array up to its closing bracket."""
+        while True:
+            char = self._peek()
+            if char == "]":
+                return
+            if char == ",":
+                self._pos += 1
+            message = self._value()
+            row = export_row(chat_id, message) if chat_id and isinstance(message, dict) else None
+            if row is None:
+                self.skipped += 1
+                continue
+            yield row
+
+    def _open(self, char, key):
+        self._pos += 1
+        self._stack.append(["object" if char == "{" else "array", key, {}])
+
+# --- Import ---
+
+def state_key(path):
+    """bot_state key of an import: file name and size identify the export."""
+    return f"import:{os.path.basename(path)}:{os.path.getsize(path)}"
+
+
+def open_reader(path, chat_id, position):
+    if path.endswith(".jsonl"):
+        return JsonlReader(path, position)
+    return ExportReader(path, chat_id, position)
+
+
+def run_import(manager, path, chat_id=None, batch_rows=BATCH_ROWS, restart=False, progress=print):
+    """Imports `path` into `manager`, resuming a previous run of the same file.
+
+    Returns {"read", "imported", "skipped", "ignored"} counts of this run, or
+    None if a batch failed (nothing after the last committed batch is kept).
+    """
+    key = state_key(path)
+    saved = manager.get_state(key)
+    state = json.loads(saved) if saved and not restart else {}
+    if state.get("done"):
+        progress(f"{path} was already imported ({state['read']} rows); use --restart to read it again.")
+        return {"read": 0, "imported": 0, "skipped": 0, "ignored": 0}
+    if state:
+        progress(f"Resuming {path} at byte {state['position']['offset']} ({state['read']} rows read before).")
+
+    reader = open_reader(path, chat_id, state.get("position"))
+    size = os.path.getsize(path)
+    counts = {"read": 0, "imported": 0, "skipped": 0, "ignored": 0}
+    # Parsing runs in its own thread, so on a multi-core machine the next
+    # batch is decoded while SQLite writes the current one.
+    batches = queue.Queue(maxsize=2)
+    threading.Thread(target=_read_batches, args=(reader, batch_rows, batches), daemon=True).start()
+
+    start = last_report = time.perf_counter()
+    while True:
+        item = batches.get()
+        if isinstance(item, Exception):
+            raise item
+        batch, position, done = item
+        # The read position is committed in the same transaction as the rows.
+        value = json.dumps({"read": state.get("read", 0) + counts["read"] + len(batch),
+                            "position": position, "done": done})
+        result = manager.import_messages(batch, key, value)
+        if result is None:
+            return None
+        counts["read"] += len(batch)
+        counts["imported"] += result[0]
+        counts["skipped"] += result[1]
+        if done:
+            break
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_SECONDS:
+            last_report = now
+            progress(f"{position['offset'] / size:6.1%}  {counts['read']} read, {counts['imported']} imported, "
+                     f"{counts['skipped']} already stored, {counts['read'] / (now - start):,.0f} rows/s")
+    counts["ignored"] = reader.skipped
+
+    elapsed = time.perf_counter() - start
+    progress(f"Done in {elapsed:.1f} s ({counts['read'] / elapsed:,.0f} rows/s): "
+             f"{counts['imported']} imported, {counts['skipped']} already stored, "
+             f"{counts['ignored']} skipped (not group text messages).")
+    return counts
+
+
+def _read_batches(reader, batch_rows, batches):
+    """Puts (rows, position after them, done) batches on the queue, or the parse error."""
+    try:
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                # Copy the position now: the reader moves on while the batch waits.
+                batches.put((batch, json.loads(json.dumps(reader.position())), False))
+                batch = []
+        batches.put((batch, reader.position(), True))
+    except Exception as e:
+        batches.put(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="Telegram Desktop result.json, or a .jsonl file.")
+    parser.add_argument("--db", default=os.environ.get("BOT_DB_PATH", "bot_data.db"), help="Bot database.")
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("BOT_DB_SHARDS", "1")),
+                        help="Database shard files (as BOT_DB_SHARDS).")
+    parser.add_argument("--chat-id", type=int,
+                        help="Store the messages of a single-chat group export under this chat id.")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Rows per transaction.")
+    parser.add_argument("--restart", action="store_true", help="Ignore saved progress and read from the start.")
+    args = parser.parse_args()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.WARNING
+    )
+
+    if args.shards == 1:
+        manager = DatabaseManager(args.db, write_behind=False)
+    else:
+        manager = ShardedDatabaseManager(args.db, args.shards, write_behind=False)
+    try:
+        counts = run_import(manager, args.path, args.chat_id, args.batch_rows, args.restart)
+        mismatches = manager.check_chat_stats() if counts is not None else []
+    except ValueError as e:
+        sys.exit(f"Import failed: {e}")
+    finally:
+        manager.close()
+    if counts is None:
+        sys.exit("Import failed (see the log); run the same command again to resume after the last batch.")
+    if mismatches:
+        sys.exit(f"FAIL: chat statistics do not match the messages: {mismatches[:5]}")
+
+
+if __name__ == "__main__":
+    main()
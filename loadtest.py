@@ -0,0 +1,346 @@
+"""Replay load test for the webhook handler, fully offline.
+
+Generates synthetic Telegram updates, posts them at the Flask app (through
+its test client or a local HTTP server) while PTB talks to a local Bot API
+stub, and reports throughput, latency percentiles and database growth as
+JSON, e.g.:
+
+    python loadtest.py --updates 20000 --chats 200 --skew 1.2 --output results.json
+    python loadtest.py --updates 20000 --baseline results.json
+
+With --baseline the run exits with status 1 if throughput dropped or p99
+latency grew by more than --tolerance, so hot-path regressions show up
+between versions. bot_data.db is never touched.
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from benchmark import percentile, populate_messages, random_text
+from stub_bot import BOT_USER, StubBotAPI
+
+logger = logging.getLogger(__name__)
+
+BIRTHDAY_PROMPT = (
+    "To set a birthday, reply to this message with the date in **DD-MM-YYYY** format (e.g., 25-05-1990)."
+)
+COMMANDS = ("/random", "/debug", "/search {word}", "/view_birthdays", "/set_birthday")
+
+# --- Update generator ---
+
+
+def generate_updates(count, chats=50, users=200, skew=1.0, command_share=0.05,
+                     birthday_share=0.01, reply_share=0.15, seed=1):
+    """Returns (kind, update) pairs shaped like real group traffic.
+
+    Chats are picked with Zipf-like weights 1/rank**skew (0 = uniform), so a
+    few busy groups produce most of the traffic. kind is "text", "command" or
+    "birthday_reply".
+    """
+    rng = random.Random(seed)
+    members = [
+        {"id": 100000 + i, "is_bot": False, "first_name": f"User{i}",
+         **({"last_name": "Example"} if i % 3 else {}),
+         **({"username": f"user_{i}"} if i % 4 else {}),
+         "language_code": "en"}
+        for i in range(users)
+    ]
+    groups = [
+        {"id": -(1001000000000 + i), "title": f"Group {i}", "type": "supergroup" if i % 5 else "group"}
+        for i in range(chats)
+    ]
+    weights = [1 / (rank + 1) ** skew for rank in range(chats)]
+    picked = rng.choices(groups, weights=weights, k=count)
+
+    updates = []
+    for update_id, chat in enumerate(picked, start=1):
+        now = 1700000000 + update_id
+        message = {"message_id": update_id, "from": rng.choice(members), "chat": chat, "date": now}
+        roll = rng.random()
+        if roll < command_share:
+            kind = "command"
+            message["text"] = rng.choice(COMMANDS).format(word=rng.choice(("hello", "party", "word42")))
+            message["entities"] = [
+                {"offset": 0, "length": len(message["text"].split()[0]), "type": "bot_command"}
+            ]
+        elif roll < command_share + birthday_share:
+            kind = "birthday_reply"
+            message["text"] = f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(1960, 2010)}"
+            message["reply_to_message"] = {
+                "message_id": max(1, update_id - 1), "from": BOT_USER, "chat": chat,
+                "date": now - 30, "text": BIRTHDAY_PROMPT,
+            }
+        else:
+            kind = "text"
+            message["text"] = random_text(rng, rng.randint(3, 25))
+            if rng.random() < reply_share:
+                message["reply_to_message"] = {
+                    "message_id": max(1, update_id - rng.randint(1, 50)), "from": rng.choice(members),
+                    "chat": chat, "date": now - 60, "text": random_text(rng),
+                }
+        updates.append((kind, {"update_id": update_id, "message": message}))
+    return updates
+
+# --- Replay driver ---
+
+
+def _client_poster(wh):
+    client = wh.app.test_client()
+
+    def post(body):
+        return client.post(wh.WEBHOOK_PATH, data=body, content_type="application/json").status_code
+    return post
+
+
+def _server_poster(address, path):
+    import http.client
+
+    def post(body):
+        conn = http.client.HTTPConnection(*address, timeout=30)
+        try:
+            conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+    return post
+
+
+def replay(make_poster, bodies, concurrency=8, rate=None):
+    """Posts every body from `concurrency` threads; returns (latencies, statuses, elapsed).
+
+    With a target rate the requests follow a fixed schedule and latency is
+    measured from the scheduled send time, so a stalled server is not hidden
+    by the driver slowing down with it.
+    """
+    latencies = [None] * len(bodies)
+    statuses = Counter()
+    lock = threading.Lock()
+    next_index = iter(range(len(bodies)))
+    start = time.perf_counter()
+
+    def worker():
+        post = make_poster()
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            sent = time.perf_counter()
+            if rate:
+                sent = start + i / rate
+                if sent > time.perf_counter():
+                    time.sleep(sent - time.perf_counter())
+            try:
+                status = post(bodies[i])
+            except Exception as e:
+                logger.error(f"Request {i} failed: {e}")
+                status = "error"
+            latencies[i] = time.perf_counter() - sent
+            with lock:
+                statuses[status] += 1
+
+    threads = [threading.Thread(target=worker, name=f"replay-{n}") for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def wait_for_drain(wh, timeout):
+    """Waits until every queued update is processed and buffered rows are committed."""
+    deadline = time.monotonic() + timeout
+    while wh.update_queue.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    wh.db.sync.flush_messages()
+
+
+def db_size(wh):
+    """Database size in bytes (all shards) after folding the WAL back into the main file."""
+    return wh.db.sync.storage_bytes()
+
+
+def message_count(wh):
+    wh.db.sync.flush_messages()
+    report = wh.db.sync.archive_report()
+    return report["hot_messages"] + report["archived_messages"]
+
+# --- Report ---
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions against a previous results file."""
+    problems = []
+    old, new = baseline["end_to_end"]["updates_per_s"], results["end_to_end"]["updates_per_s"]
+    if new < old * (1 - tolerance):
+        problems.append(f"throughput {new:.0f}/s vs {old:.0f}/s")
+    for key in ("p95_ms", "p99_ms"):
+        old, new = baseline["ack_latency"][key], results["ack_latency"][key]
+        if new > old * (1 + tolerance) and new - old > 1.0:
+            problems.append(f"ack {key} {new:.2f} vs {old:.2f}")
+    return problems
+
+
+def run(args):
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    # Registered before webhook_handler's own atexit hooks, so it runs after them.
+    atexit.register(shutil.rmtree, tmp, True)
+
+    stub = StubBotAPI(latency=args.api_latency).start()
+    os.environ["BOT_DB_PATH"] = os.path.join(tmp, "load.db")
+    os.environ["BOT_API_BASE_URL"] = stub.base_url
+    os.environ["BOT_DB_SHARDS"] = str(args.shards)
+    import webhook_handler as wh
+    wh.bootstrap()
+
+    deadline = time.monotonic() + 30
+    running = lambda: wh.bot_ready.is_set() and wh.application.running
+    while not running() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if not running():
+        sys.exit("PTB application did not start against the Bot API stub.")
+
+    if args.history:
+        populate_messages(wh.db.sync, [-(1001000000000 + i) for i in range(args.chats)], args.history)
+
+    updates = generate_updates(
+        args.updates, chats=args.chats, users=args.users, skew=args.skew,
+        command_share=args.command_share, birthday_share=args.birthday_share, seed=args.seed,
+    )
+    bodies = [json.dumps(update).encode() for _, update in updates]
+    size_before = db_size(wh)
+    messages_before = message_count(wh)
+
+    server = None
+    if args.mode == "server":
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log per request
+        server = make_server("127.0.0.1", 0, wh.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+        make_poster = lambda: _server_poster(server.server_address, wh.WEBHOOK_PATH)
+    else:
+        make_poster = lambda: _client_poster(wh)
+
+    start = time.perf_counter()
+    latencies, statuses, ack_elapsed = replay(make_poster, bodies, args.concurrency, args.rate)
+    wait_for_drain(wh, args.drain_timeout)
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+
+    size_after = db_size(wh)
+    messages_after = message_count(wh)
+    queue = wh.update_queue.stats()
+    results = {
+        "version": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items()
+                   if key not in ("baseline", "output", "tolerance")},
+        "mix": dict(Counter(kind for kind, _ in updates)),
+        "status": {str(status): count for status, count in statuses.items()},
+        "ack_latency": {
+            "updates_per_s": len(bodies) / ack_elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies) * 1000,
+        },
+        "end_to_end": {
+            "elapsed_s": elapsed,
+            "updates_per_s": len(bodies) / elapsed,
+        },
+        "queue": {key: queue[key] for key in (
+            "submitted", "rejected", "processed", "failed",
+            "avg_wait_ms", "max_wait_ms", "avg_processing_ms", "max_processing_ms",
+        )},
+        "bot_api": dict(stub.counters),
+        "db": {
+            "messages_stored": messages_after - messages_before,
+            "size_before_bytes": size_before,
+            "size_after_bytes": size_after,
+            "bytes_per_update": (size_after - size_before) / len(bodies),
+        },
+    }
+    stub.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=10000, help="Updates to replay.")
+    parser.add_argument("--chats", type=int, default=50, help="Number of group chats.")
+    parser.add_argument("--users", type=int, default=200, help="Number of distinct senders.")
+    parser.add_argument("--skew", type=float, default=1.0, help="Chat popularity skew (0 = uniform).")
+    parser.add_argument("--command-share", type=float, default=0.05, help="Fraction of commands.")
+    parser.add_argument("--birthday-share", type=float, default=0.01, help="Fraction of birthday replies.")
+    parser.add_argument("--history", type=int, default=0, help="Messages per chat stored before the run.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--shards", type=int, default=1, help="Database shard files.")
+    parser.add_argument("--mode", choices=("client", "server"), default="client",
+                        help="Flask test client, or a local threaded HTTP server.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent webhook requests.")
+    parser.add_argument("--rate", type=float, help="Target updates/s (default: as fast as possible).")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Bot API stub latency (s).")
+    parser.add_argument("--drain-timeout", type=float, default=120.0,
+                        help="Seconds to wait for queued updates after the replay.")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout.")
+    parser.add_argument("--baseline", help="Previous results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative throughput/latency regression.")
+    args = parser.parse_args()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.WARNING
+    )
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    e2e, ack = results["end_to_end"], results["ack_latency"]
+    print(f"{args.updates} updates in {e2e['elapsed_s']:.2f} s -> {e2e['updates_per_s']:.0f} updates/s; "
+          f"ack p50 {ack['p50_ms']:.2f} ms, p95 {ack['p95_ms']:.2f} ms, p99 {ack['p99_ms']:.2f} ms; "
+          f"DB +{results['db']['bytes_per_update']:.0f} bytes/update", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != results["params"]:
+            print("warning: baseline was run with different parameters", file=sys.stderr)
+        problems = compare(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
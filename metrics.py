@@ -0,0 +1,209 @@
+"""Minimal Prometheus metrics for the bot (text exposition format, no dependencies).
+
+Counters and histograms are updated in place under a per-metric lock, which
+costs about a microsecond per observation, so instrumentation stays on in
+production. Values that other components already count (update queue,
+message buffer, deduplicator) are read by collectors only when /metrics is
+scraped.
+"""
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds; covers a sub-millisecond buffered insert up to a slow Telegram call.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one series per label-value tuple."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+                for labels, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label-value tuple."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        """Context manager that observes the duration of its block."""
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        lines = []
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """Holds metrics and scrape-time collectors; render() returns the /metrics text."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """Registers collect() -> [(name, kind, help, value)], called on every scrape."""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logging.getLogger(__name__).error(f"Metrics collector {collect.__name__} failed: {e}")
+                continue
+            for name, kind, help, value in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Bot metrics ---
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Time spent in PTB handler callbacks.", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Exceptions raised by PTB handler callbacks.", ("handler", "exception"))
+JOB_SECONDS = REGISTRY.histogram(
+    "bot_job_duration_seconds", "Duration of scheduled job runs.", ("job",), buckets=JOB_BUCKETS)
+JOB_ERRORS = REGISTRY.counter(
+    "bot_job_errors_total", "Exceptions raised by scheduled jobs.", ("job", "exception"))
+DB_SECONDS = REGISTRY.histogram(
+    "bot_db_call_duration_seconds", "Execution time of DatabaseManager calls made by handlers and jobs.",
+    ("method",))
+WEBHOOK_SECONDS = REGISTRY.histogram(
+    "bot_webhook_request_duration_seconds", "Time to acknowledge a webhook request, by outcome.",
+    ("outcome",))
+BROADCAST_MESSAGES = REGISTRY.counter(
+    "bot_broadcast_messages_total", "Messages sent by scheduled broadcasts, by job and result.",
+    ("job", "result"))
+LOGGED_ERRORS = REGISTRY.counter(
+    "bot_logged_errors_total",
+    "ERROR log records by logger, including errors that are logged and answered with a default.",
+    ("logger",))
+
+
+def instrument(histogram, errors):
+    """Decorator for async callbacks: observes their duration and counts exceptions by type."""
+    def decorator(callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception as e:
+                errors.inc(name, type(e).__name__)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+
+class ErrorLogCounter(logging.Handler):
+    """Logging handler that counts ERROR records, so swallowed exceptions stay visible."""
+
+    def __init__(self, counter=LOGGED_ERRORS):
+        super().__init__(level=logging.ERROR)
+        self.counter = counter
+
+    def emit(self, record):
+        self.counter.inc(record.name)
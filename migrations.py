@@ -0,0 +1,558 @@
+"""Versioned schema migrations for the bot database.
+
+The schema version lives in ``PRAGMA user_version``. Each migration runs in
+its own transaction together with the version bump, so a database is always
+at exactly one known version. Append new migrations to MIGRATIONS; never edit
+or reorder ones that have shipped.
+"""
+import logging
+import re
+
+import archive
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _parse_legacy_date(value):
+    """Parses the legacy birthdays.date text ('MM-DD', 'DD-MM' or 'YYYY-MM-DD')."""
+    parts = [int(part) for part in str(value).split("-")]
+    if len(parts) == 3:
+        parts = parts[1:] if parts[0] > 31 else parts[:2]
+    first, second = parts
+    # The old bot stored month first; fall back to day first when that
+    # cannot be a month.
+    month, day = (first, second) if first <= 12 else (second, first)
+    if not 1 <= month <= 12 or not 1 <= day <= 31:
+        raise ValueError(f"Invalid legacy birthday date: {value!r}")
+    return month, day
+
+
+def migration_1_base_schema(conn):
+    """Creates the base tables and upgrades the legacy layout if present."""
+    # Stores message text and chat ID for the memory feature
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            text TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+    """)
+    # The previous bot stored Unix timestamps as REAL; the handlers expect ISO text.
+    conn.execute("""
+        UPDATE messages
+        SET timestamp = strftime('%Y-%m-%dT%H:%M:%S', timestamp, 'unixepoch', 'localtime')
+        WHERE typeof(timestamp) IN ('integer', 'real')
+    """)
+
+    birthday_columns = _columns(conn, "birthdays")
+    if birthday_columns and "month" not in birthday_columns:
+        # Legacy table: (user_id, chat_id, username, date, ...). Keep it around
+        # under another name, since it has columns the new layout drops.
+        conn.execute("ALTER TABLE birthdays RENAME TO birthdays_legacy")
+
+    # Stores birthdays
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS birthdays (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL UNIQUE,
+            username TEXT,
+            name TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            month INTEGER NOT NULL
+        )
+    """)
+
+    if birthday_columns and "month" not in birthday_columns:
+        legacy = conn.execute(
+            "SELECT chat_id, user_id, username, date FROM birthdays_legacy"
+        ).fetchall()
+        for chat_id, user_id, username, date in legacy:
+            try:
+                month, day = _parse_legacy_date(date)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Skipping legacy birthday of user {user_id}: {e}")
+                continue
+            conn.execute("""
+                INSERT OR REPLACE INTO birthdays (chat_id, user_id, username, name, day, month)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (chat_id, user_id, username, username or str(user_id), day, month))
+        logger.info(f"Migrated {len(legacy)} legacy birthday rows")
+
+
+def migration_2_memory_index(conn):
+    """Creates the per-chat memory sequence index and backfills it.
+
+    Every non-command message gets a dense per-chat sequence number
+    (0, 1, 2, ...) at insert time, so a random memory is a random integer
+    below the chat's next sequence number plus one primary-key lookup.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS memory_index (
+            chat_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, seq)
+        ) WITHOUT ROWID
+    """)
+    # A trigger covers every ingest path (single inserts and executemany).
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS memory_index_insert
+        AFTER INSERT ON messages
+        WHEN NEW.text NOT LIKE '/%'
+        BEGIN
+            INSERT INTO memory_index (chat_id, seq, message_id)
+            VALUES (
+                NEW.chat_id,
+                COALESCE((SELECT MAX(seq) + 1 FROM memory_index WHERE chat_id = NEW.chat_id), 0),
+                NEW.id
+            );
+        END
+    """)
+    # Messages stored before the index existed are numbered in id order.
+    if conn.execute("SELECT 1 FROM memory_index LIMIT 1").fetchone() is None:
+        cursor = conn.execute("""
+            INSERT INTO memory_index (chat_id, seq, message_id)
+            SELECT chat_id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id) - 1, id
+            FROM messages
+            WHERE text NOT LIKE '/%'
+        """)
+        logger.info(f"Backfilled memory index with {cursor.rowcount} messages")
+
+
+def migration_3_hot_query_indexes(conn):
+    """Adds the indexes behind /debug, /view_birthdays and the scheduled jobs."""
+    # count_messages: COUNT(*) and the latest entries per chat.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp
+        ON messages (chat_id, timestamp)
+    """)
+    # get_birthdays_list: covering, already in (month, day) order per chat.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_birthdays_chat_month_day
+        ON birthdays (chat_id, month, day, name)
+    """)
+    # get_today_birthdays: every chat's birthdays on one date.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_birthdays_month_day
+        ON birthdays (month, day)
+    """)
+
+
+def migration_4_bot_state(conn):
+    """Adds a small key/value table for process-spanning bot state."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+
+
+def migration_5_search_index(conn):
+    """Adds an FTS5 full-text index over messages.text for /search.
+
+    The index uses messages as external content, so it stores only the
+    inverted index, not a second copy of the text. Triggers keep new rows in
+    sync; rows that existed before this migration are indexed later in small
+    batches (see DatabaseManager.backfill_search_index) so the migration
+    itself stays instant. bot_state tracks the not-yet-indexed id range
+    [fts_backfill_next, fts_backfill_end].
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            text,
+            chat_id UNINDEXED,
+            content='messages',
+            content_rowid='id'
+        )
+    """)
+    end = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+    conn.executemany(
+        "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)",
+        [("fts_backfill_next", "1"), ("fts_backfill_end", str(end))],
+    )
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert
+        AFTER INSERT ON messages
+        WHEN NEW.text NOT LIKE '/%'
+        BEGIN
+            INSERT INTO messages_fts (rowid, text, chat_id) VALUES (NEW.id, NEW.text, NEW.chat_id);
+        END
+    """)
+    # External-content FTS must only be told to delete rows it has indexed.
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete
+        AFTER DELETE ON messages
+        WHEN OLD.text NOT LIKE '/%' AND (
+            OLD.id > CAST((SELECT value FROM bot_state WHERE key = 'fts_backfill_end') AS INTEGER)
+            OR OLD.id < CAST((SELECT value FROM bot_state WHERE key = 'fts_backfill_next') AS INTEGER)
+        )
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text, chat_id)
+            VALUES ('delete', OLD.id, OLD.text, OLD.chat_id);
+        END
+    """)
+
+
+RECENT_SLOTS = 5
+
+
+def migration_6_chat_stats(conn):
+    """Adds incrementally maintained per-chat statistics for /debug.
+
+    An insert trigger updates the totals, per-user and per-day counters and a
+    ring buffer of the latest RECENT_SLOTS message ids in the same
+    transaction as the message itself, so /debug never has to count rows.
+    Existing messages are aggregated once here.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_stats (
+            chat_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL,
+            first_timestamp TEXT NOT NULL,
+            last_timestamp TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_user_stats (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            message_count INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_daily_stats (
+            chat_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, day)
+        ) WITHOUT ROWID
+    """)
+    # Ring buffer: message number n of a chat lives in slot n % RECENT_SLOTS.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_recent (
+            chat_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, slot)
+        ) WITHOUT ROWID
+    """)
+
+    # One-time backfill from the existing history.
+    conn.execute("""
+        INSERT OR REPLACE INTO chat_stats (chat_id, message_count, first_timestamp, last_timestamp)
+        SELECT chat_id, COUNT(*), MIN(timestamp), MAX(timestamp) FROM messages GROUP BY chat_id
+    """)
+    # With MAX(id), SQLite takes the bare username column from the newest row.
+    conn.execute("""
+        INSERT OR REPLACE INTO chat_user_stats (chat_id, user_id, username, message_count)
+        SELECT chat_id, user_id, username, cnt FROM (
+            SELECT chat_id, user_id, username, COUNT(*) AS cnt, MAX(id)
+            FROM messages GROUP BY chat_id, user_id
+        )
+    """)
+    conn.execute("""
+        INSERT OR REPLACE INTO chat_daily_stats (chat_id, day, message_count)
+        SELECT chat_id, substr(timestamp, 1, 10), COUNT(*) FROM messages
+        GROUP BY chat_id, substr(timestamp, 1, 10)
+    """)
+    conn.execute(f"""
+        INSERT OR REPLACE INTO chat_recent (chat_id, slot, message_id)
+        SELECT r.chat_id, (s.message_count - r.rn + 1) % {RECENT_SLOTS}, r.id
+        FROM (
+            SELECT chat_id, id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id DESC) AS rn
+            FROM messages
+        ) r JOIN chat_stats s ON s.chat_id = r.chat_id
+        WHERE r.rn <= {RECENT_SLOTS}
+    """)
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS chat_stats_insert
+        AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO chat_stats (chat_id, message_count, first_timestamp, last_timestamp)
+            VALUES (NEW.chat_id, 1, NEW.timestamp, NEW.timestamp)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                message_count = message_count + 1,
+                first_timestamp = min(first_timestamp, excluded.first_timestamp),
+                last_timestamp = max(last_timestamp, excluded.last_timestamp);
+
+            INSERT INTO chat_user_stats (chat_id, user_id, username, message_count)
+            VALUES (NEW.chat_id, NEW.user_id, NEW.username, 1)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                message_count = message_count + 1,
+                username = excluded.username;
+
+            INSERT INTO chat_daily_stats (chat_id, day, message_count)
+            VALUES (NEW.chat_id, substr(NEW.timestamp, 1, 10), 1)
+            ON CONFLICT (chat_id, day) DO UPDATE SET message_count = message_count + 1;
+
+            INSERT OR REPLACE INTO chat_recent (chat_id, slot, message_id)
+            VALUES (
+                NEW.chat_id,
+                (SELECT message_count FROM chat_stats WHERE chat_id = NEW.chat_id) % {RECENT_SLOTS},
+                NEW.id
+            );
+        END
+    """)
+
+
+def migration_7_birthday_calendar(conn):
+    """Adds per-chat timezones and a change counter for the birthday cache.
+
+    Triggers bump bot_state.birthdays_version on every change to birthdays
+    or chat_settings, so each process can tell with one primary-key read
+    whether its in-memory BirthdayCalendar is still current.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_settings (
+            chat_id INTEGER PRIMARY KEY,
+            timezone TEXT
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO bot_state (key, value) VALUES ('birthdays_version', '0')")
+    for table in ("birthdays", "chat_settings"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE bot_state SET value = CAST(value AS INTEGER) + 1
+                    WHERE key = 'birthdays_version';
+                END
+            """)
+
+
+def migration_8_message_archive(conn):
+    """Adds the cold tier: compressed per-chat, per-month message segments.
+
+    archive_segments rows are written by DatabaseManager.archive_messages
+    (see archive.py for the blob format); users interns the (user_id,
+    username) pairs the segments refer to. Stats, memory_index and
+    chat_recent keep pointing at archived message ids; readers fall back to
+    the segments when a message is no longer in the hot table.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_user_username
+        ON users (user_id, username)
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    """)
+    # Finding the segment of an archived message id: covering, no blob reads.
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archive_segments_chat_first
+        ON archive_segments (chat_id, first_id, last_id)
+    """)
+
+
+def migration_9_telegram_message_ids(conn):
+    """Records Telegram message ids so imported history can be deduplicated.
+
+    messages.message_id is the id Telegram gives a message within its chat;
+    rows stored before this migration have none. Their coverage is kept per
+    chat in legacy_history (first and last timestamp), so an import can skip
+    export messages from that period. archived_message_ids keeps the ids of
+    messages moved to the archive, which no longer have a hot row.
+    """
+    if "message_id" not in _columns(conn, "messages"):
+        conn.execute("ALTER TABLE messages ADD COLUMN message_id INTEGER")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_message_id
+        ON messages (chat_id, message_id) WHERE message_id IS NOT NULL
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_message_ids (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS legacy_history (
+            chat_id INTEGER PRIMARY KEY,
+            first_timestamp TEXT NOT NULL,
+            last_timestamp TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT OR REPLACE INTO legacy_history (chat_id, first_timestamp, last_timestamp)
+        SELECT chat_id, first_timestamp, last_timestamp FROM chat_stats
+    """)
+
+
+# month * 100 + day of an ISO timestamp; Feb 29 counts as Feb 28 so its
+# messages come up every year.
+MONTH_DAY_SQL = """
+    CASE WHEN substr({ts}, 6, 5) = '02-29' THEN 228
+    ELSE CAST(substr({ts}, 6, 2) AS INTEGER) * 100 + CAST(substr({ts}, 9, 2) AS INTEGER) END
+"""
+
+
+def migration_10_memory_days(conn):
+    """Adds a calendar-day index of memories for "on this day" throwbacks.
+
+    memory_days numbers every memory densely per (chat, month_day, year), so
+    the messages of one calendar day in earlier years are counted with one
+    index seek per year and picked uniformly with a primary-key lookup, the
+    same scheme as memory_index. Like memory_index it keeps entries for
+    archived messages; existing messages (hot and archived) are backfilled
+    here.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS memory_days (
+            chat_id INTEGER NOT NULL,
+            month_day INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, month_day, year, seq)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS memory_days_insert
+        AFTER INSERT ON messages
+        WHEN NEW.text NOT LIKE '/%'
+        BEGIN
+            INSERT INTO memory_days (chat_id, month_day, year, seq, message_id)
+            SELECT NEW.chat_id, d.month_day, d.year,
+                   COALESCE((SELECT MAX(seq) + 1 FROM memory_days
+                             WHERE chat_id = NEW.chat_id AND month_day = d.month_day AND year = d.year), 0),
+                   NEW.id
+            FROM (SELECT {MONTH_DAY_SQL.format(ts="NEW.timestamp")} AS month_day,
+                         CAST(substr(NEW.timestamp, 1, 4) AS INTEGER) AS year) d;
+        END
+    """)
+
+    # Backfill: archived messages only exist inside their segments.
+    conn.execute("CREATE TEMP TABLE memory_days_backfill (id INTEGER, chat_id INTEGER, timestamp TEXT)")
+    conn.execute("""
+        INSERT INTO memory_days_backfill SELECT id, chat_id, timestamp FROM messages
+        WHERE text NOT LIKE '/%'
+    """)
+    for chat_id, blob in conn.execute("SELECT chat_id, data FROM archive_segments").fetchall():
+        conn.executemany(
+            "INSERT INTO memory_days_backfill VALUES (?, ?, ?)",
+            [(message_id, chat_id, archive.from_epoch(timestamp))
+             for message_id, (_, timestamp, text) in archive.decode_segment(blob).items()
+             if text and not text.startswith("/")],
+        )
+    cursor = conn.execute(f"""
+        INSERT INTO memory_days (chat_id, month_day, year, seq, message_id)
+        SELECT chat_id, month_day, year,
+               ROW_NUMBER() OVER (PARTITION BY chat_id, month_day, year ORDER BY id) - 1, id
+        FROM (SELECT id, chat_id, {MONTH_DAY_SQL.format(ts="timestamp")} AS month_day,
+                     CAST(substr(timestamp, 1, 4) AS INTEGER) AS year
+              FROM memory_days_backfill)
+    """)
+    conn.execute("DROP TABLE memory_days_backfill")
+    logger.info(f"Backfilled memory_days with {cursor.rowcount} messages")
+
+
+def migration_11_message_id_floor(conn):
+    """Rebuilds messages with AUTOINCREMENT so archived ids are never reused.
+
+    Without it SQLite hands out MAX(id) + 1, so archiving the newest rows
+    would let the next message take an id that memory_index, memory_days,
+    chat_recent and the archive segments still use for the archived one.
+    The legacy layout already has AUTOINCREMENT; either way the sequence is
+    set above every id still referenced anywhere.
+    """
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()[0]
+    if "AUTOINCREMENT" not in sql.upper():
+        # Triggers and indexes go with the old table; recreate them from their SQL.
+        dependents = [row[0] for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = 'messages' AND type IN ('index', 'trigger') "
+            "AND sql IS NOT NULL"
+        )]
+        new_sql = re.sub(r"\bid\s+INTEGER\s+PRIMARY\s+KEY\b", "id INTEGER PRIMARY KEY AUTOINCREMENT",
+                         sql, count=1, flags=re.IGNORECASE)
+        new_sql = re.sub(r"^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?\"?messages\"?",
+                         "CREATE TABLE messages_rebuild", new_sql, count=1, flags=re.IGNORECASE)
+        conn.execute(new_sql)
+        cursor = conn.execute("INSERT INTO messages_rebuild SELECT * FROM messages")
+        conn.execute("DROP TABLE messages")
+        conn.execute("ALTER TABLE messages_rebuild RENAME TO messages")
+        for dependent in dependents:
+            conn.execute(dependent)
+        logger.info(f"Rebuilt messages with AUTOINCREMENT ({cursor.rowcount} rows)")
+
+    floor = conn.execute("""
+        SELECT MAX(COALESCE((SELECT MAX(id) FROM messages), 0),
+                   COALESCE((SELECT MAX(last_id) FROM archive_segments), 0),
+                   COALESCE((SELECT MAX(message_id) FROM memory_index), 0),
+                   COALESCE((SELECT MAX(message_id) FROM memory_days), 0),
+                   COALESCE((SELECT MAX(message_id) FROM chat_recent), 0),
+                   COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'messages'), 0))
+    """).fetchone()[0]
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'messages'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)", (floor,))
+
+
+MIGRATIONS = [
+    migration_1_base_schema,
+    migration_2_memory_index,
+    migration_3_hot_query_indexes,
+    migration_4_bot_state,
+    migration_5_search_index,
+    migration_6_chat_stats,
+    migration_7_birthday_calendar,
+    migration_8_message_archive,
+    migration_9_telegram_message_ids,
+    migration_10_memory_days,
+    migration_11_message_id_floor,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Applies all pending migrations in order and returns the resulting version."""
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if get_version(conn) >= version:
+            continue
+        # BEGIN IMMEDIATE takes the write lock up front; re-check the version
+        # under the lock in case another worker migrated in the meantime.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied migration {version}: {migration.__name__}")
+    return get_version(conn)
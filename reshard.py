@@ -0,0 +1,121 @@
+"""Splits a single bot database into chat-hash shards (offline).
+
+    python reshard.py bot_data.db 4
+
+writes bot_data.0-of-4.db ... bot_data.3-of-4.db next to the source and
+leaves the source untouched; start the bot with BOT_DB_SHARDS=4 afterwards.
+Stop the bot first: messages written to the source during the split are not
+copied.
+
+Every shard starts as an online-backup copy of the source and then drops the
+chats that hash to other shards, so ids, memory sequence numbers, stats,
+archive segments and birthdays carry over unchanged. The search index is
+rebuilt per shard.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from database import DatabaseManager, resolve_db_path
+from sharding import SHARD_KEY, shard_for, shard_paths
+
+logger = logging.getLogger(__name__)
+
+# Every table keyed by chat_id (users and bot_state are bot-wide and copied as is).
+CHAT_TABLES = (
+    "messages", "memory_index", "memory_days", "chat_stats", "chat_user_stats", "chat_daily_stats",
+    "chat_recent", "birthdays", "chat_settings", "archive_segments", "archived_message_ids",
+    "legacy_history",
+)
+
+
+def split_shard(source_path, target_path, index, shards, batch_size=50000):
+    """Writes shard `index` of `shards` to target_path; returns its message count."""
+    with sqlite3.connect(source_path) as source, sqlite3.connect(target_path) as target:
+        source.backup(target)
+    target = sqlite3.connect(target_path, isolation_level=None)
+    try:
+        target.create_function("shard_of", 1, lambda chat_id: shard_for(chat_id, shards), deterministic=True)
+        target.execute("BEGIN")
+        # Drop the search index up front and let the backfill rebuild it: the
+        # FTS delete trigger then skips the rows removed below (that would be
+        # one index update per foreign message).
+        end = target.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        target.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+        target.executemany(
+            "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)",
+            [("fts_backfill_next", "1"), ("fts_backfill_end", str(end)), (SHARD_KEY, f"{index}/{shards}")],
+        )
+        for table in CHAT_TABLES:
+            target.execute(f"DELETE FROM {table} WHERE shard_of(chat_id) != ?", (index,))
+        target.execute("COMMIT")
+    finally:
+        target.close()
+
+    manager = DatabaseManager(target_path, write_behind=False)
+    try:
+        while manager.backfill_search_index(batch_size=batch_size) > 0:
+            pass
+        manager.pool.get().execute("VACUUM")
+        report = manager.archive_report()
+        mismatches = manager.check_chat_stats()
+    finally:
+        manager.close()
+    if mismatches:
+        raise RuntimeError(f"Shard {index} stats do not match its messages: {mismatches[:5]}")
+    return report["hot_messages"] + report["archived_messages"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path", help="Unsharded database to split.")
+    parser.add_argument("shards", type=int, help="Number of shards (2 or more).")
+    parser.add_argument("--force", action="store_true", help="Overwrite existing shard files.")
+    args = parser.parse_args()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.WARNING
+    )
+
+    source_path = resolve_db_path(args.db_path)
+    if args.shards < 2:
+        sys.exit("Nothing to do: use 2 or more shards.")
+    if not os.path.exists(source_path):
+        sys.exit(f"{source_path} does not exist.")
+    targets = shard_paths(source_path, args.shards)
+    existing = [path for path in targets if os.path.exists(path)]
+    if existing and not args.force:
+        sys.exit(f"Shard files already exist (use --force to overwrite): {', '.join(existing)}")
+
+    # Bring the source to the current schema and make sure it is not itself a shard.
+    source = DatabaseManager(source_path, write_behind=False)
+    try:
+        if source.get_state(SHARD_KEY) not in (None, "0/1"):
+            sys.exit(f"{source_path} is already shard {source.get_state(SHARD_KEY)}; reshard from one file.")
+        source.pool.get().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        report = source.archive_report()
+        total = report["hot_messages"] + report["archived_messages"]
+    finally:
+        source.close()
+
+    copied = 0
+    for index, target_path in enumerate(targets):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(target_path + suffix):
+                os.remove(target_path + suffix)
+        start = time.perf_counter()
+        count = split_shard(source_path, target_path, index, args.shards)
+        copied += count
+        print(f"{os.path.basename(target_path)}: {count} messages, "
+              f"{os.path.getsize(target_path) / 1e6:.1f} MB in {time.perf_counter() - start:.1f} s")
+
+    if copied != total:
+        sys.exit(f"FAIL: shards hold {copied} messages, source has {total}.")
+    print(f"OK: {total} messages split into {args.shards} shards. "
+          f"Start the bot with BOT_DB_SHARDS={args.shards}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Chat-sharded storage: one SQLite file per shard, routed by chat_id.
+
+SQLite allows one writer per file, so with every chat in one file all
+groups queue behind the same write lock. ShardedDatabaseManager keeps N
+DatabaseManagers (each with its own connections, write-behind buffer and
+birthday calendar) and exposes the DatabaseManager interface: chat-scoped
+calls go to the chat's shard, cross-chat calls fan out to all shards in
+parallel and merge. Bot-wide state (bot_state) lives in shard 0.
+
+A single existing file is split with reshard.py.
+"""
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager, resolve_db_path, writes
+
+logger = logging.getLogger(__name__)
+
+SHARD_KEY = "shard"
+
+
+def shard_for(chat_id, shards):
+    """Stable shard index of a chat (the same in every process and Python version)."""
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+def shard_paths(db_path, shards):
+    """bot_data.db -> [bot_data.0-of-4.db, ...]; one shard keeps the plain path."""
+    db_path = resolve_db_path(db_path)
+    if shards == 1:
+        return [db_path]
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.{i}-of-{shards}{ext}" for i in range(shards)]
+
+
+class ShardedDatabaseManager:
+    """DatabaseManager interface over `shards` SQLite files."""
+
+    def __init__(self, db_path, shards, write_behind=True):
+        self.db_path = resolve_db_path(db_path)
+        self.shard_count = shards
+        paths = shard_paths(db_path, shards)
+        if shards > 1 and os.path.exists(self.db_path) and not all(map(os.path.exists, paths)):
+            # Starting empty shards next to the old file would silently hide its history.
+            raise RuntimeError(
+                f"{self.db_path} is not sharded yet; run `python reshard.py {self.db_path} {shards}` first."
+            )
+        self.shards = [DatabaseManager(path, write_behind=write_behind) for path in paths]
+        # One thread per shard, so fan-out calls keep one connection per shard.
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-shard-{i}") for i in range(shards)
+        ]
+        for index, shard in enumerate(self.shards):
+            self._check_shard(index, shard)
+
+    def _check_shard(self, index, shard):
+        expected = f"{index}/{self.shard_count}"
+        stored = shard.get_state(SHARD_KEY)
+        if stored is None:
+            shard.set_state(SHARD_KEY, expected)
+        elif stored != expected:
+            raise RuntimeError(f"{shard.db_path} holds shard {stored}, expected {expected}.")
+
+    def shard(self, chat_id):
+        return self.shards[shard_for(chat_id, self.shard_count)]
+
+    def _fan_out_chats(self, chat_ids, call):
+        """Runs call(shard, its chat ids) in parallel on the shards holding chat_ids; returns the results."""
+        by_shard = {}
+        for chat_id in chat_ids:
+            by_shard.setdefault(shard_for(chat_id, self.shard_count), []).append(chat_id)
+        futures = [
+            self._executors[index].submit(call, self.shards[index], ids)
+            for index, ids in by_shard.items()
+        ]
+        return [future.result() for future in futures]
+
+    def _fan_out(self, method, *args, **kwargs):
+        """Calls a DatabaseManager method on every shard in parallel; returns results in shard order."""
+        futures = [
+            executor.submit(getattr(shard, method), *args, **kwargs)
+            for shard, executor in zip(self.shards, self._executors)
+        ]
+        return [future.result() for future in futures]
+
+    def close(self):
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+    # --- Whole-database operations ---
+
+    def check_query_plans(self):
+        return self.shards[0].check_query_plans()
+
+    def check_chat_stats(self):
+        return [mismatch for result in self._fan_out("check_chat_stats") for mismatch in result]
+
+    def flush_messages(self):
+        self._fan_out("flush_messages")
+
+    def buffer_stats(self):
+        results = [stats for stats in self._fan_out("buffer_stats") if stats is not None]
+        if not results:
+            return None
+        merged = {}
+        for stats in results:
+            for key, value in stats.items():
+                merged[key] = max(merged.get(key, 0), value) if key.startswith("max_") else \
+                    merged.get(key, 0) + value
+        merged["avg_flush_ms"] = merged["total_flush_ms"] / merged["flushes"] if merged["flushes"] else 0.0
+        return merged
+
+    def storage_bytes(self):
+        return sum(self._fan_out("storage_bytes"))
+
+    def archive_report(self):
+        merged = {}
+        for report in self._fan_out("archive_report"):
+            for key, value in report.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    @writes
+    def backfill_search_index(self, batch_size=2000):
+        remaining = self._fan_out("backfill_search_index", batch_size=batch_size)
+        return -1 if any(r < 0 for r in remaining) else sum(remaining)
+
+    @writes
+    def archive_messages(self, cutoff, max_rows=2000):
+        return sum(self._fan_out("archive_messages", cutoff, max_rows=max_rows))
+
+    # --- Bot-wide state (shard 0) ---
+
+    @writes
+    def set_state(self, key, value):
+        return self.shards[0].set_state(key, value)
+
+    def get_state(self, key, default=None):
+        return self.shards[0].get_state(key, default)
+
+    @writes
+    def delete_states(self, keys):
+        return self.shards[0].delete_states(keys)
+
+    def get_states(self, prefix):
+        return self.shards[0].get_states(prefix)
+
+    # --- Chat-scoped operations ---
+
+    @writes
+    def store_message(self, chat_id, user_id, username, text, message_id=None):
+        return self.shard(chat_id).store_message(chat_id, user_id, username, text, message_id)
+
+    @writes
+    def import_messages(self, rows, state_key=None, state=None):
+        # Shard 0 goes last and stores the import position, so a crash in
+        # between replays the batch on the other shards (skipped by message id).
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(shard_for(row[0], self.shard_count), []).append(row)
+        futures = [
+            self._executors[index].submit(self.shards[index].import_messages, batch)
+            for index, batch in by_shard.items() if index != 0
+        ]
+        results = [future.result() for future in futures]
+        results.append(self.shards[0].import_messages(by_shard.get(0, []), state_key, state))
+        if any(result is None for result in results):
+            return None
+        return sum(imported for imported, _ in results), sum(skipped for _, skipped in results)
+
+    @writes
+    def store_birthday(self, chat_id, user_id, username, name, day, month):
+        # A user has one birthday bot-wide; drop it from the shard of their previous chat.
+        target = self.shard(chat_id)
+        for shard in self.shards:
+            if shard is not target:
+                shard.delete_birthday(user_id)
+        return target.store_birthday(chat_id, user_id, username, name, day, month)
+
+    @writes
+    def set_chat_timezone(self, chat_id, tz_name):
+        return self.shard(chat_id).set_chat_timezone(chat_id, tz_name)
+
+    def get_random_messages(self, chat_id, limit=1):
+        return self.shard(chat_id).get_random_messages(chat_id, limit)
+
+    def get_day_messages(self, chat_id, today, limit=1, window=3):
+        return self.shard(chat_id).get_day_messages(chat_id, today, limit, window)
+
+    def search_messages(self, chat_id, query, page=1, page_size=5):
+        return self.shard(chat_id).search_messages(chat_id, query, page, page_size)
+
+    def get_chat_stats(self, chat_id, top_posters=3, days=7):
+        return self.shard(chat_id).get_chat_stats(chat_id, top_posters, days)
+
+    def get_birthdays_list(self, chat_id):
+        return self.shard(chat_id).get_birthdays_list(chat_id)
+
+    def render_birthdays(self, chat_id, render):
+        return self.shard(chat_id).render_birthdays(chat_id, render)
+
+    # --- Cross-chat reads (fan out) ---
+
+    def get_chat_ids(self):
+        return sorted(chat_id for result in self._fan_out("get_chat_ids") for chat_id in result)
+
+    def get_random_memories(self, chat_ids=None):
+        if chat_ids is None:
+            results = self._fan_out("get_random_memories")
+        else:
+            results = self._fan_out_chats(chat_ids, lambda shard, ids: shard.get_random_memories(ids))
+        memories = {}
+        for result in results:
+            memories.update(result)
+        return memories
+
+    def get_day_memories(self, today, chat_ids=None, window=3):
+        if chat_ids is None:
+            results = self._fan_out("get_day_memories", today, window=window)
+        else:
+            results = self._fan_out_chats(
+                chat_ids, lambda shard, ids: shard.get_day_memories(today, ids, window)
+            )
+        memories = {}
+        for result in results:
+            memories.update(result)
+        return memories
+
+    def get_today_birthdays(self, month, day):
+        return [row for result in self._fan_out("get_today_birthdays", month, day) for row in result]
+
+    def get_due_birthdays(self, now, hour, default_tz=None):
+        return [row for result in self._fan_out("get_due_birthdays", now, hour, default_tz) for row in result]
+
+    def get_chat_timezones(self):
+        timezones = {}
+        for result in self._fan_out("get_chat_timezones"):
+            timezones.update(result)
+        return timezones
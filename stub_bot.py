@@ -0,0 +1,205 @@
+"""A local stand-in for the Telegram Bot API, for offline tests and benchmarks.
+
+Point PTB at it with ``Application.builder().base_url(stub.base_url)``. It
+answers the methods the bot uses, records what was sent, can add latency and
+enforces Telegram-style flood limits by answering 429 with retry_after.
+"""
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    "id": 1000000001,
+    "is_bot": True,
+    "first_name": "Stub",
+    "username": "stub_memory_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": True,
+    "supports_inline_queries": False,
+}
+
+
+class StubBotAPI:
+    """Threaded HTTP server that mimics the Bot API endpoints the bot calls.
+
+    latency: seconds every request takes.
+    global_rate: sendMessage calls per second allowed across all chats (None = unlimited).
+    per_chat_interval: minimum seconds between two messages to one chat (0 = unlimited).
+    forbidden_chats: chat ids that answer 403, like a group that removed the bot.
+    """
+
+    def __init__(self, latency=0.0, global_rate=None, per_chat_interval=0.0,
+                 forbidden_chats=(), retry_after=1, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.forbidden_chats = set(forbidden_chats)
+        self.retry_after = retry_after
+        self.sent = []
+        self.counters = {"requests": 0, "sent": 0, "flood_limited": 0, "forbidden": 0}
+        self._lock = threading.Lock()
+        self._tokens = float(global_rate or 0)
+        self._refilled = time.monotonic()
+        self._last_by_chat = {}
+        self._message_id = 0
+        # getWebhookInfo state; tests set pending_update_count to simulate a backlog.
+        self.webhook = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Bot API methods ---
+
+    def call(self, method, params):
+        """Dispatches one Bot API call; returns (HTTP status, JSON body)."""
+        with self._lock:
+            self.counters["requests"] += 1
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+        return handler(params)
+
+    def api_getMe(self, params):
+        return 200, {"ok": True, "result": BOT_USER}
+
+    def api_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        if chat_id in self.forbidden_chats:
+            with self._lock:
+                self.counters["forbidden"] += 1
+            return 403, {"ok": False, "error_code": 403,
+                         "description": "Forbidden: bot was kicked from the group chat"}
+
+        now = time.monotonic()
+        with self._lock:
+            if self._flood_limited(chat_id, now):
+                self.counters["flood_limited"] += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+            self._last_by_chat[chat_id] = now
+            self._message_id += 1
+            message = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            self.sent.append(message)
+            self.counters["sent"] += 1
+        return 200, {"ok": True, "result": message}
+
+    def api_setWebhook(self, params):
+        params = {key: _json_param(value) for key, value in params.items()}
+        with self._lock:
+            if params.get("drop_pending_updates"):
+                self.webhook["pending_update_count"] = 0
+            self.webhook["url"] = params.get("url", "")
+            for key in ("max_connections", "allowed_updates", "ip_address"):
+                if key in params:
+                    self.webhook[key] = params[key]
+                else:
+                    self.webhook.pop(key, None)
+        return 200, {"ok": True, "result": True, "description": "Webhook was set"}
+
+    def api_deleteWebhook(self, params):
+        with self._lock:
+            if _json_param(params.get("drop_pending_updates", False)):
+                self.webhook["pending_update_count"] = 0
+            self.webhook = {"url": "", "has_custom_certificate": False,
+                            "pending_update_count": self.webhook["pending_update_count"]}
+        return 200, {"ok": True, "result": True, "description": "Webhook was deleted"}
+
+    def api_getWebhookInfo(self, params):
+        with self._lock:
+            return 200, {"ok": True, "result": dict(self.webhook)}
+
+    def _flood_limited(self, chat_id, now):
+        if self.per_chat_interval:
+            last = self._last_by_chat.get(chat_id)
+            if last is not None and now - last < self.per_chat_interval:
+                return True
+        if self.global_rate:
+            self._tokens = min(self.global_rate, self._tokens + (now - self._refilled) * self.global_rate)
+            self._refilled = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+        return False
+
+    # --- HTTP plumbing ---
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without TCP_NODELAY
+            # Nagle + delayed ACK add ~40 ms to every keep-alive response.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._dispatch({})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                self._dispatch(params)
+
+            def _dispatch(self, params):
+                # Path is /bot<token>/<method>
+                method = self.path.rstrip("/").rsplit("/", 1)[-1].split("?")[0]
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, payload = stub.call(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+
+def _json_param(value):
+    """Form-encoded Bot API parameters carry lists, numbers and booleans as JSON strings."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
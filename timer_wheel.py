@@ -0,0 +1,140 @@
+"""Staggered per-chat schedule for periodic broadcasts (a hashed timer wheel).
+
+A job that visits every chat at the same moment makes a spike of DB queries
+and sends, then nothing until the next run. TimerWheel instead gives every
+chat a stable offset inside the interval, hashed from its chat_id, and has
+one slot per tick: each tick releases only the chats of the slots it
+passed, so the same work is spread evenly over the interval. Offsets count
+from midnight on each chat's own wall clock (its timezone), so with an
+interval that divides a day every chat is due at the same local times each
+day, also across DST changes. Adding or removing a chat touches a single
+slot, so the wheel follows new chats incrementally.
+"""
+import logging
+import math
+import zlib
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Chats bucketed by their hashed offset into interval // tick slots."""
+
+    def __init__(self, interval, tick, salt="memory"):
+        interval, tick = int(interval), int(tick)
+        if tick <= 0 or interval % tick:
+            raise ValueError(f"The interval ({interval}s) must be a multiple of the tick ({tick}s).")
+        self.interval = interval
+        self.tick = tick
+        # The salt keeps this hash independent of the shard hash (sharding.shard_for).
+        self.salt = salt
+        self.slots = [set() for _ in range(interval // tick)]
+        self._slot_of = {}
+        self._tz_of = {}       # chat_id -> IANA timezone name (None = server local time)
+        self._tz_chats = {}    # timezone name -> number of chats in it
+        self._zones = {}       # timezone name -> tzinfo
+        self._local_end = {}   # timezone name -> local end of the last due() range
+
+    def offset(self, chat_id):
+        """Seconds into every interval (counted from local midnight) at which chat_id is due."""
+        return zlib.crc32(f"{self.salt}:{chat_id}".encode()) % self.interval
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._slot_of
+
+    def add(self, chat_id, tz_name=None):
+        """Schedules a chat in tz_name; returns False if it was already scheduled.
+
+        A scheduled chat keeps its slot and moves to tz_name if that changed.
+        """
+        if chat_id in self._slot_of:
+            if self._tz_of[chat_id] != tz_name:
+                self._untrack(chat_id)
+                self._track(chat_id, tz_name)
+            return False
+        slot = self.offset(chat_id) // self.tick
+        self.slots[slot].add(chat_id)
+        self._slot_of[chat_id] = slot
+        self._track(chat_id, tz_name)
+        return True
+
+    def discard(self, chat_id):
+        slot = self._slot_of.pop(chat_id, None)
+        if slot is not None:
+            self.slots[slot].discard(chat_id)
+            self._untrack(chat_id)
+
+    def _track(self, chat_id, tz_name):
+        self._tz_of[chat_id] = tz_name
+        self._tz_chats[tz_name] = self._tz_chats.get(tz_name, 0) + 1
+        if tz_name not in self._zones:
+            self._zones[tz_name] = self._zone(tz_name)
+
+    def _untrack(self, chat_id):
+        tz_name = self._tz_of.pop(chat_id)
+        self._tz_chats[tz_name] -= 1
+        if not self._tz_chats[tz_name]:
+            del self._tz_chats[tz_name]
+
+    def sync(self, chat_ids, timezones=None, default_tz=None):
+        """Makes the wheel hold exactly chat_ids; returns (added, removed) counts.
+
+        timezones maps chat_id to an IANA name; other chats use default_tz
+        (None = the server's local time).
+        """
+        chat_ids = set(chat_ids)
+        timezones = timezones or {}
+        added = sum(self.add(chat_id, timezones.get(chat_id) or default_tz) for chat_id in chat_ids)
+        gone = [chat_id for chat_id in self._slot_of if chat_id not in chat_ids]
+        for chat_id in gone:
+            self.discard(chat_id)
+        return added, len(gone)
+
+    def due(self, start, end):
+        """Returns the chats due in [start, end) (Unix seconds), each at most once.
+
+        A chat is due when a tick boundary of its slot falls in the range as
+        read on its timezone's clock; a range of a whole interval or more
+        (e.g. after downtime) returns every chat once. Slots skipped when DST
+        starts are due at the jump; the hour repeated when it ends is not
+        sent twice.
+        """
+        if end - start >= self.interval:
+            for tz_name in self._tz_chats:
+                self._local_end[tz_name] = self._local(end, tz_name)
+            return list(self._slot_of)
+        chats = []
+        for tz_name in self._tz_chats:
+            local_start, local_end = self._local(start, tz_name), self._local(end, tz_name)
+            # After the clock goes back, wait until it passes where it was.
+            local_start = max(local_start, self._local_end.get(tz_name, local_start))
+            self._local_end[tz_name] = max(local_end, local_start)
+            if local_end - local_start >= self.interval:
+                chats.extend(c for c, tz in self._tz_of.items() if tz == tz_name)
+                continue
+            first = math.ceil(local_start / self.tick)  # index of the first tick boundary >= start
+            last = math.ceil(local_end / self.tick)
+            for boundary in range(first, last):
+                slot = self.slots[boundary % len(self.slots)]
+                chats.extend(c for c in slot if self._tz_of[c] == tz_name)
+        return chats
+
+    def _local(self, timestamp, tz_name):
+        """timestamp (Unix seconds) shifted by tz_name's UTC offset at that moment."""
+        moment = datetime.fromtimestamp(timestamp, timezone.utc).astimezone(self._zones[tz_name])
+        return timestamp + moment.utcoffset().total_seconds()
+
+    @staticmethod
+    def _zone(tz_name):
+        if tz_name is None:
+            return None  # astimezone(None) is the server's local time, DST included
+        try:
+            return ZoneInfo(tz_name)
+        except Exception:
+            logger.error(f"Unknown timezone {tz_name!r}, using UTC")
+            return timezone.utc
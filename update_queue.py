@@ -0,0 +1,351 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib decoder is used without it
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+# Update fields that carry the chat an update belongs to.
+CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def chat_key(update_data):
+    """Returns the chat an update belongs to (falls back to the sender or update id)."""
+    for field in CHAT_FIELDS:
+        payload = update_data.get(field)
+        if payload and "chat" in payload:
+            return payload["chat"].get("id")
+    callback = update_data.get("callback_query")
+    if callback:
+        message = callback.get("message") or {}
+        if "chat" in message:
+            return message["chat"].get("id")
+        return (callback.get("from") or {}).get("id")
+    return update_data.get("update_id")
+
+
+def decode_update(body):
+    """Parses a raw webhook body; returns the update dict, or None if it is not one."""
+    try:
+        update_data = _loads(body)
+    except ValueError:
+        return None
+    if not isinstance(update_data, dict) or not isinstance(update_data.get("update_id"), int):
+        return None
+    return update_data
+
+
+def plain_group_text(update_data):
+    """Returns (chat_id, user_id, username, text, message_id) for plain group text, else None.
+
+    Such updates only ever end up in collect_message, so the webhook can store
+    them without building an Update and dispatching it through PTB. Commands,
+    replies to the bot (birthday replies), edits and non-text messages return
+    None and take the normal path.
+    """
+    message = update_data.get("message")
+    if message is None or len(update_data) != 2:
+        return None
+    text = message.get("text")
+    sender = message.get("from")
+    chat = message.get("chat") or {}
+    if not text or text.startswith("/") or sender is None or chat.get("type") not in ("group", "supergroup"):
+        return None
+    reply = message.get("reply_to_message")
+    if reply is not None and (reply.get("from") or {}).get("is_bot"):
+        return None
+    # Same fallback as effective_user.username or effective_user.full_name
+    username = sender.get("username")
+    if not username:
+        username = sender.get("first_name", "")
+        if sender.get("last_name"):
+            username = f"{username} {sender['last_name']}"
+    return chat["id"], sender["id"], username, text, message.get("message_id")
+
+
+class UpdateQueue:
+    """Bounded queue between the Flask webhook route and PTB.
+
+    The route only calls submit() and returns; a background thread runs an
+    event loop with `workers` async workers that decode the updates and feed
+    them to application.process_update(). Updates of one chat always go to
+    the same worker, which handles them one at a time, so per-chat order is
+    preserved while different chats are processed concurrently.
+
+    At most max_pending updates are queued or in flight. When full, submit()
+    waits up to put_timeout seconds for a slot and then gives up, so the
+    webhook can push back on Telegram instead of buffering without bound.
+    """
+
+    def __init__(self, application, workers=8, max_pending=1000, put_timeout=2.0):
+        self.application = application
+        self.workers = workers
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+        self._closing = False
+        self._loop = None
+        self._queues = []
+        self._thread = None
+        self._counters = {
+            "submitted": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+            "in_flight": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "total_processing_ms": 0.0,
+            "max_processing_ms": 0.0,
+        }
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Starts the worker event loop thread and the PTB application."""
+        self._thread = threading.Thread(target=self._run_loop, name="update-queue", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        logger.info(f"Update queue started with {self.workers} workers (max {self.max_pending} pending).")
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._started.set()
+
+        if not await self._start_application():
+            return
+        try:
+            await asyncio.gather(*(self._worker(queue) for queue in self._queues))
+        finally:
+            await self.application.stop()
+            await self.application.shutdown()
+
+    async def _start_application(self):
+        """Initializes and starts PTB, retrying while Telegram is unreachable."""
+        delay = 1.0
+        while not self._closing:
+            try:
+                await self.application.initialize()
+                await self.application.start()
+                return True
+            except Exception as e:
+                logger.error(f"Failed to start application, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+        return False
+
+    def stop(self, timeout=10.0):
+        """Stops accepting updates, drains what is queued and stops PTB."""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._closing = True
+            for queue in self._queues:
+                # The sentinel lands behind everything already queued.
+                self._loop.call_soon_threadsafe(queue.put_nowait, None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Update queue did not drain within {timeout}s.")
+        else:
+            logger.info("Update queue drained and stopped.")
+
+    # --- Producer side (Flask threads) ---
+
+    def submit(self, update_data):
+        """Queues a raw update. Returns False if the queue is closed or stays full."""
+        arrived = time.monotonic()
+        acquired = not self._closing and self._slots.acquire(timeout=self.put_timeout)
+        queue = self._queues[hash(chat_key(update_data)) % self.workers]
+        with self._lock:
+            # Checked under the lock so nothing lands behind stop()'s sentinels.
+            if not acquired or self._closing:
+                if acquired:
+                    self._slots.release()
+                self._counters["rejected"] += 1
+                return False
+            self._counters["submitted"] += 1
+            self._counters["in_flight"] += 1
+            self._loop.call_soon_threadsafe(queue.put_nowait, (arrived, update_data))
+        return True
+
+    # --- Consumer side (event loop thread) ---
+
+    async def _worker(self, queue):
+        # Imported here rather than at module level: the webhook module uses
+        # decode_update/plain_group_text before PTB is loaded (lazy bootstrap).
+        from telegram import Update
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            arrived, update_data = item
+            started = time.monotonic()
+            failed = False
+            try:
+                update = Update.de_json(update_data, self.application.bot)
+                await self.application.process_update(update)
+            except Exception as e:
+                failed = True
+                logger.error(f"Error processing update {update_data.get('update_id')}: {e}")
+            finally:
+                self._slots.release()
+                self._record(arrived, started, failed)
+
+    def _record(self, arrived, started, failed):
+        finished = time.monotonic()
+        wait_ms = (started - arrived) * 1000
+        processing_ms = (finished - started) * 1000
+        with self._lock:
+            counters = self._counters
+            counters["in_flight"] -= 1
+            counters["failed" if failed else "processed"] += 1
+            counters["total_wait_ms"] += wait_ms
+            counters["max_wait_ms"] = max(counters["max_wait_ms"], wait_ms)
+            counters["total_processing_ms"] += processing_ms
+            counters["max_processing_ms"] = max(counters["max_processing_ms"], processing_ms)
+
+    def stats(self):
+        """Returns queue depth, wait time and processing time counters."""
+        with self._lock:
+            stats = dict(self._counters)
+        done = stats["processed"] + stats["failed"]
+        stats["queue_depth"] = stats["in_flight"]
+        stats["avg_wait_ms"] = stats["total_wait_ms"] / done if done else 0.0
+        stats["avg_processing_ms"] = stats["total_processing_ms"] / done if done else 0.0
+        return stats
+
+
+class UpdateDeduplicator:
+    """Drops updates Telegram redelivers, keyed on update_id.
+
+    Recently claimed ids live in an LRU with a TTL, capped at max_size
+    entries, so memory stays flat over weeks of uptime. The highest id
+    accepted (commit()) is persisted through save_mark(mark, saved_at) every
+    persist_interval seconds (and on flush()); after a restart everything at
+    or below the mark load_mark() returns counts as already handled, which
+    covers redeliveries that outlive the process. The mark stays below ids
+    that are claimed but not committed yet, or were released for redelivery
+    (until the TTL); a release that lowers it is persisted right away.
+
+    Telegram numbers updates at random again after a week without any, so
+    the mark only holds for ttl seconds after it was saved, and tracking
+    starts over after ttl seconds without a commit.
+    """
+
+    def __init__(self, load_mark, save_mark, max_size=10000, ttl=3600.0, persist_interval=5.0):
+        self.save_mark = save_mark
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_interval = persist_interval
+        self._seen = OrderedDict()
+        self._open = {}  # update_id -> expiry, for claimed or released ids not committed yet
+        self._lock = threading.Lock()
+        mark, saved_at = load_mark() or (0, 0)
+        age = max(0.0, time.time() - saved_at)
+        self._floor = int(mark) if age < ttl else 0
+        self._floor_until = time.monotonic() + ttl - age
+        self._high = self._floor
+        self._saved = self._floor
+        self._written = False  # whether this process has saved a mark yet
+        self._last_persist = self._last_commit = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def claim(self, update_id):
+        """Returns True the first time an update_id is seen, False for duplicates."""
+        now = time.monotonic()
+        with self._lock:
+            # Entries share one TTL, so the oldest ones are at the front.
+            while self._seen and next(iter(self._seen.values())) <= now:
+                self._seen.popitem(last=False)
+            if self._floor and now >= self._floor_until:
+                self._floor = 0
+
+            if update_id <= self._floor or update_id in self._seen:
+                self.hits += 1
+                return False
+
+            self._seen[update_id] = now + self.ttl
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            self.misses += 1
+            self._open[update_id] = now + self.ttl
+        return True
+
+    def commit(self, update_id):
+        """Records that a claimed update was stored or queued; only then may the mark pass it."""
+        now = time.monotonic()
+        with self._lock:
+            self._open.pop(update_id, None)
+            if now - self._last_commit >= self.ttl:
+                self._high = self._floor  # quiet for a while: ids may start over lower
+            self._high = max(self._high, update_id)
+            self._last_commit = now
+            persist = now - self._last_persist >= self.persist_interval
+            if persist:
+                self._last_persist = now
+        if persist:
+            self.flush()
+
+    def release(self, update_id):
+        """Forgets a claimed id whose update was not accepted, so a redelivery is processed."""
+        with self._lock:
+            self._seen.pop(update_id, None)
+            # Keeps the mark below it, also across a restart, until it is redelivered.
+            self._open[update_id] = time.monotonic() + self.ttl
+            # Other processes only see this process's mark once it is saved.
+            lowered = not self._written or self._mark() < self._saved
+        if lowered:
+            self.flush(force=True)
+
+    def _mark(self):
+        """The highest id below which every update was committed (call with the lock held)."""
+        now = time.monotonic()
+        for update_id in [update_id for update_id, expires in self._open.items() if expires <= now]:
+            del self._open[update_id]
+        if not self._open:
+            return self._high
+        return max(self._floor, min(self._high, min(self._open) - 1))
+
+    def flush(self, force=False):
+        """Persists the high-water mark if it moved (down too, after a release) or if forced."""
+        with self._lock:
+            mark = self._mark()
+            if mark == self._saved and not force:
+                return
+            self._saved = mark
+            self._written = True
+        self.save_mark(mark, time.time())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._seen),
+                "high_water_mark": self._mark(),
+            }
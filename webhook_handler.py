@@ -1,15 +1,32 @@
-import os
+from __future__ import annotations
+
+import atexit
 import logging
-import json
-import sqlite3
-from datetime import datetime, time, timedelta
-
-# Import required libraries
-from telegram import Update
-from telegram.ext import (
-    Application, CommandHandler, ContextTypes, MessageHandler, filters, JobQueue
-)
-from flask import Flask, request, abort
+import os
+import threading
+import uuid
+from time import perf_counter
+from datetime import date, datetime, time, timedelta, timezone
+from typing import TYPE_CHECKING
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from flask import Flask, Response, request
+
+import metrics
+from database import AsyncDatabaseManager, DatabaseManager, resolve_db_path
+from sharding import ShardedDatabaseManager
+from timer_wheel import TimerWheel
+from update_queue import UpdateDeduplicator, UpdateQueue, decode_update, plain_group_text
+
+# PTB takes most of the import time; it is loaded by bootstrap(), not here.
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes, JobQueue
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process runs the scheduled jobs
+    fcntl = None
 
 # --- CONFIGURATION (Hardcoded for immediate deployment) ---
 # WARNING: Hardcoding your token is less secure than using environment variables.
@@ -19,8 +36,71 @@ BOT_TOKEN = "8020313173:AAG1V_ytdmVHCL7Jz0Y0MfGHgURe9G9pbnc"
 # The username is used for the log context
 USERNAME = "blueberry111" 
 
+# Overridable so the load test (loadtest.py) can run the bot offline against
+# a throw-away database and a local Bot API stub.
+DB_PATH = os.environ.get("BOT_DB_PATH", "bot_data.db")
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL")  # None = api.telegram.org
+# >1 splits storage into per-chat-hash shard files (split an existing file with reshard.py).
+DB_SHARDS = int(os.environ.get("BOT_DB_SHARDS", "1"))
+
+# Importing this module only creates the Flask app. bootstrap() runs on the
+# first webhook request (or from warm_up() in the WSGI file): it opens the DB,
+# so plain group text is stored right away, and loads PTB and the update
+# workers in the background. "0" does all of it at import instead.
+LAZY_BOOTSTRAP = os.environ.get("BOT_LAZY_BOOTSTRAP", "1") != "0"
+# Scheduled jobs run in one process: with "auto" the first process to lock
+# JOB_LOCK_PATH runs them, "1"/"0" force them on/off in this process.
+JOB_RUNNER = os.environ.get("BOT_JOB_RUNNER", "auto")
+# Next to the DB file (not the working directory), so every worker locks the same file.
+JOB_LOCK_PATH = resolve_db_path(os.environ.get("BOT_JOB_LOCK_PATH", f"{DB_PATH}.jobs.lock"))
+BOOTSTRAP_RETRY_SECONDS = 10  # Pause before loading PTB again after a failed start
+
 WEBHOOK_PATH = f"/{BOT_TOKEN}"
 WEBHOOK_URL = f"https://blueberry111.pythonanywhere.com{WEBHOOK_PATH}" 
+
+# Webhook ingestion: updates are queued and processed by async workers.
+UPDATE_WORKERS = 8           # Concurrent workers (updates of one chat stay in order)
+# Deliveries Telegram keeps in flight at once; applied by `python webhook_manager.py set`.
+WEBHOOK_MAX_CONNECTIONS = UPDATE_WORKERS
+MAX_PENDING_UPDATES = 1000   # Queued + in-flight updates before backpressure
+ENQUEUE_TIMEOUT = 2.0        # Seconds a webhook request waits for a free slot
+DEDUPE_CACHE_SIZE = 10000    # Recently seen update_ids kept for redelivery checks
+DEDUPE_TTL = 3600            # Seconds an update_id stays in that cache
+
+# Plain group text is stored straight from the webhook route, skipping PTB dispatch.
+FAST_INGEST = True
+
+# Birthday reminders go out at this local hour in each chat's timezone (/set_timezone).
+BIRTHDAY_REMINDER_HOUR = 8
+DEFAULT_TIMEZONE = None      # IANA name for chats without one (also memories); None = server local time
+
+# /search
+SEARCH_PAGE_SIZE = 5         # Results per /search page
+SEARCH_BACKFILL_BATCH = 2000 # Old messages indexed per backfill step
+
+# Memories: "random" picks any stored message; "on_this_day" picks one from
+# today's date in earlier years (nearest day within MEMORY_DAY_WINDOW days),
+# falling back to a random one for chats without such history.
+MEMORY_JOB_MODE = "on_this_day"
+MEMORY_DAY_WINDOW = 3
+# Each chat gets a memory every MEMORY_INTERVAL_HOURS at its own time (hashed
+# from chat_id, on the chat's clock: /set_timezone, else DEFAULT_TIMEZONE);
+# the scheduler wakes every MEMORY_TICK_SECONDS and sends to the chats that
+# came due, so the broadcast is spread over the interval.
+MEMORY_INTERVAL_HOURS = 6
+MEMORY_TICK_SECONDS = 60
+MEMORY_CATCH_UP_TICKS = 15   # Ticks missed while the bot was down that are still sent
+
+# Messages older than this move to the compressed archive (None = keep all in the hot table).
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_ROWS = 2000    # Messages archived per write transaction
+
+# Scheduled broadcasts (memories, birthday reminders) to many chats.
+BROADCAST_RATE = 25          # Messages per second across all chats (Telegram allows ~30)
+BROADCAST_CHAT_INTERVAL = 3  # Seconds between two messages to one group (~20/min)
+BROADCAST_CONCURRENCY = 16   # Sends in flight at once
+# One pooled HTTP client serves the update workers and the broadcasts.
+HTTP_POOL_SIZE = UPDATE_WORKERS + BROADCAST_CONCURRENCY
 # --- END CONFIGURATION ---
 
 # Set up logging for PythonAnywhere debug
@@ -28,155 +108,27 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# Counts every ERROR record for /metrics, including errors answered with a default.
+logging.getLogger().addHandler(metrics.ErrorLogCounter())
 
-# --- Database Manager ---
-
-class DatabaseManager:
-    """Handles all SQLite database operations."""
-    def __init__(self, db_path):
-        self.db_path = db_path
-        self._initialize_db()
-
-    def _initialize_db(self):
-        """Initializes the database connection and creates tables if they don't exist."""
-        try:
-            # Construct absolute path to ensure we always find the DB
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            self.db_path = os.path.join(script_dir, "bot_data.db")
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                # Stores message text and chat ID for the memory feature
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS messages (
-                        id INTEGER PRIMARY KEY,
-                        chat_id INTEGER NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        username TEXT,
-                        text TEXT NOT NULL,
-                        timestamp TEXT NOT NULL
-                    )
-                """)
-                # Stores birthdays
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS birthdays (
-                        id INTEGER PRIMARY KEY,
-                        chat_id INTEGER NOT NULL,
-                        user_id INTEGER NOT NULL UNIQUE,
-                        username TEXT,
-                        name TEXT NOT NULL,
-                        day INTEGER NOT NULL,
-                        month INTEGER NOT NULL
-                    )
-                """)
-                conn.commit()
-            logger.info(f"Database initialized at {self.db_path}")
-
-        except Exception as e:
-            logger.error(f"Failed to initialize database: {e}")
+# --- Command Handlers ---
 
-    # Data Storage Methods
-    def store_message(self, chat_id, user_id, username, text):
-        """Stores a message in the database."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO messages (chat_id, user_id, username, text, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (chat_id, user_id, username, text, datetime.now().isoformat()))
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Error storing message: {e}")
-
-    def store_birthday(self, chat_id, user_id, username, name, day, month):
-        """Stores or updates a user's birthday."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                # Use INSERT OR REPLACE to update if user_id already exists
-                cursor.execute("""
-                    INSERT OR REPLACE INTO birthdays (chat_id, user_id, username, name, day, month)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (chat_id, user_id, username, name, day, month))
-                conn.commit()
-                return True
-        except Exception as e:
-            logger.error(f"Error storing birthday: {e}")
-            return False
-
-    # Data Retrieval Methods
-    def get_random_messages(self, chat_id, limit=1):
-        """Retrieves a random message from the database for a specific chat."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT text, username, timestamp FROM messages 
-                    WHERE chat_id = ? AND text NOT LIKE '/%'
-                    ORDER BY RANDOM() LIMIT ?
-                """, (chat_id, limit))
-                return cursor.fetchall()
-        except Exception as e:
-            logger.error(f"Error retrieving random message: {e}")
-            return []
-
-    def get_birthdays_list(self, chat_id):
-        """Retrieves all stored birthdays for a specific chat, ordered by month and day."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT name, day, month FROM birthdays 
-                    WHERE chat_id = ? 
-                    ORDER BY month, day
-                """, (chat_id,))
-                return cursor.fetchall()
-        except Exception as e:
-            logger.error(f"Error retrieving birthday list: {e}")
-            return []
-
-    def get_today_birthdays(self, month, day):
-        """Retrieves birthdays matching the given day and month for all chats."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT chat_id, name, username FROM birthdays 
-                    WHERE month = ? AND day = ?
-                """, (month, day))
-                return cursor.fetchall()
-        except Exception as e:
-            logger.error(f"Error retrieving today's birthdays: {e}")
-            return []
-
-    def count_messages(self, chat_id):
-        """Counts total messages and fetches the 5 most recent for debug."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Count total messages
-                cursor.execute("SELECT COUNT(*) FROM messages WHERE chat_id = ?", (chat_id,))
-                count = cursor.fetchone()[0]
-                
-                # Fetch 5 most recent
-                cursor.execute("""
-                    SELECT text, username FROM messages 
-                    WHERE chat_id = ?
-                    ORDER BY timestamp DESC LIMIT 5
-                """, (chat_id,))
-                recent = cursor.fetchall()
-                
-                return count, recent
-        except Exception as e:
-            logger.error(f"Error counting messages: {e}")
-            return 0, []
+# Per-callback latency histograms and exception counters, exported on /metrics.
+handler_metrics = metrics.instrument(metrics.HANDLER_SECONDS, metrics.HANDLER_ERRORS)
+job_metrics = metrics.instrument(metrics.JOB_SECONDS, metrics.JOB_ERRORS)
 
-# --- Command Handlers ---
+# Handlers await DB calls; they run on a dedicated DB thread, not the event loop.
+db = None  # AsyncDatabaseManager, opened by bootstrap()
 
-db = DatabaseManager(db_path="bot_data.db")
+# Redelivered updates are dropped by update_id before they are decoded. Each
+# process saves its own high-water mark (UPDATE_MARK_KEY:WORKER_ID); a new one
+# starts from the lowest mark saved within DEDUPE_TTL, so an update another
+# worker turned away is not dropped when Telegram retries it after a restart.
+UPDATE_MARK_KEY = f"update_high_water_mark:{BOT_TOKEN.split(':')[0]}"
+WORKER_ID = uuid.uuid4().hex[:12]
+deduplicator = None  # UpdateDeduplicator, created by bootstrap()
 
+@handler_metrics
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message with instructions."""
     if update.effective_chat.type == 'private':
@@ -188,28 +140,45 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     else:
         await update.message.reply_text(
             "Hi there! I'm now active in this group. I'll silently record messages "
-            "to share memories later. Use /set_birthday to track important dates."
+            "to share memories later. Use /random for a memory (/random today for one "
+            "from this day in earlier years), /set_birthday to track important dates "
+            "and /set_timezone so reminders arrive in the morning your time."
         )
 
+@handler_metrics
 async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays memory status and latest entries for debug."""
     chat_id = update.effective_chat.id
-    total_count, recent_messages = db.count_messages(chat_id)
+    stats = await db.get_chat_stats(chat_id)
 
     response = f"📚 **Memory Status for this Chat**\n"
-    response += f"Total Messages Stored: **{total_count}**\n\n"
-    
-    if total_count > 0:
-        response += "💾 **5 Most Recent Memories:**\n"
-        for text, username in recent_messages:
+
+    if stats:
+        first = datetime.fromisoformat(stats['first_timestamp'])
+        last = datetime.fromisoformat(stats['last_timestamp'])
+        response += f"Total Messages Stored: **{stats['total']}**\n"
+        response += f"Collecting since {first.strftime('%B %d, %Y')}, last message {last.strftime('%B %d, %Y')}\n"
+        response += (
+            f"Messages per day: **{stats['per_day']:.1f}** "
+            f"({stats['last_days']} in the last {stats['days']} days)\n\n"
+        )
+
+        response += "🏆 **Top Posters:**\n"
+        for username, count in stats['top_posters']:
+            response += f"- @{username}: {count}\n"
+
+        response += "\n💾 **5 Most Recent Memories:**\n"
+        for text, username in stats['recent']:
             # Truncate text for display
             display_text = text[:40] + ('...' if len(text) > 40 else '')
             response += f"- @{username}: *{display_text}*\n"
     else:
+        response += "Total Messages Stored: **0**\n\n"
         response += "The memory database is currently empty for this chat."
 
     await update.message.reply_markdown(response)
 
+@handler_metrics
 async def set_birthday_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Starts the process of setting a birthday."""
     await update.message.reply_text(
@@ -232,16 +201,15 @@ async def handle_birthday_reply(update: Update, context: ContextTypes.DEFAULT_TY
                 # Year is ignored for birthday reminders but required for full date format
                 year = int(date_str[2])
 
-                # Basic validation
-                if not 1 <= day <= 31 or not 1 <= month <= 12:
-                    raise ValueError("Invalid day or month value")
+                # Full calendar validation: rejects 31-04, accepts 29-02 only in leap years
+                date(year, month, day)
                 
                 chat_id = update.effective_chat.id
                 user_id = update.effective_user.id
                 username = update.effective_user.username or update.effective_user.full_name
                 name = update.effective_user.full_name
 
-                if db.store_birthday(chat_id, user_id, username, name, day, month):
+                if await db.store_birthday(chat_id, user_id, username, name, day, month):
                     await update.message.reply_text(
                         f"🎉 Got it! **{name}'s** birthday is saved for **{day:02d}/{month:02d}**.",
                         parse_mode='Markdown'
@@ -254,47 +222,145 @@ async def handle_birthday_reply(update: Update, context: ContextTypes.DEFAULT_TY
                     "❌ I couldn't understand that date. Please ensure you use the **DD-MM-YYYY** format."
                 )
 
-async def view_birthdays_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Displays all stored birthdays for the current chat."""
-    chat_id = update.effective_chat.id
-    birthdays = db.get_birthdays_list(chat_id)
-
+def render_birthdays(birthdays):
+    """Formats a chat's (name, day, month) birthdays for /view_birthdays."""
     if not birthdays:
-        await update.message.reply_text("I haven't recorded any birthdays for this group yet.")
-        return
+        return None
 
     response = "🎂 **Group Birthdays (Month/Day):**\n"
     current_month = None
-    
+
     for name, day, month in birthdays:
         if month != current_month:
             current_month = month
             response += f"\n**--- {datetime(2000, month, 1).strftime('%B')} ---**\n"
-        
+
         response += f"- **{day:02d}**: {name}\n"
+    return response
+
+@handler_metrics
+async def view_birthdays_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Displays all stored birthdays for the current chat."""
+    chat_id = update.effective_chat.id
+    # Rendered once per chat and cached until its birthdays change
+    response = await db.render_birthdays(chat_id, render_birthdays)
+
+    if not response:
+        await update.message.reply_text("I haven't recorded any birthdays for this group yet.")
+        return
 
     await update.message.reply_markdown(response)
 
+@handler_metrics
+async def set_timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sets the timezone used for this chat's birthday reminders and memories."""
+    if not context.args:
+        await update.message.reply_text(
+            f"Usage: /set_timezone <Area/City>, e.g. /set_timezone Europe/Berlin. "
+            f"Reminders are sent at {BIRTHDAY_REMINDER_HOUR:02d}:00 local time."
+        )
+        return
+
+    tz_name = context.args[0]
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        await update.message.reply_text(f"❌ I don't know the timezone \"{tz_name}\".")
+        return
+
+    if await db.set_chat_timezone(update.effective_chat.id, tz_name):
+        await update.message.reply_text(
+            f"🕗 Birthday reminders for this chat will go out at "
+            f"{BIRTHDAY_REMINDER_HOUR:02d}:00 {tz_name} time, and memories "
+            f"at the same {tz_name} times every day."
+        )
+    else:
+        await update.message.reply_text("I couldn't save the timezone due to a database error.")
+
+
+def _calendar_day(day):
+    """(month, day) as the day index files it: Feb 29 counts as Feb 28."""
+    return (2, 28) if (day.month, day.day) == (2, 29) else (day.month, day.day)
+
+def years_ago(timestamp, today, window=MEMORY_DAY_WINDOW):
+    """'On this day 3 years ago' / 'Around this day 1 year ago' for an on-this-day memory.
+
+    Years count from the day within `window` days of today that the memory
+    matched, so on January 2nd a memory from December 30th of the year before
+    last is 1 year ago, not 2.
+    """
+    matched = today
+    for offset in sorted(range(-window, window + 1), key=lambda o: (abs(o), o)):
+        day = today + timedelta(days=offset)
+        if _calendar_day(day) == _calendar_day(timestamp):
+            matched = day
+            break
+    years = matched.year - timestamp.year
+    when = "On this day" if matched == today else "Around this day"
+    return f"{when} {years} year{'s' if years != 1 else ''} ago"
+
 
+@handler_metrics
 async def random_message_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Retrieves a random message from the database."""
+    """Retrieves a random message from the database (/random today: from this day in earlier years)."""
     chat_id = update.effective_chat.id
-    messages = db.get_random_messages(chat_id)
+    on_this_day = bool(context.args) and context.args[0].lower() == "today"
+    today = date.today()
+    if on_this_day:
+        messages = await db.get_day_messages(chat_id, today, window=MEMORY_DAY_WINDOW)
+    else:
+        messages = await db.get_random_messages(chat_id)
     
     if messages:
         text, username, timestamp_str = messages[0]
         timestamp = datetime.fromisoformat(timestamp_str)
+        heading = f"{years_ago(timestamp, today)}, " if on_this_day else ""
         
         reply_text = (
-            f"🕰️ {timestamp.strftime('%B %d, %Y')}:\n"
+            f"🕰️ {heading}{timestamp.strftime('%B %d, %Y')}:\n"
             f"**@{username} said:**\n"
             f"> {text}"
         )
         await update.message.reply_markdown(reply_text)
+    elif on_this_day:
+        await update.message.reply_text(
+            "No memories from around this day in earlier years yet. Try plain /random!"
+        )
     else:
         await update.message.reply_text("I haven't collected enough memories in this chat yet. Keep chatting!")
 
 
+@handler_metrics
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Searches this chat's memories: /search <terms> [page:N]."""
+    chat_id = update.effective_chat.id
+    terms = list(context.args or [])
+    page = 1
+    if terms and terms[-1].startswith("page:") and terms[-1][5:].isdigit():
+        page = max(1, int(terms.pop()[5:]))
+
+    if not terms:
+        await update.message.reply_text("Usage: /search <words> (add page:2 for more results)")
+        return
+
+    query = " ".join(terms)
+    results, has_more = await db.search_messages(chat_id, query, page=page, page_size=SEARCH_PAGE_SIZE)
+    if not results:
+        await update.message.reply_text(f"No memories found for \"{query}\".")
+        return
+
+    response = f"🔎 **Memories matching \"{query}\"** (page {page}):\n\n"
+    for text, username, timestamp_str in results:
+        timestamp = datetime.fromisoformat(timestamp_str)
+        display_text = text[:80] + ('...' if len(text) > 80 else '')
+        response += f"- {timestamp.strftime('%b %d, %Y')} @{username}: *{display_text}*\n"
+    if has_more:
+        response += f"\nMore results: /search {query} page:{page + 1}"
+
+    await update.message.reply_markdown(response)
+
+
+@handler_metrics
 async def collect_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Collects and stores messages that are not commands."""
     if update.message and update.message.text:
@@ -304,7 +370,7 @@ async def collect_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             chat_id = update.effective_chat.id
             user_id = update.effective_user.id
             username = update.effective_user.username or update.effective_user.full_name
-            db.store_message(chat_id, user_id, username, text)
+            await db.store_message(chat_id, user_id, username, text, update.message.message_id)
             # Log successful collection (optional, useful for debugging)
             # logger.info(f"Collected message in chat {chat_id}")
     
@@ -313,85 +379,152 @@ async def collect_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 # --- Scheduled Jobs ---
 
+broadcaster = None  # Broadcaster, created by start_bot()
+
+def record_broadcast(job, stats):
+    """Adds a broadcast's sent/failed/retried counts to /metrics."""
+    for result in ("sent", "failed", "retried"):
+        metrics.BROADCAST_MESSAGES.inc(job, result, amount=stats[result])
+
+@job_metrics
 async def birthday_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Sends a reminder for today's birthdays."""
-    now = datetime.now()
-    today_birthdays = db.get_today_birthdays(now.month, now.day)
-    
-    if not today_birthdays:
+    """Sends reminders to every chat where it is now the reminder hour and someone has a birthday."""
+    # Runs hourly; each chat is due once a day at BIRTHDAY_REMINDER_HOUR in its own timezone
+    birthdays_by_chat = await db.get_due_birthdays(
+        datetime.now(timezone.utc), BIRTHDAY_REMINDER_HOUR, DEFAULT_TIMEZONE
+    )
+
+    if not birthdays_by_chat:
         return
 
-    # Group birthdays by chat_id
-    birthdays_by_chat = {}
-    for chat_id, name, username in today_birthdays:
-        if chat_id not in birthdays_by_chat:
-            birthdays_by_chat[chat_id] = []
-        birthdays_by_chat[chat_id].append(name)
-        
-    for chat_id, names in birthdays_by_chat.items():
+    messages = []
+    for chat_id, names in birthdays_by_chat:
         if len(names) == 1:
             message = f"🎂 **Happy Birthday to {names[0]}!** Let's make their day special!"
         else:
             names_str = ', '.join(names)
             message = f"🎉 **It's a birthday party!** Wishing a great day to: {names_str}!"
-        
-        await context.bot.send_message(
-            chat_id=chat_id, 
-            text=message, 
-            parse_mode='Markdown'
-        )
+        messages.append((chat_id, message))
+
+    stats = await broadcaster.send_all(context.bot, messages, parse_mode='Markdown')
+    record_broadcast("birthday_reminder_job", stats)
+    logger.info(f"Birthday reminders: {stats}")
 
+memory_wheel = TimerWheel(MEMORY_INTERVAL_HOURS * 3600, MEMORY_TICK_SECONDS)
+MEMORY_TICK_KEY = "memory_wheel_tick"
+
+@job_metrics
 async def random_memory_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Sends a random message to all chats found in the database."""
-    # This retrieves all unique chat IDs that have stored messages
-    try:
-        with sqlite3.connect(db.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT chat_id FROM messages")
-            chat_ids = [row[0] for row in cursor.fetchall()]
-    except Exception as e:
-        logger.error(f"Failed to get unique chat IDs for memory job: {e}")
-        return
+    """Sends a memory to the chats whose slot in memory_wheel came up since the last tick."""
+    # Chats seen for the first time join the wheel at their hashed slot, read on their local clock.
+    memory_wheel.sync(await db.get_chat_ids(), await db.get_chat_timezones(), DEFAULT_TIMEZONE)
+
+    tick = MEMORY_TICK_SECONDS
+    # The tick boundary this run was scheduled for (+1 s so it is inside [start, end)).
+    end = round(datetime.now(timezone.utc).timestamp() / tick) * tick + 1
+    start = float(await db.get_state(MEMORY_TICK_KEY, end - tick))
+    # The last tick is persisted so a restart catches up, but only on recent ticks.
+    start = max(start, end - tick * MEMORY_CATCH_UP_TICKS)
+    chat_ids = memory_wheel.due(start, end) if end > start else []
+    await db.set_state(MEMORY_TICK_KEY, end)
+    if chat_ids:
+        await send_memories(context.bot, chat_ids)
+
+
+async def send_memories(bot, chat_ids):
+    """Sends one memory (see MEMORY_JOB_MODE) to each of chat_ids."""
+    today = date.today()
+    # Each call picks a memory for many chats in one DB pass
+    if MEMORY_JOB_MODE == "on_this_day":
+        day_memories = await db.get_day_memories(today, chat_ids, window=MEMORY_DAY_WINDOW)
+        missing = [chat_id for chat_id in chat_ids if chat_id not in day_memories]
+        memories = await db.get_random_memories(missing) if missing else {}
+    else:
+        day_memories = {}
+        memories = await db.get_random_memories(chat_ids)
 
-    for chat_id in chat_ids:
-        messages = db.get_random_messages(chat_id)
-        
-        if messages:
-            text, username, timestamp_str = messages[0]
-            timestamp = datetime.fromisoformat(timestamp_str)
-
-            reply_text = (
-                f"🌟 **Throwback Time!** A random memory from the past:\n"
-                f"**{timestamp.strftime('%B %d, %Y')}**\n"
-                f"**@{username} said:**\n"
-                f"> {text}"
-            )
-            
-            await context.bot.send_message(
-                chat_id=chat_id, 
-                text=reply_text, 
-                parse_mode='Markdown'
-            )
+    messages = []
+    for chat_id, (text, username, timestamp_str) in [*day_memories.items(), *memories.items()]:
+        timestamp = datetime.fromisoformat(timestamp_str)
+        if chat_id in day_memories:
+            heading = f"{years_ago(timestamp, today)}:"
+        else:
+            heading = "A random memory from the past:"
+
+        reply_text = (
+            f"🌟 **Throwback Time!** {heading}\n"
+            f"**{timestamp.strftime('%B %d, %Y')}**\n"
+            f"**@{username} said:**\n"
+            f"> {text}"
+        )
+        messages.append((chat_id, reply_text))
+
+    stats = await broadcaster.send_all(bot, messages, parse_mode='Markdown')
+    record_broadcast("random_memory_job", stats)
+    logger.info(f"Random memory broadcast to {len(chat_ids)} due chats: {stats}")
+
+@job_metrics
+async def search_backfill_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Indexes messages stored before /search existed, one small batch per run."""
+    remaining = await db.backfill_search_index(batch_size=SEARCH_BACKFILL_BATCH)
+    if remaining == 0:
+        logger.info("Search index backfill complete.")
+        context.job.schedule_removal()
+
+@job_metrics
+async def archive_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Moves messages older than ARCHIVE_AFTER_DAYS into the archive, one short transaction per batch."""
+    cutoff = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    total = 0
+    while True:
+        archived = await db.archive_messages(cutoff, max_rows=ARCHIVE_BATCH_ROWS)
+        total += archived
+        if archived < ARCHIVE_BATCH_ROWS:
+            break
+    if total:
+        logger.info(f"Archived {total} messages older than {cutoff:%Y-%m-%d}.")
 
 def setup_jobs(application: Application):
     """Sets up and starts the Job Queue."""
     # Ensure JobQueue runs on separate thread/process than the webhook
     job_queue: JobQueue = application.job_queue
 
-    # 1. Birthday Reminder (e.g., runs at 8:00 AM every day)
-    job_queue.run_daily(
-        birthday_reminder_job, 
-        time=time(hour=8, minute=0, second=0),
+    # 1. Birthday Reminder (hourly, at the top of the hour; each chat fires at
+    #    BIRTHDAY_REMINDER_HOUR in its own timezone)
+    next_hour = (datetime.now(timezone.utc) + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    job_queue.run_repeating(
+        birthday_reminder_job,
+        interval=timedelta(hours=1),
+        first=next_hour,
         name="Birthday Reminder"
     )
 
-    # 2. Random Memory Sender (e.g., runs every 6 hours)
+    # 2. Random Memory Sender: every chat once per MEMORY_INTERVAL_HOURS at its
+    #    own staggered time; the job ticks on MEMORY_TICK_SECONDS boundaries.
+    now = datetime.now(timezone.utc)
+    next_tick = MEMORY_TICK_SECONDS - now.timestamp() % MEMORY_TICK_SECONDS
     job_queue.run_repeating(
-        random_memory_job, 
-        interval=timedelta(hours=6), 
-        first=time(hour=9, minute=0, second=0),
+        random_memory_job,
+        interval=MEMORY_TICK_SECONDS,
+        first=next_tick,
         name="Random Memory"
     )
+
+    # 3. Search index backfill for pre-existing messages (removes itself when done)
+    job_queue.run_repeating(
+        search_backfill_job,
+        interval=timedelta(seconds=2),
+        first=timedelta(seconds=10),
+        name="Search Backfill"
+    )
+
+    # 4. Archive old messages (nightly, off-peak)
+    if ARCHIVE_AFTER_DAYS is not None:
+        job_queue.run_daily(
+            archive_job,
+            time=time(hour=4, minute=0, second=0),
+            name="Message Archive"
+        )
     logger.info("Scheduled jobs initialized.")
 
 # --- Flask Webhook Setup ---
@@ -399,52 +532,283 @@ def setup_jobs(application: Application):
 # Create the core application instance
 app = Flask(__name__)
 
-# Initialize the PTB application object
-application = Application.builder().token(BOT_TOKEN).concurrent_updates(True).build()
+# Set by bootstrap(): the PTB application and the workers feeding it webhook updates.
+application = None
+update_queue = None
+HANDLED_UPDATES = frozenset()
+is_job_runner = False
+db_ready = threading.Event()   # db and deduplicator are set
+bot_ready = threading.Event()  # application and update_queue are set
+_bootstrap_lock = threading.Lock()
+_bot_starting = False          # a start_bot() is running
+_bot_retry_at = 0.0            # perf_counter() before which a failed start is not retried
+_job_lock_file = None
+
+def build_application(job_queue=True):
+    """Builds the PTB application with every handler registered; opens nothing and starts nothing."""
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .connection_pool_size(HTTP_POOL_SIZE)
+        .pool_timeout(10.0)
+    )
+    if BOT_API_BASE_URL:
+        builder.base_url(BOT_API_BASE_URL)
+    if not job_queue:
+        builder.job_queue(None)
+    application = builder.build()
+
+    # Everything reacts to new messages only, so webhook_manager registers
+    # allowed_updates=["message"] and Telegram skips edits, member updates etc.
+    # (check with webhook_manager.allowed_updates(application)).
+    new_messages = filters.UpdateType.MESSAGE
+    application.add_handler(CommandHandler("start", start_command, filters=new_messages))
+    application.add_handler(CommandHandler("debug", debug_command, filters=new_messages))
+    application.add_handler(CommandHandler("set_birthday", set_birthday_command, filters=new_messages))
+    application.add_handler(CommandHandler("view_birthdays", view_birthdays_command, filters=new_messages))
+    application.add_handler(CommandHandler("set_timezone", set_timezone_command, filters=new_messages))
+    application.add_handler(CommandHandler("random", random_message_command, filters=new_messages))
+    application.add_handler(CommandHandler("search", search_command, filters=new_messages))
+    # collect_message stores text and reads birthday replies (text too); commands never reach it.
+    application.add_handler(MessageHandler(new_messages & filters.TEXT & ~filters.COMMAND, collect_message))
+    return application
+
+def claim_job_runner():
+    """Returns True if this process runs the scheduled jobs (see JOB_RUNNER)."""
+    global _job_lock_file
+    if JOB_RUNNER != "auto":
+        return JOB_RUNNER == "1"
+    if fcntl is None or _job_lock_file is not None:
+        return True
+    try:
+        lock_file = open(JOB_LOCK_PATH, "a")
+    except OSError as e:
+        logger.error(f"Cannot open job lock {JOB_LOCK_PATH}, not running scheduled jobs: {e}")
+        return False
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Kept open for the life of the process; the lock goes away with it.
+    _job_lock_file = lock_file
+    return True
+
+def bootstrap(background=True):
+    """Opens the DB and loads the PTB application (in a background thread by default), once per process.
+
+    A failed PTB start leaves the DB open and is retried by a later call.
+    """
+    global _bot_starting
+    if bot_ready.is_set():
+        return
+    with _bootstrap_lock:
+        if not db_ready.is_set():
+            open_db()
+        if bot_ready.is_set() or _bot_starting or perf_counter() < _bot_retry_at:
+            return
+        _bot_starting = True
+    # PTB takes most of the start-up time; plain group text does not need it.
+    if background:
+        threading.Thread(target=start_bot, name="bootstrap", daemon=True).start()
+    else:
+        start_bot()
+
+def open_db():
+    """Opens the DB and the update deduplicator (call with _bootstrap_lock held)."""
+    global db, deduplicator
+    db = AsyncDatabaseManager(
+        DatabaseManager(db_path=DB_PATH) if DB_SHARDS == 1 else ShardedDatabaseManager(DB_PATH, DB_SHARDS)
+    )
+    atexit.register(db.close)
+    deduplicator = UpdateDeduplicator(
+        load_mark=load_update_mark,
+        save_mark=lambda mark, saved_at: db.sync.set_state(
+            f"{UPDATE_MARK_KEY}:{WORKER_ID}", f"{mark} {saved_at:.0f}"
+        ),
+        max_size=DEDUPE_CACHE_SIZE,
+        ttl=DEDUPE_TTL,
+    )
+    atexit.register(deduplicator.flush)
+    db_ready.set()
 
-# Setup handlers
-application.add_handler(CommandHandler("start", start_command))
-application.add_handler(CommandHandler("debug", debug_command))
-application.add_handler(CommandHandler("set_birthday", set_birthday_command))
-application.add_handler(CommandHandler("view_birthdays", view_birthdays_command))
-application.add_handler(CommandHandler("random", random_message_command))
-application.add_handler(MessageHandler(filters.ALL, collect_message))
+def load_update_mark():
+    """(lowest mark, latest save time) of the workers' marks saved within DEDUPE_TTL, or None.
 
-# Setup scheduled jobs
-setup_jobs(application)
+    Older marks are deleted, as is the single shared mark earlier versions kept.
+    """
+    now = datetime.now(timezone.utc).timestamp()
+    marks, stale = [], [UPDATE_MARK_KEY]
+    for key, value in db.sync.get_states(f"{UPDATE_MARK_KEY}:").items():
+        try:
+            mark, saved_at = (int(part) for part in value.split())
+        except ValueError:
+            mark, saved_at = 0, 0
+        if now - saved_at < DEDUPE_TTL:
+            marks.append((mark, saved_at))
+        else:
+            stale.append(key)
+    db.sync.delete_states(stale)
+    if not marks:
+        return None
+    return min(mark for mark, _ in marks), max(saved_at for _, saved_at in marks)
+
+def start_bot():
+    """Runs load_bot(); a failure is logged and bootstrap() tries again after BOOTSTRAP_RETRY_SECONDS."""
+    global _bot_starting, _bot_retry_at
+    try:
+        load_bot()
+    except Exception as e:
+        logger.error(f"Failed to load the PTB application, retrying in {BOOTSTRAP_RETRY_SECONDS}s: {e}")
+        _bot_retry_at = perf_counter() + BOOTSTRAP_RETRY_SECONDS
+    finally:
+        with _bootstrap_lock:
+            _bot_starting = False
+
+def load_bot():
+    """Builds the PTB application, schedules the jobs if this is the job runner, starts the update workers."""
+    global broadcaster, application, update_queue, HANDLED_UPDATES, is_job_runner
+    started = perf_counter()
+    from broadcast import Broadcaster
+    from webhook_manager import allowed_updates
+
+    broadcaster = Broadcaster(
+        global_rate=BROADCAST_RATE,
+        per_chat_interval=BROADCAST_CHAT_INTERVAL,
+        concurrency=BROADCAST_CONCURRENCY,
+    )
+    # Only the job runner gets a JobQueue, so other workers start no scheduler.
+    is_job_runner = claim_job_runner()
+    application = build_application(job_queue=is_job_runner)
+    if is_job_runner:
+        setup_jobs(application)
+    # Update types no handler reacts to are acknowledged without being queued
+    # (Telegram may still deliver them until the webhook is re-registered).
+    HANDLED_UPDATES = frozenset(allowed_updates(application))
+
+    update_queue = UpdateQueue(
+        application,
+        workers=UPDATE_WORKERS,
+        max_pending=MAX_PENDING_UPDATES,
+        put_timeout=ENQUEUE_TIMEOUT,
+    )
+    update_queue.start()
+    # atexit runs in reverse order: drain the queue before the DB is closed.
+    atexit.register(update_queue.stop)
+    bot_ready.set()
+    logger.info(f"PTB application loaded in {perf_counter() - started:.2f}s (job runner: {is_job_runner}).")
+
+def warm_up():
+    """Bootstraps in the background, so a fresh worker is ready before its first webhook."""
+    threading.Thread(target=bootstrap, name="warm-up", daemon=True).start()
 
 @app.route('/')
 def index():
     """Confirms the Flask application is running."""
     return "Hello from Flask & Python-Telegram-Bot! Webhook is active."
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@metrics.REGISTRY.collector
+def ingest_metrics():
+    """Update queue, deduplicator and message buffer counters, read at scrape time."""
+    if not bot_ready.is_set():
+        return []
+    queue = update_queue.stats()
+    dedupe = deduplicator.stats()
+    samples = [
+        ("bot_update_queue_depth", "gauge", "Updates queued or being processed.",
+         queue["in_flight"]),
+        ("bot_updates_submitted_total", "counter", "Updates accepted onto the update queue.",
+         queue["submitted"]),
+        ("bot_updates_rejected_total", "counter", "Updates refused because the queue stayed full.",
+         queue["rejected"]),
+        ("bot_updates_processed_total", "counter", "Updates processed by PTB.",
+         queue["processed"]),
+        ("bot_updates_failed_total", "counter", "Updates whose processing raised.",
+         queue["failed"]),
+        ("bot_update_queue_wait_seconds_max", "gauge", "Longest time an update waited for a worker.",
+         queue["max_wait_ms"] / 1000),
+        ("bot_duplicate_updates_total", "counter", "Redelivered updates dropped by update_id.",
+         dedupe["hits"]),
+    ]
+    stats = db.sync.buffer_stats()
+    if stats is not None:
+        samples += [
+            ("bot_message_buffer_depth", "gauge", "Messages waiting for the next group commit.",
+             stats["queue_depth"]),
+            ("bot_message_buffer_rows_total", "counter", "Messages committed by the write-behind buffer.",
+             stats["flushed_rows"]),
+            ("bot_message_buffer_failed_flushes_total", "counter", "Group commits that failed.",
+             stats["failed_flushes"]),
+            ("bot_message_buffer_dropped_total", "counter", "Messages dropped after failed commits.",
+             stats["dropped"]),
+            ("bot_message_buffer_flush_seconds_max", "gauge", "Slowest group commit.",
+             stats["max_flush_ms"] / 1000),
+        ]
+    return samples
+
 @app.route(WEBHOOK_PATH, methods=["POST"])
-async def telegram_webhook_handler():
-    """Receives updates from Telegram and passes them to PTB."""
-    if request.method == "POST":
-        try:
-            # Get the JSON update from the request
-            update_data = request.get_json(force=True)
-            
-            # Process the update with the PTB application
-            update = Update.de_json(update_data, application.bot)
-            await application.process_update(update)
-            
-            return "OK"
-        except Exception as e:
-            logger.error(f"Error processing update: {e}")
-            # Return 200 OK even on internal error to avoid Telegram sending the update again
-            return "OK"
-    
-    # Telegram only sends POST requests to the webhook URL
-    abort(405)
+def telegram_webhook_handler():
+    """Receives updates from Telegram and queues them for the PTB workers."""
+    bootstrap()
+    start = perf_counter()
+    outcome, response = accept_update(request.get_data(cache=False))
+    metrics.WEBHOOK_SECONDS.observe(perf_counter() - start, outcome)
+    return response
+
+def accept_update(body):
+    """Dedupes and stores or queues one raw update; returns (outcome, Flask response)."""
+    update_data = decode_update(body)
+    if update_data is None:
+        logger.error("Rejected webhook request without a valid update payload.")
+        return "invalid", ("Bad Request", 400)
+
+    # Plain group text only needs the DB; everything else waits for PTB after a cold start.
+    fields = plain_group_text(update_data) if FAST_INGEST else None
+    if fields is None:
+        if not bot_ready.wait(ENQUEUE_TIMEOUT):
+            logger.error(f"Bot still starting, deferring update {update_data['update_id']}.")
+            return "busy", ("Busy", 503)
+        if not HANDLED_UPDATES.intersection(update_data):
+            return "ignored", "OK"
+
+    update_id = update_data["update_id"]
+    if not deduplicator.claim(update_id):
+        # Already accepted once; acknowledge so Telegram stops redelivering it.
+        return "duplicate", "OK"
+
+    if fields is not None:
+        # Nothing but collect_message would see it: store it directly.
+        db.sync.store_message(*fields)
+        deduplicator.commit(update_id)
+        return "stored", "OK"
+
+    if not update_queue.submit(update_data):
+        # Queue stayed full: a non-2xx makes Telegram back off and redeliver later.
+        deduplicator.release(update_id)
+        logger.error(f"Update queue full, deferring update {update_id}.")
+        return "busy", ("Busy", 503)
+
+    deduplicator.commit(update_id)
+    # Acknowledge right away; processing happens on the update queue workers.
+    return "queued", "OK"
 
 
 # This function is called by the WSGI file to run the app
 def run():
     """The function that starts the application (called by WSGI)."""
-    # The application is already built and handlers added above.
-    # The Flask app 'app' is the entry point used by PythonAnywhere.
-    logger.info("Flask/PTB application initialized and ready to receive webhooks.")
+    # The Flask app 'app' is the entry point used by PythonAnywhere. With
+    # LAZY_BOOTSTRAP the PTB application is built on the first webhook request;
+    # the WSGI file can call warm_up() to start that right away instead.
+    if not LAZY_BOOTSTRAP:
+        bootstrap(background=False)
+    logger.info("Flask application ready to receive webhooks.")
 
 run()
@@ -0,0 +1,280 @@
+"""Registers and inspects the bot's Telegram webhook.
+
+    python webhook_manager.py set [--drop-pending-updates]
+    python webhook_manager.py info
+    python webhook_manager.py watch --interval 10
+    python webhook_manager.py delete
+
+`set` registers WEBHOOK_URL with allowed_updates computed from the handlers
+of webhook_handler.build_application(), so Telegram never sends update types
+nothing here would handle (edits, member changes, ...), and with
+max_connections capped at WEBHOOK_MAX_CONNECTIONS. `info` shows the registered webhook and
+where it differs from that; `watch` samples pending_update_count to show
+whether a backlog is growing or draining. Set BOT_API_BASE_URL to run any of
+them against a local Bot API stub (stub_bot.py).
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from collections import deque
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import ChatMemberHandler, ConversationHandler, filters
+from telegram.ext import (
+    CallbackQueryHandler, ChatJoinRequestHandler, ChosenInlineResultHandler, InlineQueryHandler,
+    PollAnswerHandler, PollHandler, PreCheckoutQueryHandler, ShippingQueryHandler,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- allowed_updates from registered handlers ---
+
+# Filter-based handlers (MessageHandler, CommandHandler, ...) only ever see these.
+MESSAGE_TYPES = (Update.MESSAGE, Update.EDITED_MESSAGE, Update.CHANNEL_POST, Update.EDITED_CHANNEL_POST)
+
+UPDATE_TYPE_FILTERS = {
+    filters.UpdateType.MESSAGE: {Update.MESSAGE},
+    filters.UpdateType.EDITED_MESSAGE: {Update.EDITED_MESSAGE},
+    filters.UpdateType.MESSAGES: {Update.MESSAGE, Update.EDITED_MESSAGE},
+    filters.UpdateType.CHANNEL_POST: {Update.CHANNEL_POST},
+    filters.UpdateType.EDITED_CHANNEL_POST: {Update.EDITED_CHANNEL_POST},
+    filters.UpdateType.CHANNEL_POSTS: {Update.CHANNEL_POST, Update.EDITED_CHANNEL_POST},
+    filters.UpdateType.EDITED: {Update.EDITED_MESSAGE, Update.EDITED_CHANNEL_POST},
+}
+
+HANDLER_TYPES = {
+    CallbackQueryHandler: (Update.CALLBACK_QUERY,),
+    ChatJoinRequestHandler: (Update.CHAT_JOIN_REQUEST,),
+    ChosenInlineResultHandler: (Update.CHOSEN_INLINE_RESULT,),
+    InlineQueryHandler: (Update.INLINE_QUERY,),
+    PollAnswerHandler: (Update.POLL_ANSWER,),
+    PollHandler: (Update.POLL,),
+    PreCheckoutQueryHandler: (Update.PRE_CHECKOUT_QUERY,),
+    ShippingQueryHandler: (Update.SHIPPING_QUERY,),
+}
+
+
+def _accepts(update_filter, update_type):
+    """Whether update_filter can pass an update of update_type: True, False or None (depends on content)."""
+    known = UPDATE_TYPE_FILTERS.get(update_filter)
+    if known is not None:
+        return update_type in known
+    # PTB's combined filters (a & b, a | b, a ^ b, ~a); anything else is decided by content.
+    if isinstance(update_filter, filters._InvertedFilter):
+        inner = _accepts(update_filter.inv_filter, update_type)
+        return None if inner is None else not inner
+    if isinstance(update_filter, filters._MergedFilter):
+        left = _accepts(update_filter.base_filter, update_type)
+        if update_filter.and_filter is not None:
+            right = _accepts(update_filter.and_filter, update_type)
+            if left is False or right is False:
+                return False
+            return True if left and right else None
+        right = _accepts(update_filter.or_filter, update_type)
+        if left or right:
+            return True
+        return False if left is False and right is False else None
+    if isinstance(update_filter, filters._XORFilter):
+        left = _accepts(update_filter.base_filter, update_type)
+        right = _accepts(update_filter.xor_filter, update_type)
+        return None if left is None or right is None else left != right
+    return None
+
+
+def handler_update_types(handler):
+    """The update types handler can react to (all of them if it is not recognised)."""
+    if isinstance(handler, ConversationHandler):
+        nested = [*handler.entry_points, *handler.fallbacks]
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        return set().union(*(handler_update_types(h) for h in nested))
+    if isinstance(handler, ChatMemberHandler):
+        return {
+            ChatMemberHandler.MY_CHAT_MEMBER: {Update.MY_CHAT_MEMBER},
+            ChatMemberHandler.CHAT_MEMBER: {Update.CHAT_MEMBER},
+        }.get(handler.chat_member_types, {Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER})
+    for handler_class, update_types in HANDLER_TYPES.items():
+        if isinstance(handler, handler_class):
+            return set(update_types)
+    if isinstance(getattr(handler, "filters", None), filters.BaseFilter):
+        return {t for t in MESSAGE_TYPES if _accepts(handler.filters, t) is not False}
+    logger.warning(f"Cannot tell which updates {type(handler).__name__} handles; requesting all of them.")
+    return set(Update.ALL_TYPES)
+
+
+def allowed_updates(application):
+    """Update types any handler registered on application can react to, in Bot API order."""
+    wanted = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wanted |= handler_update_types(handler)
+    return [str(update_type) for update_type in Update.ALL_TYPES if update_type in wanted]
+
+# --- Webhook calls ---
+
+
+class BacklogTrend:
+    """Recent pending_update_count samples and how fast the backlog changes."""
+
+    def __init__(self, window=30):
+        self.samples = deque(maxlen=window)
+
+    def add(self, pending, at=None):
+        self.samples.append((time.monotonic() if at is None else at, pending))
+
+    def rate(self):
+        """Backlog change in updates per minute (least-squares slope), None before two samples."""
+        if len(self.samples) < 2:
+            return None
+        n = len(self.samples)
+        mean_t = sum(t for t, _ in self.samples) / n
+        mean_p = sum(p for _, p in self.samples) / n
+        spread = sum((t - mean_t) ** 2 for t, _ in self.samples)
+        if not spread:
+            return None
+        slope = sum((t - mean_t) * (p - mean_p) for t, p in self.samples) / spread
+        return slope * 60
+
+    def drain_minutes(self):
+        """Minutes until the backlog is empty at the current rate, None if it is not shrinking."""
+        rate = self.rate()
+        if rate is None or rate >= 0:
+            return None
+        return self.samples[-1][1] / -rate
+
+
+async def set_webhook(bot, url, updates, max_connections, drop_pending_updates=False):
+    """Registers url for updates; returns True on success."""
+    try:
+        ok = await bot.set_webhook(
+            url,
+            max_connections=max_connections,
+            allowed_updates=updates,
+            drop_pending_updates=drop_pending_updates,
+        )
+        logger.info(f"Webhook set for {updates} with max_connections={max_connections}: {ok}")
+        return ok
+    except TelegramError as e:
+        logger.error(f"Could not set webhook: {e}")
+        return False
+
+
+def config_drift(info, url, updates, max_connections):
+    """Human-readable differences between the registered webhook and the wanted one."""
+    drift = []
+    if info.url != url:
+        drift.append(f"url is {info.url or '(none)'}, want {url}")
+    # Telegram omits allowed_updates while it still is the default (all but chat_member).
+    registered = list(info.allowed_updates or ())
+    if sorted(registered) != sorted(updates):
+        drift.append(f"allowed_updates is {registered or '(default)'}, want {updates}")
+    if info.max_connections is not None and info.max_connections != max_connections:
+        drift.append(f"max_connections is {info.max_connections}, want {max_connections}")
+    return drift
+
+
+def format_info(info):
+    lines = [
+        f"URL: {info.url or '(none)'}",
+        f"Pending updates: {info.pending_update_count}",
+        f"Allowed updates: {list(info.allowed_updates) if info.allowed_updates else '(default)'}",
+        f"Max connections: {info.max_connections if info.max_connections is not None else '(default)'}",
+    ]
+    if info.last_error_date:
+        lines.append(f"Last error: {info.last_error_message} at {info.last_error_date:%Y-%m-%d %H:%M:%S}")
+    return "\n".join(lines)
+
+
+async def watch_backlog(bot, interval, count=0):
+    """Prints pending_update_count every interval seconds with its trend (count=0 runs until stopped)."""
+    trend = BacklogTrend()
+    sample = 0
+    while not count or sample < count:
+        if sample:
+            await asyncio.sleep(interval)
+        sample += 1
+        try:
+            info = await bot.get_webhook_info()
+        except TelegramError as e:
+            logger.error(f"getWebhookInfo failed: {e}")
+            continue
+        trend.add(info.pending_update_count)
+        rate, drain = trend.rate(), trend.drain_minutes()
+        line = f"{time.strftime('%H:%M:%S')} pending {info.pending_update_count:>7}"
+        if rate is not None:
+            line += f"   {rate:+9.1f}/min"
+        if drain is not None:
+            line += f"   empty in ~{drain:.0f} min"
+        if info.last_error_message:
+            line += f"   last error: {info.last_error_message}"
+        print(line, flush=True)
+    return trend
+
+# --- CLI ---
+
+
+async def run(args):
+    # Only builds the handlers: no database, update workers or jobs are started.
+    import webhook_handler as wh
+
+    bot = Bot(wh.BOT_TOKEN, base_url=wh.BOT_API_BASE_URL or "https://api.telegram.org/bot")
+    updates = allowed_updates(wh.build_application(job_queue=False))
+    url = getattr(args, "url", None) or wh.WEBHOOK_URL
+    max_connections = getattr(args, "max_connections", None) or wh.WEBHOOK_MAX_CONNECTIONS
+    async with bot:
+        if args.command == "set":
+            ok = await set_webhook(bot, url, updates, max_connections, args.drop_pending_updates)
+            print(format_info(await bot.get_webhook_info()))
+            return 0 if ok else 1
+        if args.command == "delete":
+            ok = await bot.delete_webhook(drop_pending_updates=args.drop_pending_updates)
+            print("Webhook deleted." if ok else "Could not delete the webhook.")
+            return 0 if ok else 1
+        if args.command == "watch":
+            await watch_backlog(bot, args.interval, args.count)
+            return 0
+        info = await bot.get_webhook_info()
+        print(format_info(info))
+        drift = config_drift(info, url, updates, max_connections)
+        for line in drift:
+            print(f"DRIFT: {line}")
+        if drift:
+            print("Run `python webhook_manager.py set` to apply the wanted configuration.")
+        return 1 if drift else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("set", help="Register the webhook with allowed_updates from the handlers.")
+    p.add_argument("--drop-pending-updates", action="store_true",
+                   help="Discard the updates Telegram has queued for the bot.")
+    p.add_argument("--url", help="Webhook URL (default: WEBHOOK_URL).")
+    p.add_argument("--max-connections", type=int,
+                   help="Parallel deliveries (default: WEBHOOK_MAX_CONNECTIONS).")
+
+    p = subparsers.add_parser("info", help="Show the registered webhook and its drift from the wanted one.")
+    p.add_argument("--url", help="Expected webhook URL (default: WEBHOOK_URL).")
+    p.add_argument("--max-connections", type=int, help="Expected max_connections.")
+
+    p = subparsers.add_parser("watch", help="Sample pending_update_count and show the backlog trend.")
+    p.add_argument("--interval", type=float, default=10.0, help="Seconds between samples.")
+    p.add_argument("--count", type=int, default=0, help="Samples to take (0 = until interrupted).")
+
+    p = subparsers.add_parser("delete", help="Remove the webhook.")
+    p.add_argument("--drop-pending-updates", action="store_true",
+                   help="Discard the updates Telegram has queued for the bot.")
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.WARNING
+    )
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()